@@ -43,9 +43,13 @@ INSTALLED_APPS = [
     'apps.loans',
     'apps.dashboard',
     'apps.newsletter',
+    'apps.jobs',
 ]
 
 MIDDLEWARE = [
+    'apps.dashboard.middleware.MetricsMiddleware',
+    'apps.dashboard.middleware.ProfilingMiddleware',
+    'apps.dashboard.middleware.DuplicateQueryMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -67,6 +71,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'apps.dashboard.context_processors.notifications',
             ],
         },
     },
@@ -82,10 +87,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: los lectores no bloquean al que escribe y un COMMIT no espera el fsync
+            # (synchronous=NORMAL sólo sincroniza en los checkpoints). Sin esto cada
+            # préstamo del mostrador tarda ~40 ms sólo en el COMMIT
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            # Toma el lock de escritura al empezar la transacción: dos mostradores
+            # simultáneos esperan su turno en vez de fallar con "database is locked".
+            # Va para todas las transacciones porque todos los atomic() del proyecto
+            # escriben, y casi todos leen antes (set_status, la cola de espera, el
+            # inventario, los jobs): en una transacción DEFERRED, SQLite no espera el
+            # timeout al pasar de lectura a escritura sino que falla en el acto. Las
+            # consultas sueltas fuera de atomic() (autocommit) no toman este lock
+            'transaction_mode': 'IMMEDIATE',
+        },
     }
 }
 AUTH_USER_MODEL = 'users.User'
 
+# Cantidades de no leídas y versiones de los canales de eventos. Con más de un
+# proceso web conviene un cache compartido (Redis o Memcached) para que todos vean lo mismo
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -114,11 +142,86 @@ EMAIL_HOST_PASSWORD = 'la pass no sirve mas'  # La contraseña de 16 caracteres
 DEFAULT_FROM_EMAIL = 'Biblioteca de la Solidaridad <mercedesmarighetti@gmail.com>'
 SERVER_EMAIL = 'mercedesmarighetti@gmail.com'
 
+# URL pública del sitio, para los links absolutos de los emails
+SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')
+
 # Configuración adicional para newsletters
 NEWSLETTER_CONFIG = {
     'SENDER_NAME': 'Biblioteca de la Solidaridad',
     'REPLY_TO': 'mercedesmarighetti@gmail.com',
-    'BATCH_SIZE': 50,  # Número de emails por lote
+    'BATCH_SIZE': 50,  # Número de emails por lote (y por conexión SMTP)
+    'WORKERS': 4,  # Hilos de envío, cada uno con su conexión SMTP
+    'RATE_LIMIT': 20,  # Emails por segundo entre todos los hilos (cuota del proveedor); None = sin límite
+    'BACKOFF_SECONDS': 2,  # Espera inicial ante una respuesta 4xx, se duplica en cada reintento
+    'MAX_BACKOFF_SECONDS': 60,
+    'TRACKING_FLUSH_INTERVAL': 5,  # Segundos entre escrituras de aperturas y clics acumulados
+    'TRACKING_MAX_PENDING': 5000,  # O antes, si se acumulan estos eventos
+}
+
+# Tareas en segundo plano: las encolan los requests y las ejecuta `manage.py run_jobs`
+JOBS_CONFIG = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,  # Espera antes del primer reintento, se duplica en cada uno
+    'MAX_BACKOFF_SECONDS': 3600,
+    # Una tarea tomada hace más que esto es de un worker caído (las largas lo renuevan con heartbeat())
+    'CLAIM_TIMEOUT_SECONDS': 600,
+    'BATCH_SIZE': 10,
+    'POLL_INTERVAL': 2,  # Segundos entre consultas con la cola vacía
+}
+
+# Proceso único de tareas periódicas (`manage.py run_scheduler`), intervalos en segundos
+SCHEDULER_CONFIG = {
+    'CAMPAIGN_CHECK_INTERVAL': 30,  # Cada cuánto busca campañas nuevas o reprogramadas
+    'SWEEP_OVERDUE_INTERVAL': 3600,
+    'DUE_REMINDER_INTERVAL': 86400,
+    'DASHBOARD_ROLLUP_INTERVAL': 300,
+}
+
+# Recordatorio a los socios cuyos préstamos vencen dentro de DUE_REMINDER_DAYS días
+LOANS_CONFIG = {
+    'DUE_REMINDER_DAYS': 3,
+    # Puntaje mínimo de cada nivel de prioridad de la lista de espera (el resto va al último)
+    'HOLD_PRIORITY_SCORES': (4.5, 3.0),
+}
+
+# El tablero usa el resumen del scheduler mientras tenga menos de ROLLUP_MAX_AGE segundos
+DASHBOARD_CONFIG = {
+    'ROLLUP_MAX_AGE': 900,
+    # Segundos que vive en el cache la cantidad de notificaciones no leídas de cada usuario
+    'UNREAD_CACHE_TIMEOUT': 3600,
+}
+
+# Novedades en vivo (server-sent events bajo ASGI, polling condicional si no)
+EVENTS_CONFIG = {
+    'KEEPALIVE': 15,
+    'MAX_DURATION': 300,
+    'QUEUE_SIZE': 100,
+    'POLL_INTERVAL': 20,
+}
+
+# Perfilado de requests: header Server-Timing y volcados de cProfile de requests lentos.
+# Apagado salvo PROFILING_ENABLED=True: el header expone cantidad y tiempos de las consultas
+PROFILING_CONFIG = {
+    'ENABLED': os.getenv('PROFILING_ENABLED', 'False') == 'True',
+    'SAMPLE_RATE': float(os.getenv('PROFILING_SAMPLE_RATE', '0')),  # Fracción de requests con cProfile
+    'SLOW_REQUEST_MS': 500,  # Sólo se guardan los volcados de requests más lentos que esto
+    'DUMP_DIR': BASE_DIR / 'profiles',
+}
+
+# Métricas en /metrics. Con varios workers, MULTIPROCESS_DIR debe apuntar a un
+# directorio local de la máquina que se vacía en cada deploy (cada proceso escribe
+# su archivo; los gauges de procesos que ya no existen se ignoran por pid)
+METRICS_CONFIG = {
+    'ENABLED': os.getenv('METRICS_ENABLED', 'True') == 'True',
+    'MULTIPROCESS_DIR': os.getenv('METRICS_MULTIPROCESS_DIR'),
+    'FLUSH_INTERVAL': 5,  # Segundos entre volcados del proceso al directorio compartido
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+}
+
+# Detector de consultas repetidas (N+1): sólo en desarrollo, registra un warning por request
+QUERYCHECK_CONFIG = {
+    'ENABLED': DEBUG,
+    'THRESHOLD': 3,  # Repeticiones de una misma forma de consulta a partir de las que se avisa
 }
 
 # Internationalization
@@ -19,6 +19,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from apps.users import views as user_views
+from apps.dashboard.views import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -30,6 +31,7 @@ urlpatterns = [
     path('loans/', include('apps.loans.urls')),
     path('dashboard/', include('apps.dashboard.urls')),
     path('newsletter/', include('apps.newsletter.urls')),
+    path('metrics', metrics_view, name='metrics'),
 
     # Autenticación
     path('accounts/login/', user_views.CustomLoginView.as_view(), name='login'),
@@ -1,8 +1,18 @@
 from django.contrib import admin
+from apps.loans.holds import HoldService
 from .models import Book, Category, BookStock, Review, Favorite
 
+
+class BookStockAdmin(admin.ModelAdmin):
+    def save_model(self, request, obj, form, change):
+        """Un ejemplar que queda disponible desde el admin pasa por la lista de espera de su libro"""
+        super().save_model(request, obj, form, change)
+        if obj.status == 'available' and 'status' in form.changed_data:
+            HoldService.shelve([(obj.pk, obj.book_id)])
+
+
 admin.site.register(Book)
 admin.site.register(Category)
-admin.site.register(BookStock)
+admin.site.register(BookStock, BookStockAdmin)
 admin.site.register(Review)
 admin.site.register(Favorite)
\ No newline at end of file
@@ -1,5 +1,7 @@
 from django import forms
-from .models import Book, Category
+from django.db import transaction
+from apps.loans.holds import HoldService
+from .models import Book, BookStock, Category
 
 class BookForm(forms.ModelForm):
     # Campos personalizados para manejar la conversión de datos
@@ -22,6 +24,17 @@ class BookForm(forms.ModelForm):
         })
     )
     
+    # Cantidad de ejemplares (BookStock) a dar de alta con el libro
+    copies = forms.IntegerField(
+        label="Ejemplares",
+        initial=1,
+        help_text="Número de copias físicas; cada una recibe su propio código",
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control',
+            'min': '0',
+        })
+    )
+
     categories = forms.ModelMultipleChoiceField(
         queryset=Category.objects.all(),
         widget=forms.SelectMultiple(attrs={'class': 'form-control'}),
@@ -32,7 +45,7 @@ class BookForm(forms.ModelForm):
         model = Book
         fields = [
             'title', 'authors_input', 'isbn_input', 'publish_date', 
-            'number_of_pages', 'cover_url', 'categories', 'stock', 'available'
+            'number_of_pages', 'cover_url', 'categories', 'copies'
         ]
         widgets = {
             'title': forms.TextInput(attrs={
@@ -51,25 +64,11 @@ class BookForm(forms.ModelForm):
                 'class': 'form-control',
                 'placeholder': 'https://ejemplo.com/portada.jpg'
             }),
-            'stock': forms.NumberInput(attrs={
-                'class': 'form-control',
-                'min': '0',
-                'value': '1'
-            }),
-            'available': forms.CheckboxInput(attrs={
-                'class': 'form-check-input', 
-            })
         }
         labels = {
             'publish_date': 'Año de Publicación',
             'number_of_pages': 'Número de Páginas',
             'cover_url': 'URL de Portada',
-            'stock': 'Cantidad en Stock',
-            'available': 'Disponible para Préstamo'
-        }
-        help_texts = {
-            'stock': 'Número total de copias disponibles',
-            'available': 'Si está marcado, el libro estará disponible para préstamo'
         }
 
     def __init__(self, *args, **kwargs):
@@ -109,12 +108,12 @@ class BookForm(forms.ModelForm):
         isbn_list = [isbn.strip() for isbn in isbn_str.split(',') if isbn.strip()]
         return isbn_list
 
-    def clean_stock(self):
-        """Valida que el stock no sea negativo"""
-        stock = self.cleaned_data.get('stock', 0)
-        if stock < 0:
-            raise forms.ValidationError("El stock no puede ser negativo")
-        return stock
+    def clean_copies(self):
+        """Valida que la cantidad de ejemplares no sea negativa"""
+        copies = self.cleaned_data.get('copies') or 0
+        if copies < 0:
+            raise forms.ValidationError("La cantidad de ejemplares no puede ser negativa")
+        return copies
 
     def clean_number_of_pages(self):
         """Valida que el número de páginas sea positivo"""
@@ -135,5 +134,24 @@ class BookForm(forms.ModelForm):
         if commit:
             instance.save()
             self.save_m2m()  # Para guardar las relaciones ManyToMany (categorías)
+            self.save_copies()
         
-        return instance
\ No newline at end of file
+        return instance
+
+    def save_copies(self):
+        """
+        Da de alta los ejemplares del libro ya guardado con código BS-<libro>-<n>;
+        pasan por la lista de espera del libro (HoldService.shelve), así los que
+        hagan falta quedan apartados y el resto disponibles. La numeración sigue al mayor <n> existente (no a la
+        cantidad de ejemplares), así no choca con códigos de ejemplares dados de baja.
+        """
+        book = self.instance
+        prefix = f'BS-{book.pk:07d}-'
+        used = BookStock.objects.filter(physical_id__startswith=prefix).values_list('physical_id', flat=True)
+        first = max((int(code[len(prefix):]) for code in used if code[len(prefix):].isdigit()), default=0) + 1
+        with transaction.atomic():
+            copies = BookStock.objects.bulk_create(
+                BookStock(book=book, physical_id=f'BS-{book.pk:07d}-{n}', status='available')
+                for n in range(first, first + self.cleaned_data['copies'])
+            )
+            HoldService.shelve([(copy.pk, book.pk) for copy in copies])
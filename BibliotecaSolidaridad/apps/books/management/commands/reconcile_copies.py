@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.books.models import Book
+
+class Command(BaseCommand):
+    help = 'Recalcula los ejemplares totales y disponibles de cada libro a partir de la tabla de ejemplares'
+
+    def handle(self, *args, **options):
+        fixed = Book.objects.sync_copies()
+        self.stdout.write(self.style.SUCCESS(f'Libros corregidos: {fixed}'))
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:38
+
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+# Libros por tramo al crear los ejemplares
+MIGRATION_CHUNK_SIZE = 500
+
+
+def copies_from_stock(apps, schema_editor):
+    """
+    Los libros sin ejemplares cargados reciben `stock` ejemplares: tantos
+    prestados como préstamos abiertos tengan (y cada préstamo queda apuntando
+    a su ejemplar, así la devolución lo libera) y el resto disponibles.
+    Después se calculan los contadores de todos.
+    """
+    Book = apps.get_model('books', 'Book')
+    BookStock = apps.get_model('books', 'BookStock')
+    Loan = apps.get_model('loans', 'Loan')
+    without_copies = Book.objects.filter(stock__gt=0).exclude(
+        pk__in=BookStock.objects.values('book_id')
+    ).order_by('pk').values_list('pk', 'stock')
+
+    def create(books):
+        open_loans = defaultdict(list)
+        for loan in Loan.objects.filter(
+            book_id__in=[book_id for book_id, _ in books], status__in=('active', 'overdue'), copy__isnull=True,
+        ).order_by('loan_date', 'pk'):
+            open_loans[loan.book_id].append(loan)
+
+        copies, lent = [], []
+        for book_id, stock in books:
+            loans = open_loans[book_id][:stock]
+            for n in range(1, stock + 1):
+                copies.append(BookStock(
+                    book_id=book_id,
+                    physical_id=f'BS-{book_id:07d}-{n}',
+                    status='borrowed' if n <= len(loans) else 'available',
+                ))
+            lent.extend(zip(loans, copies[len(copies) - stock:]))
+        BookStock.objects.bulk_create(copies)
+        for loan, copy in lent:
+            loan.copy_id = copy.pk
+        Loan.objects.bulk_update([loan for loan, _ in lent], ['copy'])
+
+    last_pk = 0
+    while books := list(without_copies.filter(pk__gt=last_pk)[:MIGRATION_CHUNK_SIZE]):
+        create(books)
+        last_pk = books[-1][0]
+
+    def copies(**filters):
+        return Coalesce(Subquery(
+            BookStock.objects.filter(book=OuterRef('pk'), **filters)
+            .order_by()
+            .values('book')
+            .annotate(total=Count('id'))
+            .values('total')
+        ), 0)
+
+    Book.objects.update(total_copies=copies(), available_copies=copies(status='available'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_alter_book_openlibrary_id'),
+        ('loans', '0007_loan_copy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(copies_from_stock, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='book',
+            name='available',
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='stock',
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['available_copies'], name='books_available_copies_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_book_copy_counters'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bookstock',
+            name='status',
+            field=models.CharField(choices=[('available', 'Disponible'), ('borrowed', 'Prestado'), ('maintenance', 'En Mantenimiento'), ('lost', 'Perdido'), ('reserved', 'Reservado')], max_length=20),
+        ),
+    ]
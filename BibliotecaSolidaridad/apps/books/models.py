@@ -1,9 +1,14 @@
-from django.db import models
+from collections import Counter, defaultdict
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
-from django.db.models import Count, Q
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 
 User = get_user_model()
 
+# Cantidad de ids por sentencia UPDATE ... WHERE id IN (...)
+UPDATE_CHUNK_SIZE = 500
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
@@ -20,10 +25,34 @@ class Category(models.Model):
 
 class BookQuerySet(models.QuerySet):
     def recommended(self):
-        return self.filter(stock__gt=0).order_by('-created_at')[:8]
+        return (
+            self.filter(available_copies__gt=0)
+            .prefetch_related('categories')
+            .order_by('-created_at')[:8]
+        )
 
     def total_available(self):
-        return self.filter(stock__gt=0).count()
+        return self.filter(available_copies__gt=0).count()
+
+    def sync_copies(self):
+        """
+        Recalcula `total_copies` y `available_copies` a partir de BookStock con
+        un único UPDATE sobre los libros desfasados. Devuelve cuántos corrigió.
+        """
+        def copies(**filters):
+            return Coalesce(Subquery(
+                BookStock.objects.filter(book=OuterRef('pk'), **filters)
+                .order_by()
+                .values('book')
+                .annotate(total=Count('id'))
+                .values('total')
+            ), 0)
+
+        return (
+            self.annotate(actual_total=copies(), actual_available=copies(status='available'))
+            .exclude(total_copies=F('actual_total'), available_copies=F('actual_available'))
+            .update(total_copies=copies(), available_copies=copies(status='available'))
+        )
 
     def featured_authors(self):
         return (
@@ -56,8 +85,10 @@ class Book(models.Model):
     number_of_pages = models.IntegerField(blank=True, null=True)
     cover_url = models.URLField(blank=True)
     categories = models.ManyToManyField(Category, related_name='libros')
-    stock = models.IntegerField(default=0)
-    available = models.BooleanField(default=True)
+    # Contadores de los ejemplares (BookStock) del libro. Los mantienen las
+    # transiciones de BookStock en la misma transacción; ver BookStockQuerySet
+    total_copies = models.PositiveIntegerField(default=0, editable=False)
+    available_copies = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     objects = BookQuerySet.as_manager()
@@ -66,10 +97,77 @@ class Book(models.Model):
         db_table = 'books'
         verbose_name = 'Libro'
         verbose_name_plural = 'Libros'
+        indexes = [
+            models.Index(fields=['available_copies'], name='books_available_copies_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def is_available(self):
+        return self.available_copies > 0
+
+
+def _shift_counters(field, deltas):
+    """
+    Suma a `field` el delta de cada libro. Los libros se agrupan por delta, así
+    cada grupo se resuelve con un UPDATE ... WHERE id IN (...)
+    """
+    by_delta = defaultdict(list)
+    for book_id, delta in deltas.items():
+        if delta:
+            by_delta[delta].append(book_id)
+    for delta, book_ids in by_delta.items():
+        for i in range(0, len(book_ids), UPDATE_CHUNK_SIZE):
+            Book.objects.filter(pk__in=book_ids[i:i + UPDATE_CHUNK_SIZE]).update(**{field: F(field) + delta})
+
+
+class BookStockQuerySet(models.QuerySet):
+    """
+    Los cambios de estado y las altas de ejemplares pasan por acá, que ajusta
+    los contadores de Book en la misma transacción. Un UPDATE directo sobre
+    BookStock los desfasa hasta el próximo `manage.py reconcile_copies`.
+    """
+
+    def set_status(self, status):
+        """
+        Pasa estos ejemplares a `status`. Cada libro suma o resta sus
+        disponibles según el estado anterior de cada ejemplar. Combinado con un
+        filtro por estado es un cambio condicional:
+        filter(pk=..., status='available').set_status('borrowed') devuelve 0 si
+        otro mostrador se lo llevó antes. Devuelve cuántos ejemplares cambiaron.
+        """
+        with transaction.atomic():
+            rows = list(self.exclude(status=status).select_for_update().values_list('pk', 'book_id', 'status'))
+            if not rows:
+                return 0
+            pks = [pk for pk, _, _ in rows]
+            for i in range(0, len(pks), UPDATE_CHUNK_SIZE):
+                BookStock.objects.filter(pk__in=pks[i:i + UPDATE_CHUNK_SIZE]).update(status=status)
+            deltas = Counter()
+            for _, book_id, previous in rows:
+                deltas[book_id] += (status == 'available') - (previous == 'available')
+            _shift_counters('available_copies', deltas)
+        return len(rows)
+
+    def lend_one(self, book):
+        """Pasa a prestado un ejemplar disponible del libro. Devuelve el ejemplar, o None si no queda ninguno."""
+        for copy in self.filter(book=book, status='available').order_by('pk')[:3]:
+            if BookStock.objects.filter(pk=copy.pk, status='available').set_status('borrowed'):
+                copy.status = 'borrowed'
+                return copy
+        return None
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Alta masiva: después de insertar recalcula los contadores de los libros afectados"""
+        with transaction.atomic():
+            objs = super().bulk_create(objs, *args, **kwargs)
+            book_ids = list({copy.book_id for copy in objs})
+            for i in range(0, len(book_ids), UPDATE_CHUNK_SIZE):
+                Book.objects.filter(pk__in=book_ids[i:i + UPDATE_CHUNK_SIZE]).sync_copies()
+        return objs
+
 
 class BookStock(models.Model):
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
@@ -78,10 +176,14 @@ class BookStock(models.Model):
         ('available', 'Disponible'),
         ('borrowed', 'Prestado'),
         ('maintenance', 'En Mantenimiento'),
-        ('lost', 'Perdido')
+        ('lost', 'Perdido'),
+        ('reserved', 'Reservado'),  # Apartado para la primera solicitud de la lista de espera
     ))
     condition = models.CharField(max_length=20, default='good')
     added_date = models.DateField(auto_now_add=True)
+
+    objects = BookStockQuerySet.as_manager()
+
     class Meta:
         db_table = 'book_stocks'
         verbose_name = 'Stock de Libro'
@@ -89,6 +191,31 @@ class BookStock(models.Model):
     def __str__(self):
         return f"{self.book.title} - {self.physical_id}"
 
+    def save(self, *args, **kwargs):
+        """Alta o edición de un ejemplar suelto (admin, create()) con sus contadores"""
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = BookStock.objects.filter(pk=self.pk).values_list('book_id', 'status').first()
+            super().save(*args, **kwargs)
+            total, available = Counter(), Counter()
+            if previous:
+                total[previous[0]] -= 1
+                available[previous[0]] -= previous[1] == 'available'
+            total[self.book_id] += 1
+            available[self.book_id] += self.status == 'available'
+            _shift_counters('total_copies', total)
+            _shift_counters('available_copies', available)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = BookStock.objects.filter(pk=self.pk).values_list('book_id', 'status').first()
+            result = super().delete(*args, **kwargs)
+            if previous:
+                _shift_counters('total_copies', {previous[0]: -1})
+                _shift_counters('available_copies', {previous[0]: -(previous[1] == 'available')})
+        return result
+
 
 class ReviewQuerySet(models.QuerySet):
     def for_book(self, book):
@@ -0,0 +1,30 @@
+import requests
+from apps.dashboard import metrics
+from apps.dashboard.profiling import timed
+
+SEARCH_URL = 'https://openlibrary.org/search.json'
+COVER_URL = 'https://covers.openlibrary.org/b/id/{cover_id}-M.jpg'
+
+
+def search(query, limit=10, timeout=10):
+    """
+    Busca en OpenLibrary y devuelve la lista de documentos crudos.
+    Propaga requests.RequestException para que cada vista decida cómo responder.
+    """
+    with timed('http'), metrics.OPENLIBRARY_DURATION.time():
+        try:
+            response = requests.get(SEARCH_URL, params={'q': query, 'limit': limit}, timeout=timeout)
+            response.raise_for_status()
+            docs = response.json().get('docs', [])
+        except requests.Timeout:
+            metrics.OPENLIBRARY_REQUESTS.inc(outcome='timeout')
+            raise
+        except (requests.RequestException, ValueError):
+            metrics.OPENLIBRARY_REQUESTS.inc(outcome='error')
+            raise
+    metrics.OPENLIBRARY_REQUESTS.inc(outcome='ok')
+    return docs
+
+
+def cover_url(doc):
+    return COVER_URL.format(cover_id=doc['cover_i']) if doc.get('cover_i') else None
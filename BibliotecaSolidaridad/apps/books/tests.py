@@ -1,3 +1,133 @@
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from apps.loans.models import Loan
+from apps.users.models import User
+from .forms import BookForm
+from .models import Book, BookStock
+
+
+class CopyCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book, cls.other = Book.objects.bulk_create(
+            Book(title=title, authors=['Autora']) for title in ('Contado', 'Otro')
+        )
+
+    def counters(self, book=None):
+        return Book.objects.values_list('total_copies', 'available_copies').get(pk=(book or self.book).pk)
+
+    def add(self, *statuses, book=None):
+        book = book or self.book
+        start = BookStock.objects.filter(book=book).count()
+        return BookStock.objects.bulk_create(
+            BookStock(book=book, physical_id=f'{book.title}-{start + n}', status=status)
+            for n, status in enumerate(statuses)
+        )
+
+    def test_bulk_create_counts_copies(self):
+        self.add('available', 'available', 'lost')
+        self.add('borrowed', book=self.other)
+        self.assertEqual(self.counters(), (3, 2))
+        self.assertEqual(self.counters(self.other), (1, 0))
+        self.assertTrue(Book.objects.get(pk=self.book.pk).is_available)
+        self.assertFalse(Book.objects.get(pk=self.other.pk).is_available)
+
+    def test_set_status_follows_each_transition(self):
+        first, second, lost = self.add('available', 'available', 'lost')
+
+        self.assertEqual(BookStock.objects.filter(pk__in=[first.pk, lost.pk]).set_status('borrowed'), 2)
+        self.assertEqual(self.counters(), (3, 1))
+        # Condicional: el ejemplar ya no está disponible, no cambia nada
+        self.assertEqual(BookStock.objects.filter(pk=first.pk, status='available').set_status('borrowed'), 0)
+        self.assertEqual(BookStock.objects.filter(pk=first.pk).set_status('borrowed'), 0)
+        self.assertEqual(BookStock.objects.filter(book=self.book).set_status('available'), 2)
+        self.assertEqual(self.counters(), (3, 3))
+
+    def test_lend_one(self):
+        self.add('maintenance', 'available')
+        copy = BookStock.objects.lend_one(self.book)
+        self.assertEqual((copy.physical_id, copy.status), ('Contado-1', 'borrowed'))
+        self.assertIsNone(BookStock.objects.lend_one(self.book))
+        self.assertEqual(self.counters(), (2, 0))
+
+    def test_single_copy_save_and_delete(self):
+        copy = BookStock.objects.create(book=self.book, physical_id='SUELTO', status='available')
+        self.assertEqual(self.counters(), (1, 1))
+
+        # Edición desde el admin: cambia de estado y de libro
+        copy.status = 'maintenance'
+        copy.save()
+        self.assertEqual(self.counters(), (1, 0))
+        copy.book = self.other
+        copy.status = 'available'
+        copy.save()
+        self.assertEqual((self.counters(), self.counters(self.other)), ((0, 0), (1, 1)))
+
+        copy.delete()
+        self.assertEqual(self.counters(self.other), (0, 0))
+
+    def test_reconcile_fixes_drift(self):
+        self.add('available', 'borrowed')
+        self.add('available', book=self.other)
+        # Un UPDATE directo no pasa por los contadores
+        BookStock.objects.filter(book=self.book).update(status='available')
+        Book.objects.filter(pk=self.other.pk).update(total_copies=5)
+
+        out = StringIO()
+        call_command('reconcile_copies', stdout=out)
+        self.assertIn('Libros corregidos: 2', out.getvalue())
+        self.assertEqual((self.counters(), self.counters(self.other)), ((2, 2), (1, 1)))
+        self.assertEqual(Book.objects.sync_copies(), 0)
+
+    def test_availability_filters(self):
+        self.add('borrowed')
+        self.add('available', book=self.other)
+        self.assertEqual(Book.objects.total_available(), 1)
+        self.assertEqual(list(Book.objects.recommended()), [self.other])
+
+    def test_add_book_creates_its_copies(self):
+        librarian = User.objects.create_user('catalogadora', dni='B1', role='librarian')
+        self.client.force_login(librarian)
+        response = self.client.post(reverse('add_book'), {
+            'title': 'Nuevo', 'authors_input': 'Autora', 'copies': 3, 'publish_date': '2020',
+        })
+
+        book = Book.objects.get(title='Nuevo')
+        self.assertRedirects(response, reverse('book_detail', args=[book.pk]), fetch_redirect_response=False)
+        self.assertEqual(
+            list(BookStock.objects.filter(book=book).order_by('pk').values_list('physical_id', flat=True)),
+            [f'BS-{book.pk:07d}-{n}' for n in (1, 2, 3)],
+        )
+        self.assertEqual(self.counters(book), (3, 3))
+
+        # Dado de baja el segundo, los nuevos siguen después del último código
+        BookStock.objects.get(physical_id=f'BS-{book.pk:07d}-2').delete()
+        form = BookForm(instance=book)
+        form.cleaned_data = {'copies': 2}
+        form.save_copies()
+        self.assertEqual(
+            list(BookStock.objects.filter(book=book).order_by('pk').values_list('physical_id', flat=True)),
+            [f'BS-{book.pk:07d}-{n}' for n in (1, 3, 4, 5)],
+        )
+
+
+class ProfileTests(TestCase):
+    def test_overdue_loans_stay_in_progress(self):
+        reader = User.objects.create_user('lectora', dni='P1')
+        book = Book.objects.create(title='Vencido', authors=['Autora'])
+        today = timezone.now().date()
+        active, overdue, returned = Loan.objects.bulk_create(
+            Loan(user=reader, book=book, due_date=today + timedelta(days=days), status=status)
+            for days, status in ((5, 'active'), (-3, 'overdue'), (-30, 'returned'))
+        )
+
+        self.client.force_login(reader)
+        response = self.client.get(reverse('profile'))
+        self.assertEqual({loan.pk for loan in response.context['active_loans']}, {active.pk, overdue.pk})
+        self.assertEqual([loan.pk for loan in response.context['loan_history']], [returned.pk])
+        self.assertContains(response, '<span class="badge bg-danger">Vencido</span>')
 
-# Create your tests here.
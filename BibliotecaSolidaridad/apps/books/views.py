@@ -7,12 +7,15 @@ from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.shortcuts import redirect, render
-from django.db.models import Avg
+from django.db.models import Avg, Count
 from django.contrib import messages
 from .models import Category
 from .forms import BookForm
 
 from .models import Book, Review
+from . import openlibrary
+from apps.loans.holds import HoldService
+from apps.loans.models import Loan
 from apps.users.models import UserProfile
 
 
@@ -35,11 +38,6 @@ class BookSearchView(ListView):
 
     def _search_openlibrary(self, query):
         try:
-            response = requests.get(
-                f"https://openlibrary.org/search.json?q={query}&limit=10", timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
             return [
                 {
                     'title': doc.get('title', ''),
@@ -47,12 +45,9 @@ class BookSearchView(ListView):
                     'publish_year': doc.get('first_publish_year', ''),
                     'isbn': ", ".join(doc.get('isbn', [])[:1]) if doc.get('isbn') else '',
                     'openlibrary_id': (doc.get('edition_key', [None])[0] or doc.get('key')),
-                    'cover_url': (
-                        f"https://covers.openlibrary.org/b/id/{doc.get('cover_i')}-M.jpg"
-                        if doc.get('cover_i') else None
-                    ),
+                    'cover_url': openlibrary.cover_url(doc),
                 }
-                for doc in data.get('docs', [])
+                for doc in openlibrary.search(query)
             ]
         except Exception:
             return []
@@ -62,7 +57,11 @@ class BookSearchView(ListView):
         context['query'] = self.query
         context['openlibrary_results'] = self.openlibrary_results
         context['searched'] = bool(self.query)
-        context['existing_ids'] = set(Book.objects.values_list('openlibrary_id', flat=True))
+        # Sólo los ids de los resultados mostrados, no el catálogo completo
+        result_ids = [r['openlibrary_id'] for r in self.openlibrary_results if r['openlibrary_id']]
+        context['existing_ids'] = set(
+            Book.objects.filter(openlibrary_id__in=result_ids).values_list('openlibrary_id', flat=True)
+        ) if result_ids else set()
         return context
 
 
@@ -72,11 +71,6 @@ class SearchOpenLibraryView(View):
         if not query:
             return JsonResponse({'error': 'Query parameter required'}, status=400)
         try:
-            response = requests.get(
-                f"https://openlibrary.org/search.json?q={query}&limit=10", timeout=10
-            )
-            response.raise_for_status()
-            data = response.json()
             books = [
                 {
                     'title': doc.get('title', ''),
@@ -85,12 +79,9 @@ class SearchOpenLibraryView(View):
                     'number_of_pages': doc.get('number_of_pages', ''),
                     'isbn': doc.get('isbn', []),
                     'description': doc.get('description', ''),
-                    'cover_url': (
-                        f"https://covers.openlibrary.org/b/id/{doc.get('cover_i')}-M.jpg"
-                        if doc.get('cover_i') else None
-                    ),
+                    'cover_url': openlibrary.cover_url(doc),
                 }
-                for doc in data.get('docs', [])
+                for doc in openlibrary.search(query)
             ]
             return JsonResponse({'books': books})
         except requests.RequestException:
@@ -137,6 +128,7 @@ class AddBookView(LoginRequiredMixin, UserPassesTestMixin, View):
                 
                 book.save()
                 form.save_m2m()
+                form.save_copies()
                 
                 messages.success(request, f'Libro "{book.title}" agregado correctamente.')
                 # ✅ CAMBIO: Usar 'pk' en lugar de 'book_id'
@@ -222,11 +214,12 @@ class BookDetailView(DetailView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         book = self.object
-        reviews = Review.objects.filter(book=book).order_by('-created_at')
+        reviews = Review.objects.for_book(book).order_by('-created_at')
 
+        summary = reviews.aggregate(count=Count('id'), avg=Avg('rating'))
         context['recent_reviews'] = reviews[:3]
-        context['review_count'] = reviews.count()
-        context['average_rating'] = round(reviews.aggregate(avg=Avg('rating'))['avg'] or 0, 1)
+        context['review_count'] = summary['count']
+        context['average_rating'] = round(summary['avg'] or 0, 1)
         context['total_loans'] = book.loan_set.count() if hasattr(book, 'loan_set') else 0
 
         user = self.request.user
@@ -236,12 +229,14 @@ class BookDetailView(DetailView):
             if user.is_authenticated else None
         )
         context['user_has_reviewed'] = bool(context['user_review'])
+        if not book.is_available:
+            context['waiting_count'] = HoldService.queue_length(book.pk)
 
         context['is_favorite'] = (
             user.is_authenticated
-            and hasattr(user, 'profile')
-            and hasattr(user.profile, 'favorite_books')
-            and book in user.profile.favorite_books.all()
+            and UserProfile.favorite_books.through.objects.filter(
+                userprofile__user=user, book=book
+            ).exists()
         )
         return context
 
@@ -318,14 +313,15 @@ class ProfileView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        profile = self.get_object()
+        profile = self.object
 
         # Favoritos (ManyToMany con Book)
         context['user_favorites'] = profile.favorite_books.all()
 
-        # Préstamos activos e historial
-        context['active_loans'] = self.request.user.loan_set.filter(status='active').select_related('book')
-        context['loan_history'] = self.request.user.loan_set.exclude(status='active').select_related('book')
+        # Préstamos en curso (activos y vencidos) e historial
+        loans = self.request.user.loan_set.select_related('book')
+        context['active_loans'] = loans.filter(status__in=Loan.OPEN_STATUSES)
+        context['loan_history'] = loans.exclude(status__in=Loan.OPEN_STATUSES)
 
         return context
 
@@ -0,0 +1,18 @@
+from django.utils.functional import SimpleLazyObject
+from . import events
+from .notifications import NotificationService
+
+
+def notifications(request):
+    """
+    Cantidad de notificaciones no leídas para el badge de base.html. Es perezosa:
+    sólo se busca (en el cache) si la plantilla la usa. También el intervalo del
+    polling de respaldo de las novedades en vivo.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {
+        'unread_notifications': SimpleLazyObject(lambda: NotificationService.unread_count(user)),
+        'events_poll_interval': events.get_config()['POLL_INTERVAL'],
+    }
@@ -0,0 +1,164 @@
+import asyncio
+import itertools
+import json
+import threading
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+DEFAULT_EVENTS_CONFIG = {
+    'KEEPALIVE': 15,  # Segundos entre comentarios que mantienen viva una conexión sin eventos
+    'MAX_DURATION': 300,  # Cada conexión se corta a los N segundos y el navegador reconecta
+    'QUEUE_SIZE': 100,  # Eventos pendientes por conexión; si se llena, el cliente recibe 'resync'
+    'RETRY': 5000,  # Milisegundos que espera el navegador antes de reconectar
+    'POLL_INTERVAL': 20,  # Segundos entre consultas del polling de respaldo
+}
+
+# Canales: uno por usuario y uno compartido por bibliotecarios y administradores
+LIBRARIANS = 'librarians'
+
+
+def get_config():
+    return {**DEFAULT_EVENTS_CONFIG, **getattr(settings, 'EVENTS_CONFIG', {})}
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+def channels_for(user):
+    channels = [user_channel(user.pk)]
+    if user.role in ('librarian', 'admin'):
+        channels.append(LIBRARIANS)
+    return channels
+
+
+def version_key(channel):
+    return f'events:version:{channel}'
+
+
+def versions(channels):
+    """Versión de cada canal; el polling la usa como ETag"""
+    found = cache.get_many([version_key(channel) for channel in channels])
+    return [found.get(version_key(channel), 0) for channel in channels]
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+class Subscription:
+    """Una conexión abierta: una cola acotada en el event loop que la atiende"""
+
+    def __init__(self, broker, channels, loop, size):
+        self.broker = broker
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    def put(self, message):
+        # Corre en el event loop (call_soon_threadsafe)
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # Un cliente que no lee no frena al resto: se descartan sus eventos y se le pide recargar
+            self.overflowed = True
+
+    async def get(self, timeout):
+        """El próximo evento, o None si pasan `timeout` segundos sin ninguno"""
+        if self.overflowed and self.queue.empty():
+            self.overflowed = False
+            return ('resync', {}, None)
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """
+    Pub/sub en memoria del proceso. Cada conexión SSE es una corrutina que
+    espera en su cola, así miles de conexiones ociosas cuestan una cola y un
+    socket cada una, sin hilos. publish() se llama desde vistas sincrónicas
+    (en otro hilo) y entrega con call_soon_threadsafe al loop de cada conexión.
+
+    Los eventos no cruzan procesos: con varios procesos o tareas fuera del
+    servidor web (run_scheduler, run_jobs) el cliente se entera por el polling
+    de respaldo, que compara versiones guardadas en el cache compartido.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.ids = itertools.count(1)
+
+    def subscribe(self, channels, size=None):
+        """Se llama desde el event loop que va a leer la suscripción"""
+        size = size or get_config()['QUEUE_SIZE']
+        subscription = Subscription(self, tuple(channels), asyncio.get_running_loop(), size)
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                self.subscribers[channel].discard(subscription)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+    def connections(self):
+        with self.lock:
+            return len(set().union(*self.subscribers.values()))
+
+    def publish(self, channel, event, data):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(channel, ()))
+        message = (event, data, next(self.ids))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, message)
+            except RuntimeError:
+                # El loop ya cerró: la conexión se está yendo
+                subscription.close()
+        return len(subscriptions)
+
+
+BROKER = EventBroker()
+
+
+def publish(channels, event, **data):
+    """
+    Publica el evento en los canales cuando se confirma la transacción en
+    curso, y sube la versión de cada canal para los clientes que hacen polling.
+    """
+    publish_many([(channels, event, data)])
+
+
+def publish_many(messages):
+    """Varios eventos (canales, evento, datos) con un solo callback de on_commit"""
+    def send():
+        bumped = set()
+        for channels, event, data in messages:
+            for channel in channels:
+                if channel not in bumped:
+                    bumped.add(channel)
+                    key = version_key(channel)
+                    cache.add(key, 0, None)
+                    try:
+                        cache.incr(key)
+                    except ValueError:
+                        cache.set(key, 1, None)
+                BROKER.publish(channel, event, data)
+    if messages:
+        transaction.on_commit(send)
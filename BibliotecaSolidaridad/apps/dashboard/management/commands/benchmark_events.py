@@ -0,0 +1,57 @@
+import asyncio
+import threading
+import time
+import tracemalloc
+from django.core.management.base import BaseCommand
+from apps.dashboard import events
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el costo de las conexiones SSE ociosas: memoria por conexión y '
+        'cuánto tarda un evento publicado desde otro hilo en llegar a todas'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, nargs='+', default=[1000, 5000, 10000])
+
+    def handle(self, *args, **options):
+        for connections in options['connections']:
+            memory, latency = asyncio.run(self.measure(connections))
+            self.stdout.write(
+                f'{connections:>6} conexiones: {memory / connections / 1024:5.1f} KiB/conexión  '
+                f'evento a todas en {latency * 1000:7.1f} ms'
+            )
+
+    async def measure(self, connections):
+        broker = events.EventBroker()
+        received = asyncio.Event()
+        pending = [connections]
+
+        async def listen(subscription):
+            # La misma espera que el stream de la vista: keepalive y vuelta a esperar
+            while True:
+                message = await subscription.get(timeout=15)
+                if message is not None:
+                    pending[0] -= 1
+                    if not pending[0]:
+                        received.set()
+                    return
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        tasks = [
+            asyncio.create_task(listen(broker.subscribe([events.LIBRARIANS], size=100)))
+            for _ in range(connections)
+        ]
+        await asyncio.sleep(0.1)
+        memory = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+
+        # Como una vista sincrónica: publica desde otro hilo
+        started = time.perf_counter()
+        threading.Thread(target=broker.publish, args=(events.LIBRARIANS, 'loan_request', {})).start()
+        await received.wait()
+        latency = time.perf_counter() - started
+        await asyncio.gather(*tasks)
+        return memory, latency
@@ -0,0 +1,328 @@
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from unittest import mock
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+from apps.books.models import Book
+from apps.loans.models import LoanRequest
+from apps.users.models import User
+
+# Escenarios: nombre -> (método, rol del usuario, descripción)
+SCENARIOS = {
+    'home': ('GET', None, 'Página de inicio'),
+    'search': ('GET', None, 'Búsqueda local + OpenLibrary'),
+    'book_detail': ('GET', 'reader', 'Detalle de un libro'),
+    'loan_submit': ('POST', 'reader', 'Envío de solicitud de préstamo'),
+    'loan_approve': ('POST', 'librarian', 'Aprobación de una solicitud pendiente'),
+    'dashboard': ('GET', 'librarian', 'Tablero de métricas'),
+}
+SEARCH_TERMS = ('amor', 'noche', 'borges', 'mar', 'ciudad', 'tiempo', 'cortázar', 'sur')
+
+
+def percentile(sorted_values, pct):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def stub_openlibrary(*args, **kwargs):
+    response = mock.Mock()
+    response.json.return_value = {'docs': []}
+    return response
+
+
+class InProcessDriver:
+    """Ejecuta los requests contra la aplicación WSGI dentro del mismo proceso"""
+
+    counts_queries = True
+
+    def __init__(self, users):
+        self.users = users
+        self.local = threading.local()
+
+    def client(self, role):
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {}
+        if role not in clients:
+            client = Client(SERVER_NAME=self.host())
+            if role:
+                client.force_login(self.users[role])
+            clients[role] = client
+        return clients[role]
+
+    @staticmethod
+    def host():
+        """Un host aceptado por ALLOWED_HOSTS (con DEBUG y la lista vacía, Django acepta localhost)"""
+        for host in settings.ALLOWED_HOSTS:
+            if host != '*':
+                return host.lstrip('.')
+        return 'localhost'
+
+    def request(self, method, role, path, data=None):
+        client = self.client(role)
+        queries = [0]
+
+        def count(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            if method == 'POST':
+                response = client.post(path, data)
+            else:
+                response = client.get(path)
+        return response.status_code, queries[0]
+
+    def close(self):
+        connections.close_all()
+
+
+class HttpDriver:
+    """Ejecuta los requests contra un servidor local (runserver, gunicorn, uvicorn...)"""
+
+    counts_queries = False
+
+    def __init__(self, base_url, credentials):
+        self.base_url = base_url.rstrip('/')
+        self.credentials = credentials
+        self.local = threading.local()
+
+    def session(self, role):
+        sessions = getattr(self.local, 'sessions', None)
+        if sessions is None:
+            sessions = self.local.sessions = {}
+        if role not in sessions:
+            session = requests.Session()
+            if role:
+                self.login(session, *self.credentials[role])
+            sessions[role] = session
+        return sessions[role]
+
+    def login(self, session, username, password):
+        url = f'{self.base_url}/accounts/login/'
+        session.get(url, timeout=10)
+        response = session.post(url, data={
+            'username': username,
+            'password': password,
+            'csrfmiddlewaretoken': session.cookies.get('csrftoken', ''),
+        }, headers={'Referer': url}, timeout=10, allow_redirects=False)
+        if response.status_code != 302:
+            raise CommandError(f'No se pudo iniciar sesión como {username}')
+
+    def request(self, method, role, path, data=None):
+        session = self.session(role)
+        url = f'{self.base_url}{path}'
+        if method == 'POST':
+            headers = {'X-CSRFToken': session.cookies.get('csrftoken', ''), 'Referer': url}
+            response = session.post(url, data=data, headers=headers, timeout=30, allow_redirects=False)
+        else:
+            response = session.get(url, timeout=30, allow_redirects=False)
+        return response.status_code, None
+
+    def close(self):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide throughput y latencia (p50/p95/p99) de los endpoints principales, '
+        'en proceso o contra un servidor local, y guarda los resultados en JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base-url',
+            help='URL de un servidor local (ej. http://127.0.0.1:8000). Sin esto, corre en proceso',
+        )
+        parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=200, help='Requests medidos por escenario')
+        parser.add_argument('--warmup', type=int, default=10, help='Requests previos que no se miden')
+        parser.add_argument('--reader', help='Usuario lector (por defecto, el primero disponible)')
+        parser.add_argument('--librarian', help='Usuario bibliotecario (por defecto, el primero disponible)')
+        parser.add_argument('--password', default='biblioteca', help='Contraseña para el modo --base-url')
+        parser.add_argument(
+            '--live-openlibrary',
+            action='store_true',
+            help='En proceso, consultar OpenLibrary de verdad en vez de simular una respuesta vacía',
+        )
+        parser.add_argument('--seed', type=int, default=31)
+        parser.add_argument('--output', help='Archivo JSON donde guardar los resultados')
+        parser.add_argument('--compare', help='JSON de una corrida anterior para mostrar la diferencia')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.rng_lock = threading.Lock()
+        users = self.resolve_users(options)
+        # Con la semilla, no con ORDER BY RANDOM(): dos corridas piden los mismos libros
+        book_ids = list(Book.objects.order_by('pk').values_list('id', flat=True))
+        self.book_ids = self.rng.sample(book_ids, min(1000, len(book_ids)))
+        if not self.book_ids:
+            raise CommandError('No hay libros cargados. Generá datos con generate_dataset primero.')
+        self.pending_requests = deque(
+            LoanRequest.objects.filter(status='pending').order_by('request_date').values_list('id', flat=True)
+        )
+        self.pending_lock = threading.Lock()
+
+        if options['base_url']:
+            credentials = {role: (user.username, options['password']) for role, user in users.items()}
+            driver = HttpDriver(options['base_url'], credentials)
+        else:
+            driver = InProcessDriver(users)
+
+        results = {}
+        with ExitStack() as stack:
+            if not options['base_url'] and not options['live_openlibrary']:
+                stack.enter_context(mock.patch('apps.books.openlibrary.requests.get', side_effect=stub_openlibrary))
+            for name in options['scenarios']:
+                results[name] = self.run_scenario(driver, name, options)
+                self.report_line(name, results[name])
+
+        report = {
+            'commit': self.git_commit(),
+            'timestamp': timezone.now().isoformat(),
+            'mode': 'http' if options['base_url'] else 'in-process',
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'database': settings.DATABASES['default']['ENGINE'],
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(report, handle, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Resultados guardados en {options['output']}"))
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def resolve_users(self, options):
+        users = {}
+        for role, roles in (('reader', ['reader']), ('librarian', ['librarian', 'admin'])):
+            username = options[role]
+            queryset = User.objects.filter(username=username) if username else User.objects.filter(role__in=roles)
+            user = queryset.order_by('id').first()
+            if user is None:
+                raise CommandError(f'No hay un usuario con rol {role} para el benchmark')
+            users[role] = user
+        return users
+
+    def next_path(self, name):
+        """Construye el request de cada escenario. Devuelve (path, data) o None si no hay trabajo"""
+        with self.rng_lock:
+            book_id = self.rng.choice(self.book_ids)
+            term = self.rng.choice(SEARCH_TERMS)
+        if name == 'home':
+            return '/', None
+        if name == 'search':
+            return f'/books/search/?q={term}', None
+        if name == 'book_detail':
+            return f'/books/{book_id}/', None
+        if name == 'loan_submit':
+            return '/loans/submit/', {'book_id': book_id}
+        if name == 'loan_approve':
+            with self.pending_lock:
+                if not self.pending_requests:
+                    return None
+                request_id = self.pending_requests.popleft()
+            return f'/loans/approved/{request_id}', {}
+        return '/dashboard/', None
+
+    def run_scenario(self, driver, name, options):
+        method, role, _ = SCENARIOS[name]
+        samples = []
+        errors = [0]
+        skipped = [0]
+        lock = threading.Lock()
+
+        def one(measure):
+            job = self.next_path(name)
+            if job is None:
+                with lock:
+                    skipped[0] += 1
+                return
+            path, data = job
+            started = time.perf_counter()
+            try:
+                status, queries = driver.request(method, role, path, data)
+            except Exception:
+                status, queries = 599, None
+            elapsed = (time.perf_counter() - started) * 1000
+            if not measure:
+                return
+            with lock:
+                if status >= 400:
+                    errors[0] += 1
+                samples.append((elapsed, queries))
+
+        def worker(count, measure):
+            try:
+                for _ in range(count):
+                    one(measure)
+            finally:
+                driver.close()
+
+        concurrency = options['concurrency']
+        for total, measure in ((options['warmup'], False), (options['requests'], True)):
+            shares = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(lambda share: worker(share, measure), shares))
+            wall = time.perf_counter() - started
+
+        latencies = sorted(sample[0] for sample in samples)
+        queries = [sample[1] for sample in samples if sample[1] is not None]
+        return {
+            'requests': len(samples),
+            'errors': errors[0],
+            'skipped': skipped[0],
+            'rps': round(len(samples) / wall, 2) if wall else 0.0,
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'max_ms': round(latencies[-1], 2) if latencies else 0.0,
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+
+    def report_line(self, name, result):
+        queries = result['queries_per_request']
+        self.stdout.write(
+            f"{name:<14} {result['rps']:>8.1f} req/s  "
+            f"p50 {result['p50_ms']:>7.1f} ms  p95 {result['p95_ms']:>7.1f} ms  p99 {result['p99_ms']:>7.1f} ms  "
+            f"consultas/req {queries if queries is not None else '-':>5}  "
+            f"errores {result['errors']}" + (f"  omitidos {result['skipped']}" if result['skipped'] else '')
+        )
+
+    def compare(self, path, results):
+        with open(path, encoding='utf-8') as handle:
+            previous = json.load(handle)
+        self.stdout.write(f"\nComparación con {previous.get('commit') or path}:")
+        for name, result in results.items():
+            before = previous.get('scenarios', {}).get(name)
+            if not before:
+                continue
+            deltas = []
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request'):
+                if before.get(key) and result.get(key) is not None:
+                    deltas.append(f'{key} {(result[key] - before[key]) / before[key] * 100:+.1f}%')
+            self.stdout.write(f"{name:<14} " + '  '.join(deltas))
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
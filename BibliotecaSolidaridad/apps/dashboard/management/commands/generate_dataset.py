@@ -0,0 +1,362 @@
+import itertools
+import random
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from apps.books.models import Book, BookStock, Category, Review
+from apps.loans.models import Loan, LoanRequest
+from apps.loans.services import LoanService
+from apps.newsletter.models import NewsletterSubscriber
+from apps.users.models import User, UserProfile
+
+WORDS = (
+    'sombra viento río memoria noche jardín ciudad silencio tiempo mar casa luz '
+    'camino fuego nieve piedra ciervo laberinto espejo isla puerto sur invierno '
+    'canción guerra amor muerte verano tango pampa cielo ventana sueño'
+).split()
+FIRST_NAMES = 'Ana Julio Jorge María Silvina Ernesto Alejandra Adolfo Victoria Manuel Clarice Roberto'.split()
+LAST_NAMES = 'Cortázar Borges Ocampo Sábato Pizarnik Bioy Puig Walsh Arlt Storni Saer Piglia'.split()
+LOAN_DAYS = {'normal': 15, 'express': 3, 'summer': 60}
+# Estado del ejemplar que deja cada estado de préstamo abierto o perdido
+COPY_STATUS_BY_LOAN = {'active': 'borrowed', 'overdue': 'borrowed', 'lost': 'lost'}
+# Ejemplares por cambio de estado al aplicar los préstamos
+COPY_STATUS_CHUNK_SIZE = 500
+
+
+class ZipfSampler:
+    """Muestreo con popularidad tipo Zipf: el elemento k tiene peso 1 / k^s"""
+
+    def __init__(self, population, exponent, rng):
+        # El ranking de popularidad no tiene que coincidir con el orden de los ids
+        self.population = list(population)
+        rng.shuffle(self.population)
+        self.rng = rng
+        total = 0.0
+        self.cumulative = []
+        for rank in range(1, len(population) + 1):
+            total += 1.0 / rank ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self):
+        index = bisect_left(self.cumulative, self.rng.random() * self.total)
+        return self.population[min(index, len(self.population) - 1)]
+
+
+@contextmanager
+def preserve_dates(*fields):
+    """Desactiva auto_now_add para poder cargar fechas históricas con bulk_create"""
+    previous = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, previous):
+            field.auto_now_add = value
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = 'Genera un volumen sintético y reproducible de datos para pruebas de carga y planificación de capacidad'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=40)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--loans', type=int, default=50000)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--reviews', type=int, default=20000)
+        parser.add_argument('--subscribers', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=42, help='Semilla para que el dataset sea reproducible')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Exponente de popularidad de libros y socios')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--password',
+            default='biblioteca',
+            help='Contraseña de todos los usuarios generados (se hashea una sola vez)',
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.today = timezone.now().date()
+        started = time.monotonic()
+
+        categories = self.create_categories(options['categories'])
+        book_ids = self.create_books(options['books'], categories)
+        user_ids = self.create_users(options['users'], categories, options['password'])
+
+        # Los libros y socios más "populares" son los primeros del ranking Zipf
+        self.books = ZipfSampler(book_ids, options['zipf'], self.rng)
+        self.users = ZipfSampler(user_ids, options['zipf'] * 0.8, self.rng)
+
+        self.create_loans(options['loans'])
+        self.step('Marcando ejemplares prestados y perdidos', self.apply_loans_to_copies)
+        self.create_loan_requests(options['requests'])
+        self.create_reviews(options['reviews'])
+        self.create_subscribers(options['subscribers'], user_ids)
+
+        self.step('Recalculando contadores de préstamos', LoanService.reconcile_active_loan_counts)
+        self.step('Actualizando secuencias', self.reset_sequences)
+        self.stdout.write(self.style.SUCCESS(f'Dataset generado en {time.monotonic() - started:.1f}s'))
+
+    def step(self, label, func, *args):
+        started = time.monotonic()
+        result = func(*args)
+        self.stdout.write(f'{label}: {time.monotonic() - started:.1f}s')
+        return result
+
+    def reset_sequences(self):
+        """Los ids se asignan en Python; las secuencias (PostgreSQL) deben continuar después del último"""
+        models = [Category, Book, BookStock, User, UserProfile, NewsletterSubscriber]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+
+    def bulk_insert(self, label, model, objects, **kwargs):
+        """Inserta en lotes dentro de una transacción y muestra el progreso"""
+        started = time.monotonic()
+        total = 0
+        with transaction.atomic():
+            while True:
+                batch = list(itertools.islice(objects, self.batch_size))
+                if not batch:
+                    break
+                model.objects.bulk_create(batch, batch_size=self.batch_size, **kwargs)
+                total += len(batch)
+        self.stdout.write(f'{label}: {total} filas en {time.monotonic() - started:.1f}s')
+        return total
+
+    def random_date(self, days_back):
+        return self.today - timedelta(days=self.rng.randint(0, days_back))
+
+    def random_datetime(self, days_back):
+        return timezone.make_aware(datetime.combine(self.random_date(days_back), dt_time(self.rng.randint(8, 20))))
+
+    def create_categories(self, count):
+        librarian = User.objects.filter(role__in=['librarian', 'admin']).first()
+        if librarian is None:
+            librarian = User.objects.create_user('bibliotecaria', dni='GEN-LIB', role='librarian')
+        first = next_id(Category)
+        self.bulk_insert('Categorías', Category, (
+            Category(id=first + i, name=f'{self.rng.choice(WORDS).capitalize()} {i}', created_by=librarian)
+            for i in range(count)
+        ))
+        return list(range(first, first + count))
+
+    def create_books(self, count, categories):
+        rng = self.rng
+        first = next_id(Book)
+        authors = [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i}' for i in range(max(1, count // 20))]
+        author_sampler = ZipfSampler(authors, 1.0, rng)
+        copies = []
+
+        def books():
+            for book_id in range(first, first + count):
+                stock = rng.choices((1, 2, 3, 5), (50, 30, 15, 5))[0]
+                copies.append((book_id, stock))
+                yield Book(
+                    id=book_id,
+                    title=' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4))).capitalize(),
+                    authors=[author_sampler.sample() for _ in range(rng.choices((1, 2), (85, 15))[0])],
+                    publish_date=str(rng.randint(1850, self.today.year)),
+                    isbn=[f'978{rng.randrange(10 ** 9, 10 ** 10)}' for _ in range(rng.randint(0, 2))],
+                    number_of_pages=rng.randint(60, 900),
+                    created_at=self.random_datetime(5 * 365),
+                )
+
+        with preserve_dates(Book._meta.get_field('created_at')):
+            self.bulk_insert('Libros', Book, books())
+
+        through = Book.categories.through
+        self.bulk_insert('Libros por categoría', through, (
+            through(book_id=book_id, category_id=category_id)
+            for book_id in range(first, first + count)
+            for category_id in rng.sample(categories, min(len(categories), rng.randint(1, 3)))
+        ))
+
+        # Los prestados no se sortean: salen de los préstamos abiertos (apply_loans_to_copies).
+        # Los ids se asignan acá para que cada préstamo apunte a su ejemplar
+        self.copies = {}
+        self.on_shelf = defaultdict(list)
+        self.lent_copies = defaultdict(list)
+        copy_id = next_id(BookStock)
+
+        def book_copies():
+            nonlocal copy_id
+            for book_id, stock in copies:
+                self.copies[book_id] = (copy_id, stock)
+                for n in range(1, stock + 1):
+                    status = rng.choices(('available', 'maintenance', 'lost'), (95, 3, 2))[0]
+                    if status == 'available':
+                        self.on_shelf[book_id].append(copy_id)
+                    yield BookStock(
+                        id=copy_id,
+                        book_id=book_id,
+                        physical_id=f'BS-{book_id:07d}-{n}',
+                        status=status,
+                        added_date=self.random_date(5 * 365),
+                    )
+                    copy_id += 1
+
+        with preserve_dates(BookStock._meta.get_field('added_date')):
+            self.bulk_insert('Ejemplares', BookStock, book_copies())
+        return list(range(first, first + count))
+
+    def create_users(self, count, categories, password):
+        rng = self.rng
+        first = next_id(User)
+        hashed = make_password(password)
+
+        # bulk_create no dispara post_save, así que create_user_profile no corre:
+        # los perfiles se insertan aparte, también en bloque
+        self.bulk_insert('Usuarios', User, (
+            User(
+                id=user_id,
+                username=f'socio{user_id}',
+                email=f'socio{user_id}@example.com',
+                password=hashed,
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                dni=f'GEN{user_id:09d}',
+                address='Av. Siempre Viva 123',
+                phone='011 1234-5678',
+                score=round(min(5.0, max(0.0, rng.gauss(4.2, 0.9))), 1),
+                is_active_member=rng.random() < 0.92,
+            )
+            for user_id in range(first, first + count)
+        ))
+
+        profile_first = next_id(UserProfile)
+        with preserve_dates(UserProfile._meta.get_field('registration_date')):
+            self.bulk_insert('Perfiles', UserProfile, (
+                UserProfile(
+                    id=profile_first + i,
+                    user_id=first + i,
+                    virtual_card_id=f'VCARD-{first + i:05d}',
+                    registration_date=self.random_datetime(5 * 365),
+                )
+                for i in range(count)
+            ))
+
+        through = UserProfile.favorite_categories.through
+        self.bulk_insert('Categorías favoritas', through, (
+            through(userprofile_id=profile_first + i, category_id=category_id)
+            for i in range(count)
+            for category_id in rng.sample(categories, min(len(categories), 3))
+        ))
+        return list(range(first, first + count))
+
+    def create_loans(self, count):
+        rng = self.rng
+        loan_types = tuple(LOAN_DAYS)
+
+        def loans():
+            for _ in range(count):
+                loan_type = rng.choices(loan_types, (80, 15, 5))[0]
+                loan_date = self.random_date(2 * 365)
+                due_date = loan_date + timedelta(days=LOAN_DAYS[loan_type])
+                return_date = None
+                if due_date >= self.today:
+                    status = 'active'
+                elif rng.random() < 0.9:
+                    status = 'returned'
+                    return_date = min(self.today, due_date + timedelta(days=rng.randint(-LOAN_DAYS[loan_type], 5)))
+                else:
+                    status = rng.choices(('overdue', 'lost'), (9, 1))[0]
+
+                book_id = self.books.sample()
+                first_copy, stock = self.copies[book_id]
+                if status in COPY_STATUS_BY_LOAN:
+                    shelf = self.on_shelf[book_id]
+                    if shelf:
+                        # Se lleva un ejemplar que estaba en el estante
+                        copy_id = shelf.pop(rng.randrange(len(shelf)))
+                        self.lent_copies[COPY_STATUS_BY_LOAN[status]].append(copy_id)
+                    else:
+                        # No quedaba ninguno libre: el préstamo ya se devolvió
+                        status, return_date = 'returned', self.today
+                        copy_id = first_copy + rng.randrange(stock)
+                else:
+                    copy_id = first_copy + rng.randrange(stock)
+                yield Loan(
+                    user_id=self.users.sample(),
+                    book_id=book_id,
+                    copy_id=copy_id,
+                    loan_type=loan_type,
+                    loan_date=loan_date,
+                    due_date=due_date,
+                    return_date=return_date,
+                    status=status,
+                    penalized_until=due_date if status == 'overdue' else None,
+                )
+
+        with preserve_dates(Loan._meta.get_field('loan_date')):
+            self.bulk_insert('Préstamos', Loan, loans())
+
+    def apply_loans_to_copies(self):
+        """Los ejemplares de préstamos abiertos quedan prestados y los de perdidos, perdidos"""
+        for status, copy_ids in self.lent_copies.items():
+            for i in range(0, len(copy_ids), COPY_STATUS_CHUNK_SIZE):
+                BookStock.objects.filter(pk__in=copy_ids[i:i + COPY_STATUS_CHUNK_SIZE]).set_status(status)
+
+    def create_loan_requests(self, count):
+        rng = self.rng
+        statuses = ('approved', 'rejected', 'returned', 'pending')
+        with preserve_dates(LoanRequest._meta.get_field('request_date')):
+            # Una sola pendiente por (usuario, libro): los duplicados del muestreo se descartan
+            self.bulk_insert('Solicitudes', LoanRequest, (
+                LoanRequest(
+                    user_id=self.users.sample(),
+                    book_id=self.books.sample(),
+                    status=rng.choices(statuses, (60, 10, 25, 5))[0],
+                    priority=rng.choices((0, 1, 2), (70, 20, 10))[0],
+                    request_date=self.random_datetime(365),
+                )
+                for _ in range(count)
+            ), ignore_conflicts=True)
+
+    def create_reviews(self, count):
+        rng = self.rng
+        with preserve_dates(Review._meta.get_field('created_at')):
+            # (usuario, libro) es único: los duplicados del muestreo se descartan
+            self.bulk_insert('Reseñas', Review, (
+                Review(
+                    user_id=self.users.sample(),
+                    book_id=self.books.sample(),
+                    rating=rng.choices((1, 2, 3, 4, 5), (5, 8, 20, 37, 30))[0],
+                    comment=' '.join(rng.choice(WORDS) for _ in range(12)).capitalize(),
+                    created_at=self.random_datetime(2 * 365),
+                )
+                for _ in range(count)
+            ), ignore_conflicts=True)
+
+    def create_subscribers(self, count, user_ids):
+        rng = self.rng
+        first = next_id(NewsletterSubscriber)
+        linked = set(rng.sample(user_ids, min(len(user_ids), count // 2)))
+        linked_iter = iter(linked)
+        with preserve_dates(NewsletterSubscriber._meta.get_field('subscribed_at')):
+            self.bulk_insert('Suscriptores', NewsletterSubscriber, (
+                NewsletterSubscriber(
+                    id=subscriber_id,
+                    email=f'lector{subscriber_id}@example.com',
+                    user_id=next(linked_iter, None),
+                    is_active=rng.random() < 0.9,
+                    token=f'{rng.getrandbits(256):064x}',
+                    subscribed_at=self.random_datetime(3 * 365),
+                )
+                for subscriber_id in range(first, first + count)
+            ))
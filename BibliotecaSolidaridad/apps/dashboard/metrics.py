@@ -0,0 +1,366 @@
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+
+DEFAULT_METRICS_CONFIG = {
+    'ENABLED': False,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    'ALLOWED_IPS': [],
+}
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_config():
+    return {**DEFAULT_METRICS_CONFIG, **getattr(settings, 'METRICS_CONFIG', {})}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} espera las etiquetas {self.labelnames}, no {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    """Valor que sólo crece. Entre procesos se suma"""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self.registry.dirty = True
+
+
+class Gauge(Metric):
+    """
+    Valor que sube y baja. Entre procesos se suman los de los procesos vivos
+    (ej. requests en curso): el último valor de un worker que terminó no cuenta.
+    """
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+            self.registry.dirty = True
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+            self.registry.dirty = True
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    """Distribución por buckets (no acumulados en memoria, acumulados al exponer)"""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.registry.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {'buckets': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['buckets'][bisect_left(self.buckets, value)] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+            self.registry.dirty = True
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+
+class Registry:
+    """
+    Registro de métricas del proceso. Con MULTIPROCESS_DIR configurado, cada
+    proceso (worker de gunicorn, comando de management) vuelca sus valores a un
+    archivo propio y el endpoint /metrics suma los de todos los procesos.
+    Contadores e histogramas suman también los archivos de procesos que ya
+    terminaron (si no, bajarían tras cada reinicio); los gauges sólo los de
+    procesos vivos en esta máquina.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_flush = 0.0
+        # pid + inicio: un pid reutilizado no pisa los contadores de un proceso anterior
+        self.process_id = f'{os.getpid()}-{int(time.time() * 1000)}'
+        atexit.register(self.flush)
+
+    def _register(self, cls, name, *args, **kwargs):
+        if name in self.metrics:
+            raise ValueError(f'La métrica {name} ya está registrada')
+        metric = self.metrics[name] = cls(self, name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def collector(self, function):
+        """
+        Registra una función que se evalúa en cada scrape y devuelve
+        [(nombre, ayuda, valor)]: gauges que se leen de la base en el momento.
+        """
+        self.collectors.append(function)
+        return function
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {
+                    'kind': metric.kind,
+                    'help': metric.documentation,
+                    'labels': list(metric.labelnames),
+                    'buckets': list(getattr(metric, 'buckets', ())),
+                    'samples': metric.snapshot(),
+                }
+                for name, metric in self.metrics.items()
+            }
+
+    def flush(self):
+        directory = get_config()['MULTIPROCESS_DIR'] if settings.configured else None
+        if not directory or not self.dirty:
+            return
+        snapshot = self.snapshot()
+        self.dirty = False
+        self.last_flush = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.process_id}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as handle:
+            json.dump(snapshot, handle)
+        os.replace(temporary, path)
+
+    def maybe_flush(self, interval):
+        if self.dirty and time.monotonic() - self.last_flush >= interval:
+            self.flush()
+
+    def collect(self):
+        """Combina los volcados de todos los procesos (o sólo este proceso sin MULTIPROCESS_DIR)"""
+        directory = get_config()['MULTIPROCESS_DIR']
+        if not directory:
+            return self.snapshot()
+        self.flush()
+        merged = {}
+        paths = sorted(glob.glob(os.path.join(directory, '*.json')))
+        live = _live_paths(paths)
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as handle:
+                    snapshot = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            for name, data in snapshot.items():
+                if data['kind'] == 'gauge' and path not in live:
+                    continue
+                target = merged.setdefault(name, {**data, 'samples': {}})
+                for key, value in data['samples']:
+                    key = tuple(key)
+                    target['samples'][key] = _merge(target['samples'].get(key), value)
+        for data in merged.values():
+            data['samples'] = [[list(key), value] for key, value in data['samples'].items()]
+        # Métricas registradas que todavía no tienen muestras en ningún proceso
+        for name, data in self.snapshot().items():
+            merged.setdefault(name, data)
+        return merged
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus"""
+        lines = []
+        for name, data in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {data['help']}")
+            lines.append(f"# TYPE {name} {data['kind']}")
+            for key, value in data['samples']:
+                labels = dict(zip(data['labels'], key))
+                if data['kind'] == 'histogram':
+                    cumulative = 0
+                    for bound, count in zip([*data['buckets'], '+Inf'], value['buckets']):
+                        cumulative += count
+                        le = bound if bound == '+Inf' else _format(bound)
+                        lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+                    lines.append(f"{name}_sum{_labels(labels)} {_format(value['sum'])}")
+                    lines.append(f"{name}_count{_labels(labels)} {value['count']}")
+                else:
+                    lines.append(f'{name}{_labels(labels)} {_format(value)}')
+        for collector in self.collectors:
+            for name, documentation, value in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {_format(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _live_paths(paths):
+    """
+    Volcados de procesos que siguen corriendo. El archivo se llama
+    <pid>-<inicio en ms>.json; si el pid se reutilizó, sólo el volcado más
+    reciente de ese pid puede ser del proceso vivo.
+    """
+    newest = {}
+    for path in paths:
+        try:
+            pid, started = map(int, os.path.basename(path)[:-len('.json')].split('-'))
+        except ValueError:
+            continue
+        if started > newest.get(pid, ('', -1))[1]:
+            newest[pid] = (path, started)
+    return {path for pid, (path, _) in newest.items() if _alive(pid)}
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Existe pero es de otro usuario
+        return True
+    return True
+
+
+def _merge(current, value):
+    if current is None:
+        return value
+    if isinstance(value, dict):
+        return {
+            'buckets': [a + b for a, b in zip(current['buckets'], value['buckets'])],
+            'sum': current['sum'] + value['sum'],
+            'count': current['count'] + value['count'],
+        }
+    return current + value
+
+
+def _format(value):
+    return repr(float(value))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        f'{name}="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+REGISTRY = Registry()
+
+# HTTP y base de datos (MetricsMiddleware)
+HTTP_REQUESTS = REGISTRY.counter(
+    'http_requests_total', 'Requests atendidos', ('method', 'view', 'status'))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Duración de los requests', ('view',))
+HTTP_REQUESTS_IN_PROGRESS = REGISTRY.gauge(
+    'http_requests_in_progress', 'Requests en curso')
+DB_QUERIES = REGISTRY.counter(
+    'db_queries_total', 'Consultas SQL ejecutadas durante requests', ('view',))
+DB_REQUEST_DURATION = REGISTRY.histogram(
+    'db_request_duration_seconds', 'Tiempo total de SQL por request', ('view',))
+
+# OpenLibrary
+OPENLIBRARY_REQUESTS = REGISTRY.counter(
+    'openlibrary_requests_total', 'Llamadas a OpenLibrary por resultado', ('outcome',))
+OPENLIBRARY_DURATION = REGISTRY.histogram(
+    'openlibrary_request_duration_seconds', 'Duración de las llamadas a OpenLibrary')
+
+# Newsletter
+NEWSLETTER_EMAILS = REGISTRY.counter(
+    'newsletter_emails_total', 'Emails de newsletter por resultado', ('result',))
+NEWSLETTER_SEND_DURATION = REGISTRY.histogram(
+    'newsletter_send_duration_seconds', 'Duración del envío de cada email de newsletter')
+
+# Préstamos
+LOAN_REQUESTS = REGISTRY.counter(
+    'loan_requests_total', 'Solicitudes de préstamo por estado', ('status',))
+LOANS_OPENED = REGISTRY.counter(
+    'loans_opened_total', 'Préstamos abiertos o rechazados por límite', ('outcome',))
+LOANS_CLOSED = REGISTRY.counter(
+    'loans_closed_total', 'Préstamos cerrados por estado final', ('status',))
+LOANS_MARKED_OVERDUE = REGISTRY.counter(
+    'loans_marked_overdue_total', 'Préstamos que el barrido marcó como vencidos')
+LOANS_REMINDED = REGISTRY.counter(
+    'loans_reminded_total', 'Préstamos recordados antes de su vencimiento')
+
+# Notificaciones
+NOTIFICATIONS_CREATED = REGISTRY.counter(
+    'notifications_created_total', 'Notificaciones creadas')
+NOTIFICATION_COUNT_CACHE = REGISTRY.counter(
+    'notification_unread_cache_total', 'Lecturas de la cantidad de no leídas por resultado del cache', ('result',))
+
+# Tareas en segundo plano (run_jobs)
+JOBS = REGISTRY.counter(
+    'jobs_total', 'Tareas ejecutadas por resultado', ('name', 'outcome'))
+JOB_DURATION = REGISTRY.histogram(
+    'job_duration_seconds', 'Duración de cada ejecución de una tarea', ('name',))
+
+
+@REGISTRY.collector
+def loan_gauges():
+    from apps.loans.models import Loan, LoanRequest
+    return [
+        ('loans_open', 'Préstamos activos o vencidos', Loan.objects.filter(status__in=Loan.OPEN_STATUSES).count()),
+        ('loans_overdue', 'Préstamos vencidos', Loan.objects.overdue().count()),
+        ('loan_requests_pending', 'Solicitudes pendientes', LoanRequest.objects.filter(status='pending').count()),
+    ]
+
+
+@REGISTRY.collector
+def job_gauges():
+    from django.utils import timezone
+    from apps.jobs.models import Job
+    return [
+        ('jobs_due', 'Tareas pendientes ya vencidas', Job.objects.filter(status='pending', run_at__lte=timezone.now()).count()),
+        ('jobs_failed', 'Tareas que agotaron sus intentos', Job.objects.filter(status='failed').count()),
+    ]
@@ -0,0 +1,145 @@
+import cProfile
+import logging
+import os
+import random
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from . import metrics
+from .profiling import instrument_templates, profile_request
+from .querycheck import describe, record_queries
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PROFILING_CONFIG = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.0,
+    'SLOW_REQUEST_MS': 500,
+    'DUMP_DIR': None,
+}
+DEFAULT_QUERYCHECK_CONFIG = {
+    'ENABLED': False,
+    'THRESHOLD': 3,
+}
+
+
+class MetricsMiddleware:
+    """
+    Cuenta requests por vista y status y registra la duración total y el tiempo
+    de SQL de cada uno. Con MULTIPROCESS_DIR, vuelca los valores del proceso
+    cada FLUSH_INTERVAL segundos para que /metrics los combine.
+    """
+
+    def __init__(self, get_response):
+        config = metrics.get_config()
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.flush_interval = config['FLUSH_INTERVAL']
+
+    def __call__(self, request):
+        sql = [0, 0.0]
+
+        def timed_sql(execute, sql_text, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql_text, params, many, context)
+            finally:
+                sql[0] += 1
+                sql[1] += time.perf_counter() - started
+
+        metrics.HTTP_REQUESTS_IN_PROGRESS.inc()
+        started = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timed_sql):
+                response = self.get_response(request)
+        finally:
+            metrics.HTTP_REQUESTS_IN_PROGRESS.dec()
+        match = request.resolver_match
+        view = (match.view_name if match else None) or 'sin_vista'
+        metrics.HTTP_REQUESTS.inc(method=request.method, view=view, status=response.status_code)
+        metrics.HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, view=view)
+        metrics.DB_QUERIES.inc(sql[0], view=view)
+        metrics.DB_REQUEST_DURATION.observe(sql[1], view=view)
+        metrics.REGISTRY.maybe_flush(self.flush_interval)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Mide SQL (cantidad y tiempo), render de templates y HTTP saliente de cada
+    request y los devuelve en el header Server-Timing. Con SAMPLE_RATE > 0 corre
+    cProfile sobre una muestra de requests y guarda el volcado de los que superan
+    SLOW_REQUEST_MS, para abrirlo con snakeviz o pstats.
+    """
+
+    def __init__(self, get_response):
+        config = {**DEFAULT_PROFILING_CONFIG, **getattr(settings, 'PROFILING_CONFIG', {})}
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = config['SAMPLE_RATE']
+        self.slow_request_ms = config['SLOW_REQUEST_MS']
+        self.dump_dir = config['DUMP_DIR'] or os.path.join(settings.BASE_DIR, 'profiles')
+        instrument_templates()
+
+    def __call__(self, request):
+        with profile_request() as profile, connection.execute_wrapper(profile.execute_wrapper):
+            if self.sample_rate and random.random() < self.sample_rate:
+                response = self.sampled(request, profile)
+            else:
+                response = self.get_response(request)
+            response['Server-Timing'] = profile.server_timing()
+        return response
+
+    def sampled(self, request, profile):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Otro perfilador ya está activo en este hilo
+            return self.get_response(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        if profile.total_ms >= self.slow_request_ms:
+            self.dump(profiler, request, profile)
+        return response
+
+    def dump(self, profiler, request, profile):
+        os.makedirs(self.dump_dir, exist_ok=True)
+        name = request.path.strip('/').replace('/', '_') or 'home'
+        path = os.path.join(self.dump_dir, f'{name}-{int(time.time() * 1000)}-{profile.total_ms:.0f}ms.prof')
+        profiler.dump_stats(path)
+        logger.warning(
+            'Request lento %s %s (%.0f ms, %d consultas): perfil en %s',
+            request.method, request.path, profile.total_ms, profile.sql_count, path,
+        )
+
+
+class DuplicateQueryMiddleware:
+    """
+    Agrupa las consultas de cada request por forma normalizada y registra un
+    warning con el origen de las que se repiten THRESHOLD veces o más: relaciones
+    cargadas fila por fila desde un template o la misma consulta ejecutada dos veces.
+    """
+
+    def __init__(self, get_response):
+        config = {**DEFAULT_QUERYCHECK_CONFIG, **getattr(settings, 'QUERYCHECK_CONFIG', {})}
+        if not config['ENABLED']:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = config['THRESHOLD']
+
+    def __call__(self, request):
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        repeated = recorder.repeated(self.threshold)
+        if repeated:
+            logger.warning(
+                'Consultas repetidas en %s %s (%d en total):\n%s',
+                request.method, request.path, recorder.total, describe(repeated),
+            )
+        return response
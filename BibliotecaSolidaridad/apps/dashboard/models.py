@@ -26,3 +26,7 @@ class Notification(models.Model):
         db_table = 'notifications'
         verbose_name = 'Notificación'
         verbose_name_plural = 'Notificaciones'
+        indexes = [
+            # Conteo de no leídas y listado de cada usuario
+            models.Index(fields=['user', 'read', '-created_at'], name='notifications_user_idx'),
+        ]
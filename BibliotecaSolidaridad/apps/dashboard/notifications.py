@@ -0,0 +1,103 @@
+from collections import Counter
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from . import events, metrics
+from .models import Notification
+
+# Filas por INSERT en las altas masivas
+BULK_BATCH_SIZE = 1000
+
+
+def unread_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+class NotificationService:
+    """
+    Alta y lectura de notificaciones. La cantidad de no leídas de cada usuario
+    (el badge de la barra de navegación) vive en el cache: se calcula con un
+    COUNT la primera vez y después se ajusta con incr/decr en cada alta o
+    lectura, así el badge no consulta la base mientras el cache esté tibio.
+    Los ajustes se aplican al confirmarse la transacción, y el timeout
+    (DASHBOARD_CONFIG['UNREAD_CACHE_TIMEOUT']) acota cualquier desvío.
+    """
+
+    @staticmethod
+    def timeout():
+        return settings.DASHBOARD_CONFIG.get('UNREAD_CACHE_TIMEOUT', 3600)
+
+    @staticmethod
+    def notify(user, message):
+        """Crea una notificación para un usuario"""
+        return NotificationService.notify_many([(user.pk, message)])[0]
+
+    @staticmethod
+    def notify_users(user_ids, message):
+        """El mismo mensaje para muchos usuarios. Devuelve la cantidad creada."""
+        return len(NotificationService.notify_many((user_id, message) for user_id in user_ids))
+
+    @staticmethod
+    def notify_many(entries):
+        """
+        Alta masiva a partir de pares (user_id, mensaje): INSERTs de a
+        BULK_BATCH_SIZE filas y un incr por usuario que ya tenga su cantidad en
+        el cache (los demás la calculan cuando la necesiten).
+        """
+        notifications = [Notification(user_id=user_id, message=message) for user_id, message in entries]
+        if not notifications:
+            return []
+        Notification.objects.bulk_create(notifications, batch_size=BULK_BATCH_SIZE)
+        added = Counter(notification.user_id for notification in notifications)
+        transaction.on_commit(lambda: NotificationService._adjust(added))
+        latest = {notification.user_id: notification.message for notification in notifications}
+        events.publish_many([
+            ([events.user_channel(user_id)], 'notification', {'count': count, 'message': latest[user_id]})
+            for user_id, count in added.items()
+        ])
+        metrics.NOTIFICATIONS_CREATED.inc(len(notifications))
+        return notifications
+
+    @staticmethod
+    def unread_count(user):
+        key = unread_key(user.pk)
+        count = cache.get(key)
+        if count is not None:
+            metrics.NOTIFICATION_COUNT_CACHE.inc(result='hit')
+            return max(count, 0)
+        metrics.NOTIFICATION_COUNT_CACHE.inc(result='miss')
+        count = Notification.objects.filter(user=user, read=False).count()
+        # add y no set: si entretanto otro proceso ya la guardó y ajustó, se respeta la suya
+        cache.add(key, count, NotificationService.timeout())
+        return cache.get(key, count)
+
+    @staticmethod
+    def mark_read(user, ids):
+        """Marca como leídas las notificaciones indicadas del usuario. Devuelve cuántas cambiaron."""
+        updated = Notification.objects.filter(user=user, pk__in=ids, read=False).update(read=True)
+        if updated:
+            transaction.on_commit(lambda: NotificationService._adjust({user.pk: -updated}))
+            events.publish([events.user_channel(user.pk)], 'notifications_read', count=updated)
+        return updated
+
+    @staticmethod
+    def mark_all_read(user):
+        """Todas las no leídas del usuario en un solo UPDATE"""
+        updated = Notification.objects.filter(user=user, read=False).update(read=True)
+        transaction.on_commit(lambda: cache.set(unread_key(user.pk), 0, NotificationService.timeout()))
+        events.publish([events.user_channel(user.pk)], 'notifications_read', all=True)
+        return updated
+
+    @staticmethod
+    def _adjust(deltas):
+        """Aplica los incrementos sólo a las cantidades que ya están en el cache"""
+        keys = {unread_key(user_id): delta for user_id, delta in deltas.items() if delta}
+        for key in cache.get_many(list(keys)):
+            try:
+                if keys[key] > 0:
+                    cache.incr(key, keys[key])
+                else:
+                    cache.decr(key, -keys[key])
+            except ValueError:
+                # Expiró entre el get_many y el incr: la próxima lectura la recalcula
+                pass
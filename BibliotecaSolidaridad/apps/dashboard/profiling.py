@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.template.backends.django import Template
+
+_current = ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """Tiempos acumulados de un request: SQL, render de templates y HTTP saliente"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        self.template_ms = 0.0
+        self.http_ms = 0.0
+        self.http_count = 0
+        self.template_depth = 0
+
+    @property
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (time.perf_counter() - started) * 1000
+            self.sql_count += 1
+
+    def server_timing(self):
+        """Valor del header Server-Timing (https://www.w3.org/TR/server-timing/)"""
+        return ', '.join([
+            f'sql;dur={self.sql_ms:.1f};desc="consultas SQL: {self.sql_count}"',
+            f'tpl;dur={self.template_ms:.1f};desc="templates"',
+            f'http;dur={self.http_ms:.1f};desc="llamadas HTTP: {self.http_count}"',
+            f'total;dur={self.total_ms:.1f}',
+        ])
+
+
+def current_profile():
+    return _current.get()
+
+
+@contextmanager
+def profile_request():
+    """Activa un RequestProfile para el código que corre dentro del bloque"""
+    profile = RequestProfile()
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(kind):
+    """
+    Suma la duración del bloque al request en curso (`kind` es 'http' o 'template').
+    Sin un request perfilado activo, sólo cuesta una lectura de la ContextVar.
+    """
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - started) * 1000
+        if kind == 'http':
+            profile.http_ms += elapsed
+            profile.http_count += 1
+        else:
+            profile.template_ms += elapsed
+
+
+def _profiled_render(render):
+    def wrapper(self, context=None, request=None):
+        profile = _current.get()
+        if profile is None:
+            return render(self, context, request)
+        # Un render_to_string dentro de otro render no se cuenta dos veces
+        profile.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context, request)
+        finally:
+            profile.template_depth -= 1
+            if not profile.template_depth:
+                profile.template_ms += (time.perf_counter() - started) * 1000
+
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument_templates():
+    """Envuelve Template.render del backend de Django una sola vez por proceso"""
+    if not getattr(Template.render, 'profiled', False):
+        Template.render = _profiled_render(Template.render)
@@ -0,0 +1,115 @@
+import os
+import re
+import sys
+from collections import namedtuple
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+
+# Normalización de SQL para agrupar consultas con la misma forma
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|:\w+')
+_IN_LIST = re.compile(r'\bIN \((?:\s*\?\s*,?)+\)', re.IGNORECASE)
+_SPACES = re.compile(r'\s+')
+
+_TEMPLATE_BASE = os.path.join('django', 'template', 'base.py')
+_INSTRUMENTATION = {
+    os.path.join(os.path.dirname(__file__), name) for name in ('querycheck.py', 'middleware.py', 'profiling.py')
+}
+
+RepeatedQuery = namedtuple('RepeatedQuery', 'shape count origin example')
+
+
+def normalize(sql):
+    """
+    Reduce una consulta a su forma: sin literales, con las listas IN colapsadas.
+    Dos consultas que sólo difieren en los parámetros tienen la misma forma.
+    """
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def _origin():
+    """
+    Primer frame del proyecto (o template) desde la consulta hacia afuera,
+    salteando Django y la instrumentación de este paquete.
+    """
+    base_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        filename = code.co_filename
+        if code.co_name == '_render' and filename.endswith(_TEMPLATE_BASE):
+            origin = getattr(frame.f_locals.get('self'), 'origin', None)
+            if origin is not None:
+                return f'template {origin.template_name}'
+        elif (
+            filename.startswith(base_dir)
+            and filename not in _INSTRUMENTATION
+            and f'{os.sep}site-packages{os.sep}' not in filename
+        ):
+            return f'{os.path.relpath(filename, base_dir)}:{frame.f_lineno} en {code.co_name}'
+        frame = frame.f_back
+    return 'desconocido'
+
+
+class QueryShapeRecorder:
+    """execute_wrapper que agrupa las consultas de un bloque por forma normalizada"""
+
+    def __init__(self):
+        # forma -> [cantidad, orígenes distintos en orden de aparición, ejemplo]
+        self.shapes = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        shape = normalize(sql)
+        entry = self.shapes.get(shape)
+        if entry is None:
+            entry = self.shapes[shape] = [0, {}, sql]
+        entry[0] += 1
+        entry[1][_origin()] = None
+        return execute(sql, params, many, context)
+
+    @property
+    def total(self):
+        return sum(entry[0] for entry in self.shapes.values())
+
+    def repeated(self, threshold):
+        """Formas que se ejecutaron `threshold` veces o más, de la más repetida a la menos"""
+        return sorted(
+            (
+                RepeatedQuery(shape, count, list(origins), example)
+                for shape, (count, origins, example) in self.shapes.items()
+                if count >= threshold
+            ),
+            key=lambda query: -query.count,
+        )
+
+
+def describe(repeated):
+    return '\n'.join(
+        f"  {query.count}x desde {', '.join(query.origin[:3])}: {query.shape[:200]}"
+        for query in repeated
+    )
+
+
+@contextmanager
+def record_queries():
+    recorder = QueryShapeRecorder()
+    with connection.execute_wrapper(recorder):
+        yield recorder
+
+
+class DuplicateQueryAssertionsMixin:
+    """Aserciones contra consultas repetidas (N+1 o duplicadas) para usar en los TestCase"""
+
+    @contextmanager
+    def assertNoDuplicateQueries(self, threshold=2):
+        with record_queries() as recorder:
+            yield recorder
+        repeated = recorder.repeated(threshold)
+        if repeated:
+            self.fail(f'Consultas repetidas ({threshold} o más veces con la misma forma):\n{describe(repeated)}')
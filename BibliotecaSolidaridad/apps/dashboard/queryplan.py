@@ -0,0 +1,39 @@
+import re
+from django.db import connection
+
+# Líneas del plan que indican un recorrido completo de la tabla:
+#   SQLite:     "SCAN loans" (sin "USING INDEX")
+#   PostgreSQL: "Seq Scan on loans"
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW|SUBQUERY)(?P<table>\w+)(?!.*\bUSING\b)'),
+    'postgresql': re.compile(r'\bSeq Scan on (?P<table>\w+)'),
+}
+
+
+def full_table_scans(queryset):
+    """
+    Devuelve las tablas que el plan de ejecución de `queryset` recorre completas.
+    Una lista vacía significa que todas las tablas se acceden por índice.
+    """
+    pattern = FULL_SCAN_PATTERNS.get(connection.vendor)
+    if pattern is None:
+        return []
+    plan = queryset.explain()
+    return [match.group('table') for match in pattern.finditer(plan)]
+
+
+def analyze():
+    """Actualiza las estadísticas del planificador, como haría un ANALYZE periódico en producción"""
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+class QueryPlanAssertionsMixin:
+    """Aserciones de plan de ejecución para usar en los TestCase"""
+
+    def assertUsesIndexes(self, queryset):
+        scans = full_table_scans(queryset)
+        self.assertEqual(
+            scans, [],
+            f"Recorrido completo de {', '.join(scans)}:\n{queryset.explain()}"
+        )
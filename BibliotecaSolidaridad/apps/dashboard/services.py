@@ -0,0 +1,168 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, F, Q, Value
+from django.utils import timezone
+from apps.books.models import Book, Category
+from apps.loans.models import Loan
+from apps.newsletter.models import NewsletterCampaign
+from apps.users.models import User
+from .models import DashboardMetric
+
+# Filas de cada ranking del tablero
+RANKING_SIZE = {'popular_book': 10, 'top_user': 10, 'popular_category': 8}
+
+
+class DashboardService:
+    """
+    Cifras del tablero. Las agregaciones recorren todos los préstamos, así que
+    el scheduler (manage.py run_scheduler) las precalcula cada tanto en
+    DashboardMetric y la vista las lee de ahí; si no hay un resumen reciente
+    se calculan en el momento.
+    """
+
+    @staticmethod
+    def compute_totals():
+        """Totales de usuarios y préstamos, cada grupo en una sola consulta"""
+        totals = User.objects.aggregate(
+            total_users=Count('id'),
+            active_members=Count('id', filter=Q(is_active_member=True)),
+            excellent=Count('id', filter=Q(score__gte=4.0)),
+            good=Count('id', filter=Q(score__gte=3.0, score__lt=4.0)),
+            fair=Count('id', filter=Q(score__gte=2.0, score__lt=3.0)),
+            poor=Count('id', filter=Q(score__lt=2.0)),
+        )
+        today = timezone.now().date()
+        totals.update(Loan.objects.filter(status__in=Loan.OPEN_STATUSES).aggregate(
+            active_loans=Count('id', filter=Q(status='active')),
+            overdue_loans=Count('id', filter=Q(status='overdue')),
+            avg_overdue=Avg(
+                ExpressionWrapper(Value(today) - F('due_date'), output_field=DurationField()),
+                filter=Q(status='overdue'),
+            ),
+        ))
+        avg_overdue = totals.pop('avg_overdue')
+        totals['avg_overdue_days'] = round(avg_overdue.total_seconds() / 86400) if avg_overdue else 0
+        totals['available_books'] = Book.objects.total_available()
+        return totals
+
+    @staticmethod
+    def ranking_querysets():
+        """
+        Rankings del tablero como {ranking: (queryset anotado, campos anotados)}.
+        Sin resumen se muestran tal cual; el resumen guarda sólo ids y conteos.
+        """
+        return {
+            'popular_book': (
+                Book.objects.annotate(loan_count=Count('loan'))
+                .order_by('-loan_count', 'id')[:RANKING_SIZE['popular_book']],
+                ('loan_count',),
+            ),
+            'top_user': (
+                User.objects.annotate(
+                    completed_loans=Count('loan', filter=Q(loan__status='returned'), distinct=True),
+                    review_count=Count('review', distinct=True),
+                ).order_by('-score', 'id')[:RANKING_SIZE['top_user']],
+                ('completed_loans', 'review_count'),
+            ),
+            'popular_category': (
+                Category.objects.annotate(
+                    book_count=Count('libros', distinct=True),
+                    loan_count=Count('libros__loan'),
+                ).order_by('-loan_count', 'id')[:RANKING_SIZE['popular_category']],
+                ('book_count', 'loan_count'),
+            ),
+        }
+
+    @staticmethod
+    def rollup():
+        """
+        Recalcula el resumen del tablero y lo reemplaza en DashboardMetric.
+        Nombres: 'total:<cifra>' y '<ranking>:<posición>:<pk>:<campo>'.
+        """
+        rows = [
+            DashboardMetric(name=f'total:{key}', value=value)
+            for key, value in DashboardService.compute_totals().items()
+        ]
+        for ranking, (queryset, fields) in DashboardService.ranking_querysets().items():
+            for position, obj in enumerate(queryset):
+                rows.extend(
+                    DashboardMetric(name=f'{ranking}:{position}:{obj.pk}:{field}', value=getattr(obj, field))
+                    for field in fields
+                )
+        with transaction.atomic():
+            DashboardMetric.objects.all().delete()
+            DashboardMetric.objects.bulk_create(rows)
+        return len(rows)
+
+    @staticmethod
+    def snapshot(max_age=None):
+        """
+        Último resumen como (totales, {ranking: [(pk, {campo: valor}), ...]}),
+        o None si no hay o es más viejo que `max_age` segundos.
+        """
+        if max_age is None:
+            max_age = settings.DASHBOARD_CONFIG.get('ROLLUP_MAX_AGE', 900)
+        rows = list(DashboardMetric.objects.values_list('name', 'value', 'updated_at'))
+        if not rows or min(row[2] for row in rows) < timezone.now() - timedelta(seconds=max_age):
+            return None
+
+        totals = {}
+        rankings = defaultdict(dict)
+        for name, value, _ in rows:
+            kind, _, rest = name.partition(':')
+            if kind == 'total':
+                totals[rest] = value
+            elif kind in RANKING_SIZE:
+                position, pk, field = rest.split(':')
+                rankings[kind].setdefault((int(position), int(pk)), {})[field] = value
+        return totals, {
+            kind: [(pk, fields) for (_, pk), fields in sorted(rankings.get(kind, {}).items())]
+            for kind in RANKING_SIZE
+        }
+
+    @staticmethod
+    def load(max_age=None):
+        """
+        Datos del tablero listos para la plantilla: (totales, libros populares,
+        mejores usuarios, categorías populares), del resumen si está fresco.
+        """
+        snapshot = DashboardService.snapshot(max_age)
+        if snapshot is None:
+            rankings = DashboardService.ranking_querysets()
+            return (
+                DashboardService.compute_totals(),
+                list(rankings['popular_book'][0]),
+                list(rankings['top_user'][0]),
+                list(rankings['popular_category'][0]),
+            )
+        totals, rankings = snapshot
+        return (
+            totals,
+            DashboardService._hydrate(Book, rankings['popular_book']),
+            DashboardService._hydrate(User, rankings['top_user']),
+            DashboardService._hydrate(Category, rankings['popular_category']),
+        )
+
+    @staticmethod
+    def recent_campaigns(limit=10):
+        """Últimas campañas enviadas con sus tasas de apertura y clics (contadores ya agregados)"""
+        return list(
+            NewsletterCampaign.objects.filter(started_at__isnull=False)
+            .only('title', 'started_at', 'total_sent', 'unique_opens', 'unique_clicks')
+            .order_by('-started_at')[:limit]
+        )
+
+    @staticmethod
+    def _hydrate(model, entries):
+        """Carga los objetos del ranking en una consulta y les agrega sus conteos"""
+        objects = model.objects.in_bulk([pk for pk, _ in entries])
+        ranked = []
+        for pk, fields in entries:
+            if pk in objects:
+                obj = objects[pk]
+                for field, value in fields.items():
+                    setattr(obj, field, value)
+                ranked.append(obj)
+        return ranked
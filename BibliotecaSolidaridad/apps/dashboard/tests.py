@@ -1,3 +1,503 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, F, Q
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from apps.books.models import Book, BookStock, Category
+from apps.loans.models import Loan
+from apps.newsletter.models import NewsletterSubscriber
+from apps.users.models import User, UserProfile
+from . import events, metrics
+from .management.commands.benchmark_http import percentile, stub_openlibrary
+from .middleware import DuplicateQueryMiddleware
+from .context_processors import notifications
+from .models import DashboardMetric, Notification
+from .notifications import NotificationService
+from .services import DashboardService
+from .querycheck import DuplicateQueryAssertionsMixin, normalize, record_queries
 
-# Create your tests here.
+
+class GenerateDatasetTests(TestCase):
+    def generate(self, **sizes):
+        options = dict(
+            categories=5, books=200, users=50, loans=1000,
+            requests=100, reviews=300, subscribers=40, seed=7,
+        )
+        options.update(sizes)
+        call_command('generate_dataset', stdout=StringIO(), **options)
+
+    def test_generates_requested_volume(self):
+        self.generate()
+
+        self.assertEqual(Category.objects.count(), 5)
+        self.assertEqual(Book.objects.count(), 200)
+        self.assertEqual(Loan.objects.count(), 1000)
+        self.assertEqual(NewsletterSubscriber.objects.count(), 40)
+        self.assertEqual(BookStock.objects.values('book').distinct().count(), 200)
+        # Los perfiles se crean en bloque, sin pasar por la señal post_save
+        self.assertEqual(UserProfile.objects.count(), User.objects.count())
+
+    def test_keeps_historical_dates_and_counters(self):
+        self.generate()
+
+        self.assertTrue(Loan.objects.filter(loan_date__lt=Loan.objects.latest('loan_date').loan_date).exists())
+        self.assertFalse(
+            User.objects.annotate(
+                open_loans=Count('loan', filter=Q(loan__status__in=Loan.OPEN_STATUSES))
+            ).exclude(active_loans_count=F('open_loans')).exists()
+        )
+        self.assertTrue(Loan._meta.get_field('loan_date').auto_now_add)
+
+    def test_copies_follow_the_loans(self):
+        self.generate()
+
+        open_loans = Loan.objects.filter(status__in=Loan.OPEN_STATUSES)
+        self.assertTrue(open_loans.exists())
+        self.assertFalse(Loan.objects.filter(copy__isnull=True).exists())
+        # Cada préstamo abierto tiene su propio ejemplar prestado, y no hay prestados sin préstamo
+        self.assertEqual(
+            set(open_loans.values_list('copy_id', flat=True)),
+            set(BookStock.objects.filter(status='borrowed').values_list('id', flat=True)),
+        )
+        self.assertEqual(open_loans.values('copy').distinct().count(), open_loans.count())
+        self.assertFalse(open_loans.exclude(copy__book=F('book')).exists())
+        self.assertFalse(Loan.objects.filter(status='lost').exclude(copy__status='lost').exists())
+        self.assertEqual(Book.objects.sync_copies(), 0)
+
+    def test_popularity_is_skewed(self):
+        self.generate(books=500, loans=5000)
+
+        counts = list(
+            Loan.objects.values('book').annotate(total=Count('id')).order_by('-total')
+            .values_list('total', flat=True)
+        )
+        # El 10% de los libros más prestados concentra buena parte de los préstamos
+        self.assertGreater(sum(counts[:50]), 0.4 * sum(counts))
+
+
+class BenchmarkHttpTests(TransactionTestCase):
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_in_process_run_writes_json_report(self):
+        call_command(
+            'generate_dataset', stdout=StringIO(),
+            categories=3, books=30, users=10, loans=100, requests=20, reviews=20, subscribers=5,
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command(
+                'benchmark_http', stdout=StringIO(), output=output,
+                scenarios=['home', 'book_detail', 'loan_approve'],
+                concurrency=2, requests=6, warmup=2,
+            )
+            with open(output, encoding='utf-8') as handle:
+                report = json.load(handle)
+
+        self.assertEqual(report['mode'], 'in-process')
+        home = report['scenarios']['home']
+        self.assertEqual(home['requests'], 6)
+        self.assertEqual(home['errors'], 0)
+        self.assertGreater(home['queries_per_request'], 0)
+        self.assertLessEqual(home['p50_ms'], home['p99_ms'])
+        self.assertEqual(report['scenarios']['loan_approve']['errors'], 0)
+
+
+def server_timing(response):
+    """Convierte el header Server-Timing en {métrica: (duración, descripción)}"""
+    metrics = {}
+    for entry in response['Server-Timing'].split(', '):
+        name, *params = entry.split(';')
+        values = dict(param.split('=', 1) for param in params)
+        metrics[name] = (float(values['dur']), values.get('desc', '').strip('"'))
+    return metrics
+
+
+class ProfilingMiddlewareTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Rayuela', authors=['Julio Cortázar'])
+
+    @override_settings(PROFILING_CONFIG={'ENABLED': True})
+    def test_reports_sql_templates_and_http(self):
+        with mock.patch('apps.books.openlibrary.requests.get', side_effect=stub_openlibrary):
+            response = self.client.get(reverse('book_search') + '?q=rayuela')
+
+        metrics = server_timing(response)
+        self.assertEqual(set(metrics), {'sql', 'tpl', 'http', 'total'})
+        self.assertEqual(metrics['sql'][1], 'consultas SQL: 1')
+        self.assertEqual(metrics['http'][1], 'llamadas HTTP: 1')
+        self.assertGreater(metrics['tpl'][0], 0)
+        self.assertGreaterEqual(metrics['total'][0], metrics['tpl'][0])
+
+    @override_settings(PROFILING_CONFIG={'ENABLED': False})
+    def test_disabled_adds_no_header(self):
+        response = self.client.get(reverse('home'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    def test_dumps_sampled_slow_requests(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'ENABLED': True, 'SAMPLE_RATE': 1.0, 'SLOW_REQUEST_MS': 0, 'DUMP_DIR': directory}
+            with override_settings(PROFILING_CONFIG=config), self.assertLogs('apps.dashboard.middleware'):
+                self.client.get(reverse('book_detail', args=[self.book.id]))
+            dumps = os.listdir(directory)
+
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].startswith('books_'))
+        self.assertTrue(dumps[0].endswith('.prof'))
+
+
+class DuplicateQueryDetectorTests(DuplicateQueryAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('bibliotecaria', dni='L1', role='librarian')
+        books = Book.objects.bulk_create(Book(title=f'Libro {i}', authors=['Autor']) for i in range(5))
+        Loan.objects.bulk_create(
+            Loan(user=cls.librarian, book=book, due_date='2026-01-01') for book in books
+        )
+
+    def test_normalize_ignores_literals_and_in_lists(self):
+        self.assertEqual(
+            normalize("SELECT * FROM books WHERE id IN (%s, %s, %s) AND title = 'x'  LIMIT 21"),
+            normalize('SELECT * FROM books WHERE id IN (%s) AND title = %s LIMIT 5'),
+        )
+
+    def test_flags_lazy_loads_with_origin(self):
+        with record_queries() as recorder:
+            titles = [loan.book.title for loan in Loan.objects.all()]
+
+        self.assertEqual(len(titles), 5)
+        [repeated] = recorder.repeated(threshold=2)
+        self.assertEqual(repeated.count, 5)
+        self.assertIn('FROM "books"', repeated.shape)
+        self.assertTrue(repeated.origin[0].startswith('apps/dashboard/tests.py:'))
+
+    def test_assertion_fails_on_repeated_shapes(self):
+        with self.assertRaisesMessage(AssertionError, '5x desde'):
+            with self.assertNoDuplicateQueries():
+                [loan.book.title for loan in Loan.objects.all()]
+
+        with self.assertNoDuplicateQueries():
+            [loan.book.title for loan in Loan.objects.select_related('book')]
+
+    @override_settings(QUERYCHECK_CONFIG={'ENABLED': True, 'THRESHOLD': 2})
+    def test_middleware_logs_repeated_queries(self):
+        def view(request):
+            return HttpResponse(', '.join(loan.book.title for loan in Loan.objects.all()))
+
+        middleware = DuplicateQueryMiddleware(view)
+        with self.assertLogs('apps.dashboard.middleware', 'WARNING') as logs:
+            middleware(RequestFactory().get('/prestamos/'))
+        self.assertIn('5x desde apps/dashboard/tests.py', logs.output[0])
+
+        self.client.force_login(self.librarian)
+        with self.assertNoLogs('apps.dashboard.middleware'):
+            self.client.get(reverse('manage_loans'))
+
+
+class MetricsTests(TestCase):
+    def test_renders_prometheus_text_format(self):
+        registry = metrics.Registry()
+        requests_total = registry.counter('requests_total', 'Requests', ('view',))
+        latency = registry.histogram('latency_seconds', 'Latencia', buckets=(0.1, 1.0))
+        requests_total.inc(view='home')
+        requests_total.inc(2, view='home')
+        for value in (0.05, 0.5, 3):
+            latency.observe(value)
+
+        text = registry.render()
+        self.assertIn('# TYPE requests_total counter\nrequests_total{view="home"} 3.0', text)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('latency_seconds_count 3', text)
+        with self.assertRaises(ValueError):
+            requests_total.inc(status=200)
+
+    def test_aggregates_across_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'ENABLED': True, 'MULTIPROCESS_DIR': directory}
+            with override_settings(METRICS_CONFIG=config):
+                workers = [metrics.Registry(), metrics.Registry()]
+                for i, registry in enumerate(workers):
+                    registry.process_id = f'worker-{i}'
+                    registry.counter('emails_total', 'Emails', ('result',)).inc(i + 1, result='sent')
+                    registry.histogram('send_seconds', 'Envío', buckets=(1.0,)).observe(0.5)
+                workers[0].flush()
+                merged = workers[1].collect()
+
+        self.assertEqual(merged['emails_total']['samples'], [[['sent'], 3]])
+        self.assertEqual(merged['send_seconds']['samples'][0][1]['count'], 2)
+
+    def test_gauges_only_count_live_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = {'ENABLED': True, 'MULTIPROCESS_DIR': directory}
+            with override_settings(METRICS_CONFIG=config):
+                dead_pid = subprocess.Popen([sys.executable, '-c', '']).pid
+                os.waitpid(dead_pid, 0)
+                # Un worker que terminó, un volcado viejo del pid de este proceso y este proceso
+                workers = {
+                    f'{dead_pid}-1000': 5,
+                    f'{os.getpid()}-1000': 7,
+                    f'{os.getpid()}-2000': 1,
+                }
+                for process_id, in_progress in workers.items():
+                    registry = metrics.Registry()
+                    registry.process_id = process_id
+                    registry.gauge('in_progress', 'En curso').set(in_progress)
+                    registry.counter('served_total', 'Atendidos').inc(in_progress)
+                    registry.flush()
+                merged = metrics.Registry().collect()
+
+        self.assertEqual(merged['in_progress']['samples'], [[[], 1]])
+        self.assertEqual(merged['served_total']['samples'], [[[], 13]])
+
+    def test_endpoint_exposes_request_and_loan_metrics(self):
+        self.client.get(reverse('home'))
+        response = self.client.get(reverse('metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('http_requests_total{method="GET",view="home",status="200"}', text)
+        self.assertIn('db_request_duration_seconds_bucket{view="home",le="0.005"}', text)
+        self.assertIn('loans_open 0.0', text)
+
+    def test_endpoint_restricted_to_allowed_ips(self):
+        response = self.client.get(reverse('metrics'), REMOTE_ADDR='10.0.0.8')
+        self.assertEqual(response.status_code, 403)
+
+
+class DashboardRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        call_command(
+            'generate_dataset', stdout=StringIO(), categories=4, books=60, users=30, loans=400,
+            requests=10, reviews=50, subscribers=5, seed=11,
+        )
+        cls.librarian = User.objects.create_user('tablero', dni='T1', role='librarian')
+
+    def summary(self, loaded):
+        totals, books, users, categories = loaded
+        return (
+            totals,
+            [(book.pk, book.loan_count) for book in books],
+            [(user.pk, user.completed_loans, user.review_count) for user in users],
+            [(category.pk, category.book_count, category.loan_count) for category in categories],
+        )
+
+    def test_snapshot_matches_the_live_figures(self):
+        live = self.summary(DashboardService.load())
+        self.assertIsNone(DashboardService.snapshot())
+
+        DashboardService.rollup()
+        self.assertEqual(self.summary(DashboardService.load()), live)
+        today = timezone.now().date()
+        days = [(today - loan.due_date).days for loan in Loan.objects.filter(status='overdue')]
+        self.assertTrue(days)
+        self.assertEqual(live[0]['avg_overdue_days'], round(sum(days) / len(days)))
+
+    def test_stale_snapshot_is_ignored(self):
+        DashboardService.rollup()
+        self.assertIsNotNone(DashboardService.snapshot(max_age=60))
+        DashboardMetric.objects.update(updated_at=timezone.now() - timedelta(minutes=5))
+        self.assertIsNone(DashboardService.snapshot(max_age=60))
+
+    def test_page_reads_the_snapshot(self):
+        cache.clear()
+        self.client.force_login(self.librarian)
+        DashboardService.rollup()
+        NotificationService.unread_count(self.librarian)
+        # Sesión y usuario, el resumen, una consulta por ranking y las campañas (el badge sale del cache)
+        with self.assertNumQueries(7):
+            response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [book.pk for book in response.context['popular_books']],
+            [book.pk for book in DashboardService.ranking_querysets()['popular_book'][0]],
+        )
+
+
+class NotificationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user('avisos', dni='N1')
+        cls.others = User.objects.bulk_create(User(username=f'aviso{i}', dni=f'N{i + 2}') for i in range(2500))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_fan_out_inserts_in_batches(self):
+        user_ids = [user.pk for user in self.others]
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            created = NotificationService.notify_users(user_ids, 'La biblioteca cierra el lunes')
+
+        # Sólo INSERTs de cientos de filas (SQLite limita los parámetros por sentencia)
+        self.assertEqual(created, 2500)
+        self.assertTrue(all(query['sql'].startswith('INSERT') for query in queries))
+        self.assertLess(len(queries), 25)
+        self.assertEqual(Notification.objects.filter(read=False).count(), 2500)
+
+    def test_unread_count_is_cached_and_updated_on_create(self):
+        NotificationService.notify(self.reader, 'Uno')
+        self.assertEqual(NotificationService.unread_count(self.reader), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.notify_many([(self.reader.pk, 'Dos'), (self.reader.pk, 'Tres')])
+        with self.assertNumQueries(0):
+            self.assertEqual(NotificationService.unread_count(self.reader), 3)
+
+    def test_mark_read_and_mark_all_read(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first, *_ = NotificationService.notify_many([(self.reader.pk, f'Aviso {i}') for i in range(4)])
+        self.assertEqual(NotificationService.unread_count(self.reader), 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(NotificationService.mark_read(self.reader, [first.pk]), 1)
+        self.assertEqual(NotificationService.unread_count(self.reader), 3)
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(1):
+            self.assertEqual(NotificationService.mark_all_read(self.reader), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(NotificationService.unread_count(self.reader), 0)
+
+    def test_badge_costs_no_queries_on_warm_cache(self):
+        NotificationService.notify(self.reader, 'Uno')
+        NotificationService.unread_count(self.reader)
+        request = RequestFactory().get('/')
+        request.user = self.reader
+
+        with self.assertNumQueries(0):
+            self.assertEqual(str(notifications(request)['unread_notifications']), '1')
+
+    def test_mark_all_read_view(self):
+        NotificationService.notify(self.reader, 'Uno')
+        self.client.force_login(self.reader)
+
+        response = self.client.get(reverse('notifications'))
+        self.assertContains(response, 'Uno')
+        self.assertContains(response, 'badge rounded-pill')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('mark_all_notifications_read'))
+        self.assertRedirects(response, reverse('notifications'))
+        self.assertFalse(Notification.objects.filter(user=self.reader, read=False).exists())
+        self.assertEqual(NotificationService.unread_count(self.reader), 0)
+
+
+def publish_when_connected(*messages, connections=1):
+    """Publica desde otro hilo (como una vista sincrónica) apenas hay conexiones abiertas"""
+    def run():
+        deadline = time.monotonic() + 5
+        while events.BROKER.connections() < connections and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for channel, event, data in messages:
+            events.BROKER.publish(channel, event, data)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+class EventTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('mostrador', dni='E1', role='librarian')
+        cls.reader = User.objects.create_user('oyente', dni='E2')
+        cls.book = Book.objects.create(title='Ficciones', authors=['Jorge Luis Borges'])
+        BookStock.objects.create(book=cls.book, physical_id='FIC-1', status='available')
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_broker_delivers_across_threads(self):
+        subscription = events.BROKER.subscribe(['user:1', events.LIBRARIANS])
+        try:
+            thread = publish_when_connected(
+                (events.LIBRARIANS, 'loan_request', {'book': 'Ficciones'}),
+                ('user:2', 'notification', {'count': 1}),
+            )
+            event, data, _ = await subscription.get(timeout=2)
+            self.assertEqual((event, data), ('loan_request', {'book': 'Ficciones'}))
+            # El evento de otro usuario no llega
+            self.assertIsNone(await subscription.get(timeout=0.05))
+            await asyncio.to_thread(thread.join)
+        finally:
+            subscription.close()
+        self.assertEqual(events.BROKER.connections(), 0)
+
+    async def test_slow_client_gets_resync(self):
+        subscription = events.BROKER.subscribe(['user:1'], size=2)
+        try:
+            thread = publish_when_connected(*[('user:1', 'notification', {'count': 1})] * 5)
+            await asyncio.to_thread(thread.join)
+            await asyncio.sleep(0)
+            received = [(await subscription.get(timeout=1))[0] for _ in range(3)]
+        finally:
+            subscription.close()
+        self.assertEqual(received, ['notification', 'notification', 'resync'])
+
+    @override_settings(EVENTS_CONFIG={'KEEPALIVE': 0.05, 'MAX_DURATION': 0.5})
+    async def test_stream_pushes_events_over_asgi(self):
+        client = AsyncClient()
+        await client.aforce_login(self.reader)
+        thread = publish_when_connected(
+            (events.user_channel(self.reader.pk), 'loan_approved', {'book': 'Ficciones'}),
+        )
+        response = await client.get(reverse('event_stream'))
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        await asyncio.to_thread(thread.join)
+
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertIn('event: loan_approved', body)
+        self.assertIn('data: {"book": "Ficciones"}', body)
+        self.assertIn(': keepalive', body)
+        self.assertEqual(events.BROKER.connections(), 0)
+
+    def test_stream_is_not_served_over_wsgi(self):
+        self.client.force_login(self.reader)
+        self.assertEqual(self.client.get(reverse('event_stream')).status_code, 204)
+
+    def test_polling_uses_conditional_gets(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('event_state'))
+        self.assertEqual(response.json(), {'unread_notifications': 0, 'pending_requests': 0})
+        etag = response['ETag']
+
+        # Sin novedades: 304 con sólo la sesión y el usuario
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('event_state'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(self.reader)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('submit_loan_request'), {'book_id': self.book.pk})
+
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('event_state'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['pending_requests'], 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_notifications_bump_the_user_channel(self):
+        before = events.versions([events.user_channel(self.reader.pk)])
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationService.notify(self.reader, 'Hola')
+        self.assertEqual(events.versions([events.user_channel(self.reader.pk)]), [before[0] + 1])
@@ -3,4 +3,8 @@ from . import views
 
 urlpatterns = [
     path('', views.dashboard, name='dashboard'),
+    path('notificaciones/', views.notifications, name='notifications'),
+    path('notificaciones/leidas/', views.mark_all_notifications_read, name='mark_all_notifications_read'),
+    path('eventos/', views.event_stream, name='event_stream'),
+    path('eventos/estado/', views.event_state, name='event_state'),
 ]
\ No newline at end of file
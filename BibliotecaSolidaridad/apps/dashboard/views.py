@@ -1,9 +1,17 @@
+import asyncio
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.shortcuts import render
-from django.db.models import Count, Avg, Q
-from apps.books.models import Book, Category, Review
-from apps.loans.models import Loan
-from apps.users.models import User
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.views.decorators.http import condition, require_POST
+from apps.loans.models import LoanRequest
+from . import events, metrics
+from .notifications import NotificationService
+from .services import DashboardService
+
+# Notificaciones que muestra la página de cada usuario
+NOTIFICATIONS_PAGE_SIZE = 50
 
 def is_librarian(user):
     return user.is_authenticated and (user.role == 'librarian' or user.role == 'admin')
@@ -11,53 +19,30 @@ def is_librarian(user):
 @login_required
 @user_passes_test(is_librarian)
 def dashboard(request):
+    # Del resumen que precalcula el scheduler, o en el momento si no hay uno reciente
+    totals, popular_books, top_users, popular_categories = DashboardService.load()
+
     # KPIs principales
     kpis = {
-        'active_loans': Loan.objects.filter(status='active').count(),
-        'active_members': User.objects.filter(is_active_member=True).count(),
-        'overdue_loans': Loan.objects.filter(status='overdue').count(),
-        'available_books': Book.objects.filter(available_copies__gt=0).count(),
+        'active_loans': totals['active_loans'],
+        'active_members': totals['active_members'],
+        'overdue_loans': totals['overdue_loans'],
+        'available_books': totals['available_books'],
     }
     
-    # Libros más prestados
-    popular_books = Book.objects.annotate(
-        loan_count=Count('loan')
-    ).order_by('-loan_count')[:10]
-    
-    # Estadísticas de morosidad
-    overdue_loans = Loan.objects.filter(status='overdue')
-    avg_overdue_days = 0
-    if overdue_loans.exists():
-        # Calcular días promedio de mora (esto es un ejemplo, necesitarías un campo para días de mora)
-        avg_overdue_days = 5  # Esto debería calcularse basado en datos reales
-    
     stats = {
-        'avg_overdue_days': avg_overdue_days,
-        'total_overdue_loans': overdue_loans.count(),
-        'users_with_low_score': User.objects.filter(score__lt=2.0).count(),
+        'avg_overdue_days': totals['avg_overdue_days'],
+        'total_overdue_loans': totals['overdue_loans'],
+        'users_with_low_score': totals['poor'],
     }
     
     # Distribución de puntuaciones
-    total_users = User.objects.count()
+    total_users = totals['total_users']
     score_distribution = {
-        'excellent': User.objects.filter(score__gte=4.0).count() / total_users * 100 if total_users > 0 else 0,
-        'good': User.objects.filter(score__gte=3.0, score__lt=4.0).count() / total_users * 100 if total_users > 0 else 0,
-        'fair': User.objects.filter(score__gte=2.0, score__lt=3.0).count() / total_users * 100 if total_users > 0 else 0,
-        'poor': User.objects.filter(score__lt=2.0).count() / total_users * 100 if total_users > 0 else 0,
+        band: totals[band] / total_users * 100 if total_users > 0 else 0
+        for band in ('excellent', 'good', 'fair', 'poor')
     }
     
-    # Mejores usuarios
-    top_users = User.objects.annotate(
-        completed_loans=Count('loan', filter=Q(loan__status='returned')),
-        review_count=Count('review')
-    ).order_by('-score')[:10]
-    
-    # Categorías populares
-    popular_categories = Category.objects.annotate(
-        book_count=Count('books'),
-        loan_count=Count('books__loan')
-    ).order_by('-loan_count')[:8]
-    
     context = {
         'kpis': kpis,
         'popular_books': popular_books,
@@ -65,6 +50,87 @@ def dashboard(request):
         'score_distribution': score_distribution,
         'top_users': top_users,
         'popular_categories': popular_categories,
+        'campaigns': DashboardService.recent_campaigns(),
     }
     
-    return render(request, 'dashboard/dashboard.html', context)
\ No newline at end of file
+    return render(request, 'dashboard/dashboard.html', context)
+
+@login_required
+def notifications(request):
+    notifications = list(request.user.notifications.order_by('-created_at')[:NOTIFICATIONS_PAGE_SIZE])
+    return render(request, 'dashboard/notifications.html', {'notifications': notifications})
+
+@login_required
+@require_POST
+def mark_all_notifications_read(request):
+    updated = NotificationService.mark_all_read(request.user)
+    if updated:
+        messages.success(request, f'{updated} notificaciones marcadas como leídas.')
+    return redirect('notifications')
+
+async def event_stream(request):
+    """
+    Server-sent events con las novedades de los canales del usuario. Sólo bajo
+    ASGI: con WSGI cada conexión ocuparía un hilo, así que responde 204 y el
+    navegador pasa al polling de /eventos/estado/.
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=403)
+
+    config = events.get_config()
+    subscription = events.BROKER.subscribe(events.channels_for(user))
+    reconnected = 'Last-Event-ID' in request.headers
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + config['MAX_DURATION']
+        try:
+            yield f"retry: {config['RETRY']}\n\n"
+            if reconnected:
+                # Lo publicado mientras estuvo desconectado no se repite: que recargue si le importa
+                yield events.format_event('resync', {})
+            while (remaining := deadline - loop.time()) > 0:
+                message = await subscription.get(min(config['KEEPALIVE'], remaining))
+                yield ': keepalive\n\n' if message is None else events.format_event(*message)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Que un proxy (nginx) no acumule la respuesta
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _event_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    return 'v' + '-'.join(str(version) for version in events.versions(events.channels_for(request.user)))
+
+@login_required
+@condition(etag_func=_event_etag)
+def event_state(request):
+    """
+    Polling de respaldo. Con If-None-Match y sin novedades responde 304 sin
+    consultar la base (las versiones están en el cache).
+    """
+    state = {'unread_notifications': NotificationService.unread_count(request.user)}
+    if request.user.role in ('librarian', 'admin'):
+        state['pending_requests'] = LoanRequest.objects.filter(status='pending').count()
+    response = JsonResponse(state)
+    response['Cache-Control'] = 'no-cache, private'
+    return response
+
+def metrics_view(request):
+    """Métricas en formato de texto de Prometheus, combinadas entre procesos"""
+    config = metrics.get_config()
+    if not config['ENABLED']:
+        raise Http404
+    if config['ALLOWED_IPS'] and request.META.get('REMOTE_ADDR') not in config['ALLOWED_IPS']:
+        return HttpResponse(status=403)
+    return HttpResponse(
+        metrics.REGISTRY.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.dashboard import metrics
+from apps.jobs.services import JobService, get_config
+
+
+class Command(BaseCommand):
+    help = (
+        'Ejecuta las tareas en segundo plano encoladas (emails de bienvenida, etc.). '
+        'Por defecto queda corriendo y consulta la cola cada POLL_INTERVAL segundos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Ejecutar las tareas vencidas y terminar (para cron)')
+        parser.add_argument('--batch-size', type=int, help='Tareas tomadas por consulta')
+        parser.add_argument('--poll-interval', type=float, help='Segundos de espera con la cola vacía')
+
+    def handle(self, *args, **options):
+        config = get_config()
+        batch_size = options['batch_size'] or config['BATCH_SIZE']
+        poll_interval = options['poll_interval'] or config['POLL_INTERVAL']
+        flush_interval = metrics.get_config()['FLUSH_INTERVAL']
+
+        if options['once']:
+            done, errors = JobService.run_pending(batch_size)
+            self.stdout.write(self.style.SUCCESS(f'{done} tareas terminadas, {errors} con error'))
+            return
+
+        self.stdout.write(f'Esperando tareas (cada {poll_interval} s, Ctrl+C para salir)')
+        try:
+            while True:
+                # Un worker de larga vida no debe quedarse con una conexión caída
+                close_old_connections()
+                done, errors = JobService.run_pending(batch_size)
+                if done or errors:
+                    self.stdout.write(f'{done} tareas terminadas, {errors} con error')
+                metrics.REGISTRY.maybe_flush(flush_interval)
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            self.stdout.write('Worker detenido')
@@ -0,0 +1,57 @@
+import signal
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from apps.dashboard import metrics
+from apps.dashboard.services import DashboardService
+from apps.jobs.scheduler import Scheduler
+from apps.loans.services import LoanService
+from apps.newsletter.scheduling import CampaignSchedule
+
+
+class Command(BaseCommand):
+    help = (
+        'Proceso de larga vida que reemplaza a los cron: envía las campañas '
+        'programadas (a través de run_jobs), barre los préstamos vencidos, '
+        'recuerda los vencimientos próximos y precalcula el resumen del tablero'
+    )
+
+    def handle(self, *args, **options):
+        config = settings.SCHEDULER_CONFIG
+        scheduler = Scheduler()
+        campaigns = CampaignSchedule(scheduler)
+
+        def task(function):
+            def run():
+                # Un proceso de larga vida no debe quedarse con una conexión caída
+                close_old_connections()
+                function()
+            return run
+
+        def sweep():
+            result = LoanService.sweep_overdue()
+            if result['overdue']:
+                self.stdout.write(f"Préstamos marcados como vencidos: {result['overdue']}")
+
+        def remind():
+            result = LoanService.send_due_reminders()
+            if result['loans']:
+                self.stdout.write(f"Recordatorios de vencimiento: {result['loans']} préstamos, {result['users']} socios")
+
+        scheduler.every(config['CAMPAIGN_CHECK_INTERVAL'], 'campaigns', task(campaigns.check))
+        scheduler.every(config['SWEEP_OVERDUE_INTERVAL'], 'sweep_overdue', task(sweep))
+        # Es idempotente: si el scheduler se reinicia y corre de nuevo el mismo día, no repite avisos
+        scheduler.every(config['DUE_REMINDER_INTERVAL'], 'due_reminders', task(remind))
+        scheduler.every(config['DASHBOARD_ROLLUP_INTERVAL'], 'dashboard_rollup', task(DashboardService.rollup))
+        scheduler.every(
+            metrics.get_config()['FLUSH_INTERVAL'], 'metrics_flush',
+            lambda: metrics.REGISTRY.maybe_flush(0), run_now=False,
+        )
+
+        signal.signal(signal.SIGTERM, lambda *_: scheduler.stop())
+        self.stdout.write('Scheduler en marcha (Ctrl+C para salir)')
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Scheduler detenido')
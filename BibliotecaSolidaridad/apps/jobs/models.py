@@ -0,0 +1,40 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    Tarea en segundo plano. La encola el request (o quien sea) y la ejecuta el
+    comando run_jobs; si falla se reprograma con espera creciente hasta agotar
+    max_attempts.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pendiente'),
+        ('running', 'En ejecución'),
+        ('done', 'Terminada'),
+        ('failed', 'Fallida'),
+    )
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    # No se ejecuta antes de este momento (reintentos con espera)
+    run_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    # Identifica la tanda que tomó la tarea, para que dos workers no se la repartan
+    claim_id = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'jobs'
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='jobs_due_idx'),
+        ]
+        verbose_name = 'Tarea'
+        verbose_name_plural = 'Tareas'
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.get_status_display()})"
@@ -0,0 +1,87 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Agenda en memoria para un proceso de larga vida: un min-heap de
+    (momento, tarea) y un sleep hasta la próxima. Las tareas periódicas se
+    reprograman solas; las puntuales se identifican con una clave y volver a
+    agendar la misma clave reemplaza la anterior (las entradas viejas se
+    descartan al salir del heap).
+    """
+
+    def __init__(self, clock=time.time, sleep=None):
+        self.clock = clock
+        self.stopped = threading.Event()
+        self.sleep = sleep or self.stopped.wait
+        self.heap = []
+        # clave -> número de la entrada vigente, para descartar las reemplazadas
+        self.current = {}
+        self.counter = itertools.count()
+
+    def _push(self, when, key, function, interval=None):
+        entry = next(self.counter)
+        self.current[key] = entry
+        heapq.heappush(self.heap, (when, entry, key, function, interval))
+
+    def every(self, interval, key, function, run_now=True):
+        """Ejecuta `function` cada `interval` segundos (la primera vez, ya)"""
+        self._push(self.clock() if run_now else self.clock() + interval, key, function, interval)
+
+    def at(self, when, key, function):
+        """Ejecuta `function` una vez en el momento `when` (timestamp)"""
+        self._push(when, key, function)
+
+    def cancel(self, key):
+        self.current.pop(key, None)
+
+    def scheduled(self, key):
+        return key in self.current
+
+    def next_due(self):
+        """Momento de la próxima tarea vigente, o None si no hay ninguna"""
+        while self.heap:
+            when, entry, key, _, _ = self.heap[0]
+            if self.current.get(key) == entry:
+                return when
+            heapq.heappop(self.heap)
+        return None
+
+    def run_due(self):
+        """Ejecuta las tareas vencidas. Devuelve cuántas corrió."""
+        ran = 0
+        while True:
+            when = self.next_due()
+            if when is None or when > self.clock():
+                return ran
+            _, entry, key, function, interval = heapq.heappop(self.heap)
+            if interval is None:
+                del self.current[key]
+            else:
+                # Se reprograma desde ahora: si una corrida se atrasó no se encadenan varias
+                self._push(self.clock() + interval, key, function, interval)
+            try:
+                function()
+            except Exception:
+                # Una tarea que falla no detiene al resto; las periódicas se reintentan en su intervalo
+                logger.exception(f"Error en la tarea programada {key}")
+            ran += 1
+
+    def run(self):
+        """Corre hasta stop(), durmiendo entre una tarea y la siguiente"""
+        while not self.stopped.is_set():
+            self.run_due()
+            when = self.next_due()
+            if when is None:
+                self.sleep(None)
+            else:
+                self.sleep(max(0.0, when - self.clock()))
+
+    def stop(self):
+        self.stopped.set()
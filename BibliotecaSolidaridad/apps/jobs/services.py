@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+import traceback
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from apps.dashboard import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_CONFIG = {
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_SECONDS': 30,
+    'MAX_BACKOFF_SECONDS': 3600,
+    'CLAIM_TIMEOUT_SECONDS': 600,
+    'BATCH_SIZE': 10,
+    'POLL_INTERVAL': 2,
+}
+
+# Nombre de la tarea -> función que la ejecuta
+REGISTRY = {}
+
+# Tarea que está ejecutando este hilo (ver heartbeat)
+_running = threading.local()
+
+
+class ClaimLost(Exception):
+    """Otro worker tomó la tarea en curso porque su claim venció"""
+
+
+def get_config():
+    return {**DEFAULT_JOBS_CONFIG, **getattr(settings, 'JOBS_CONFIG', {})}
+
+
+def job(name):
+    """
+    Registra una función como tarea en segundo plano. La función recibe el
+    payload como argumentos con nombre, así que debe ser serializable a JSON.
+    Para reintentar, la función sólo tiene que lanzar una excepción.
+    """
+    def decorator(function):
+        REGISTRY[name] = function
+        return function
+    return decorator
+
+
+def heartbeat():
+    """
+    Para tareas largas: devuelve una función que renueva el claim de la tarea
+    en curso (claimed_at), así otro worker no la toma por abandonada mientras
+    sigue corriendo. Se puede llamar seguido y desde otros hilos: sólo escribe
+    cada CLAIM_TIMEOUT_SECONDS / 4, y lanza ClaimLost si la tarea ya es de
+    otro worker. Fuera de una tarea no hace nada.
+    """
+    job = getattr(_running, 'job', None)
+    if job is None:
+        return lambda: None
+    interval = get_config()['CLAIM_TIMEOUT_SECONDS'] / 4
+    lock = threading.Lock()
+    last = [time.monotonic()]
+
+    def beat():
+        with lock:
+            if time.monotonic() - last[0] < interval:
+                return
+            last[0] = time.monotonic()
+        renewed = Job.objects.filter(pk=job.pk, claim_id=job.claim_id, status='running').update(
+            claimed_at=timezone.now()
+        )
+        if not renewed:
+            raise ClaimLost(f"La tarea {job} ya la tomó otro worker")
+    return beat
+
+
+class JobService:
+    @staticmethod
+    def enqueue(name, run_at=None, max_attempts=None, **payload):
+        """
+        Encola una tarea registrada. Como es un INSERT en la misma base, si se
+        llama dentro de una transacción la tarea sólo existe si ésta se confirma.
+        """
+        if name not in REGISTRY:
+            raise ValueError(f"Tarea desconocida: {name}")
+        return Job.objects.create(
+            name=name,
+            payload=payload,
+            run_at=run_at or timezone.now(),
+            max_attempts=max_attempts or get_config()['MAX_ATTEMPTS'],
+        )
+
+    @staticmethod
+    def claim(limit):
+        """
+        Toma hasta `limit` tareas vencidas (o abandonadas por un worker caído)
+        con un único UPDATE condicional, así dos workers nunca toman la misma.
+        """
+        now = timezone.now()
+        timeout = timedelta(seconds=get_config()['CLAIM_TIMEOUT_SECONDS'])
+        claimable = Q(status='pending', run_at__lte=now) | Q(status='running', claimed_at__lt=now - timeout)
+        claim_id = uuid.uuid4().hex
+        candidates = Job.objects.filter(claimable).order_by('run_at', 'id').values('id')[:limit]
+        claimed = Job.objects.filter(claimable, id__in=candidates).update(
+            status='running',
+            claim_id=claim_id,
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return []
+        return list(Job.objects.filter(claim_id=claim_id, status='running').order_by('run_at', 'id'))
+
+    @staticmethod
+    def execute(job):
+        """Ejecuta una tarea tomada y registra el resultado. Devuelve True si terminó bien."""
+        handler = REGISTRY.get(job.name)
+        started = time.perf_counter()
+        _running.job = job
+        try:
+            if handler is None:
+                raise LookupError(f"Tarea desconocida: {job.name}")
+            handler(**job.payload)
+        except ClaimLost as e:
+            # El resultado lo registra el worker que la tiene ahora
+            metrics.JOBS.inc(name=job.name, outcome='claim_lost')
+            logger.warning(str(e))
+            return False
+        except Exception as e:
+            metrics.JOBS.inc(name=job.name, outcome='error')
+            JobService.fail(job, f"{e.__class__.__name__}: {e}\n{traceback.format_exc()}")
+            return False
+        finally:
+            _running.job = None
+            metrics.JOB_DURATION.observe(time.perf_counter() - started, name=job.name)
+
+        metrics.JOBS.inc(name=job.name, outcome='done')
+        Job.objects.filter(pk=job.pk, claim_id=job.claim_id).update(
+            status='done', finished_at=timezone.now(), last_error=''
+        )
+        return True
+
+    @staticmethod
+    def fail(job, error):
+        """
+        Reprograma la tarea con espera exponencial, o la da por fallida si ya
+        agotó sus intentos.
+        """
+        config = get_config()
+        now = timezone.now()
+        updates = {'last_error': error[:5000]}
+        if job.attempts >= job.max_attempts:
+            updates.update(status='failed', finished_at=now)
+            logger.error(f"Tarea {job} fallida tras {job.attempts} intentos: {error.splitlines()[0]}")
+        else:
+            delay = min(config['BACKOFF_SECONDS'] * 2 ** (job.attempts - 1), config['MAX_BACKOFF_SECONDS'])
+            updates.update(status='pending', run_at=now + timedelta(seconds=delay))
+            logger.warning(f"Tarea {job} falló (intento {job.attempts}), reintento en {delay} s")
+        Job.objects.filter(pk=job.pk, claim_id=job.claim_id).update(**updates)
+
+    @staticmethod
+    def run_pending(batch_size=None):
+        """
+        Ejecuta tareas hasta que no quede ninguna vencida.
+        Devuelve (terminadas, con error).
+        """
+        batch_size = batch_size or get_config()['BATCH_SIZE']
+        done = errors = 0
+        while True:
+            jobs = JobService.claim(batch_size)
+            if not jobs:
+                return done, errors
+            for job in jobs:
+                if JobService.execute(job):
+                    done += 1
+                else:
+                    errors += 1
@@ -0,0 +1,163 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from .models import Job
+from .scheduler import Scheduler
+from .services import REGISTRY, JobService, heartbeat
+
+
+@override_settings(JOBS_CONFIG={'MAX_ATTEMPTS': 3, 'BACKOFF_SECONDS': 10, 'MAX_BACKOFF_SECONDS': 15})
+class JobServiceTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.handler = mock.Mock(side_effect=lambda **payload: self.calls.append(payload))
+        patcher = mock.patch.dict(REGISTRY, {'tests.echo': self.handler})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runs_due_jobs_with_their_payload(self):
+        JobService.enqueue('tests.echo', value=1)
+        JobService.enqueue('tests.echo', value=2)
+        later = JobService.enqueue('tests.echo', run_at=timezone.now() + timedelta(hours=1), value=3)
+
+        self.assertEqual(JobService.run_pending(), (2, 0))
+        self.assertEqual(self.calls, [{'value': 1}, {'value': 2}])
+        later.refresh_from_db()
+        self.assertEqual(later.status, 'pending')
+        self.assertEqual(Job.objects.filter(status='done').count(), 2)
+
+    def test_unknown_jobs_are_rejected_when_enqueued(self):
+        with self.assertRaises(ValueError):
+            JobService.enqueue('tests.no_existe')
+
+    def test_failures_back_off_until_the_last_attempt(self):
+        self.handler.side_effect = RuntimeError('SMTP caído')
+        job = JobService.enqueue('tests.echo')
+
+        with self.assertLogs('apps.jobs.services', 'WARNING') as logs:
+            self.assertEqual(JobService.run_pending(), (0, 1))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts), ('pending', 1))
+            self.assertIn('SMTP caído', job.last_error)
+            self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=9))
+            # No se reintenta antes de tiempo
+            self.assertEqual(JobService.run_pending(), (0, 0))
+
+            for expected in ('pending', 'failed'):
+                Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+                JobService.run_pending()
+                job.refresh_from_db()
+                self.assertEqual(job.status, expected)
+        self.assertEqual(job.attempts, 3)
+        self.assertIsNotNone(job.finished_at)
+        self.assertIn('fallida tras 3 intentos', logs.output[-1])
+
+    def test_claims_do_not_overlap_and_stale_claims_are_retaken(self):
+        for value in range(3):
+            JobService.enqueue('tests.echo', value=value)
+        first = JobService.claim(2)
+        second = JobService.claim(2)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertEqual(JobService.claim(2), [])
+
+        # El worker que tomó `first` murió sin terminar
+        Job.objects.filter(pk__in=[job.pk for job in first]).update(
+            claimed_at=timezone.now() - timedelta(hours=1)
+        )
+        retaken = JobService.claim(5)
+        self.assertEqual({job.pk for job in retaken}, {job.pk for job in first})
+        self.assertTrue(all(job.attempts == 2 for job in retaken))
+
+    @override_settings(JOBS_CONFIG={'CLAIM_TIMEOUT_SECONDS': 0})
+    def test_heartbeat_keeps_long_jobs_claimed(self):
+        job = JobService.enqueue('tests.echo')
+
+        def long_job(**payload):
+            # Pasó más que el timeout desde que se tomó: sin heartbeat otro worker la retomaría
+            Job.objects.filter(pk=job.pk).update(claimed_at=timezone.now() - timedelta(hours=1))
+            heartbeat()()
+            self.calls.append(Job.objects.get(pk=job.pk).claimed_at)
+
+        self.handler.side_effect = long_job
+        self.assertEqual(JobService.run_pending(), (1, 0))
+        self.assertGreater(self.calls[0], timezone.now() - timedelta(minutes=1))
+        # Fuera de una tarea no hace nada
+        heartbeat()()
+
+    @override_settings(JOBS_CONFIG={'CLAIM_TIMEOUT_SECONDS': 0})
+    def test_heartbeat_stops_a_job_another_worker_retook(self):
+        job = JobService.enqueue('tests.echo')
+
+        def retaken(**payload):
+            Job.objects.filter(pk=job.pk).update(claim_id='otro-worker')
+            heartbeat()()
+            self.calls.append('siguió')
+
+        self.handler.side_effect = retaken
+        with self.assertLogs('apps.jobs.services', 'WARNING') as logs:
+            self.assertFalse(JobService.execute(JobService.claim(1)[0]))
+        self.assertEqual(self.calls, [])
+        self.assertIn('ya la tomó otro worker', logs.output[0])
+        job.refresh_from_db()
+        # El resultado queda para el worker que la tiene ahora
+        self.assertEqual((job.status, job.claim_id, job.last_error), ('running', 'otro-worker', ''))
+
+    def test_command_runs_pending_jobs_once(self):
+        JobService.enqueue('tests.echo', value='cron')
+        out = StringIO()
+        call_command('run_jobs', '--once', stdout=out)
+        self.assertEqual(self.calls, [{'value': 'cron'}])
+        self.assertIn('1 tareas terminadas', out.getvalue())
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SchedulerTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = Scheduler(clock=self.clock, sleep=self.advance)
+        self.ran = []
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        if self.clock.now >= 1100:
+            self.scheduler.stop()
+
+    def record(self, name):
+        return lambda: self.ran.append((name, self.clock.now))
+
+    def test_sleeps_until_the_next_due_task(self):
+        self.scheduler.every(30, 'periodic', self.record('periodic'))
+        self.scheduler.at(1045, 'once', self.record('once'))
+        self.scheduler.run()
+        self.assertEqual(self.ran, [
+            ('periodic', 1000), ('periodic', 1030), ('once', 1045), ('periodic', 1060), ('periodic', 1090),
+        ])
+
+    def test_rescheduling_a_key_replaces_the_previous_entry(self):
+        self.scheduler.at(1010, 'campaign', self.record('old'))
+        self.scheduler.at(1020, 'campaign', self.record('new'))
+        self.scheduler.at(1030, 'cancelled', self.record('cancelled'))
+        self.scheduler.cancel('cancelled')
+        self.clock.now = 1050
+        self.assertEqual(self.scheduler.run_due(), 1)
+        self.assertEqual(self.ran, [('new', 1050)])
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_a_failing_task_does_not_stop_the_others(self):
+        self.scheduler.every(10, 'broken', mock.Mock(side_effect=RuntimeError('roto')))
+        self.scheduler.every(10, 'healthy', self.record('healthy'))
+        with self.assertLogs('apps.jobs.scheduler', 'ERROR'):
+            self.assertEqual(self.scheduler.run_due(), 2)
+        self.assertEqual(self.ran, [('healthy', 1000)])
+        self.assertEqual(self.scheduler.next_due(), 1010)
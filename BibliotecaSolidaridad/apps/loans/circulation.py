@@ -0,0 +1,184 @@
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from apps.books.models import BookStock
+from apps.dashboard import events, metrics
+from apps.users.models import User
+from .holds import HoldService
+from .models import Loan, LoanRequest
+from .services import LoanService
+
+# Días de préstamo en el mostrador (como LoanService.open_loan)
+LOAN_DAYS = 15
+
+
+class CirculationError(Exception):
+    """
+    Un escaneo que no se puede procesar. `barcodes` detalla el problema de
+    cada código; `status` es el código HTTP con el que responde la API.
+    """
+
+    def __init__(self, message, barcodes=None, status=409):
+        super().__init__(message)
+        self.message = message
+        self.barcodes = barcodes or {}
+        self.status = status
+
+
+class CirculationService:
+    """
+    Préstamo y devolución en el mostrador a partir de códigos escaneados: el
+    carnet virtual del socio (UserProfile.virtual_card_id) y el código de cada
+    ejemplar (BookStock.physical_id), ambos únicos e indexados.
+
+    Cada operación es todo o nada: si un ejemplar no se puede prestar o
+    devolver no se procesa ninguno, y la respuesta dice qué pasó con cada código.
+    """
+
+    @staticmethod
+    def patron(card_id):
+        """Socio por su carnet, con el perfil, en una consulta"""
+        try:
+            return User.objects.select_related('profile').get(profile__virtual_card_id=card_id)
+        except User.DoesNotExist:
+            raise CirculationError(f'No existe el carnet {card_id}', status=404)
+
+    @staticmethod
+    def blocked_reason(user, today=None):
+        today = today or timezone.now().date()
+        if not user.is_active_member:
+            return 'El socio no está activo'
+        if user.suspension_end_date and user.suspension_end_date >= today:
+            return f'El socio está suspendido hasta el {user.suspension_end_date:%d/%m/%Y}'
+        return None
+
+    @staticmethod
+    def _copies(barcodes):
+        barcodes = list(dict.fromkeys(barcodes))
+        if not barcodes:
+            raise CirculationError('No se escaneó ningún ejemplar', status=400)
+        copies = {
+            copy.physical_id: copy
+            for copy in BookStock.objects.select_related('book').filter(physical_id__in=barcodes)
+        }
+        missing = {barcode: 'Código desconocido' for barcode in barcodes if barcode not in copies}
+        if missing:
+            raise CirculationError('Hay códigos que no corresponden a ningún ejemplar', missing, status=404)
+        return [copies[barcode] for barcode in barcodes]
+
+    @staticmethod
+    def checkout(user, barcodes, librarian=None, days=LOAN_DAYS):
+        """
+        Presta los ejemplares al socio. El cupo se reserva de una vez con el
+        UPDATE condicional sobre su contador (como LoanService.open_loan) y los
+        ejemplares pasan a prestados con otro UPDATE condicional, así dos
+        mostradores no pueden prestar el mismo ejemplar.
+        """
+        today = timezone.now().date()
+        reason = CirculationService.blocked_reason(user, today)
+        if reason:
+            raise CirculationError(reason, status=403)
+
+        with transaction.atomic():
+            copies = CirculationService._copies(barcodes)
+            # Los ejemplares que la lista de espera le apartó a este socio también se le prestan
+            reserved = set(
+                LoanRequest.objects.filter(user=user, status='pending', copy__in=copies).values_list('copy_id', flat=True)
+            )
+            unavailable = {
+                copy.physical_id: f'No está disponible ({copy.get_status_display().lower()})'
+                for copy in copies
+                if copy.status != 'available' and not (copy.status == 'reserved' and copy.pk in reserved)
+            }
+            if unavailable:
+                raise CirculationError('Hay ejemplares que no se pueden prestar', unavailable)
+
+            reserved = User.objects.filter(
+                pk=user.pk,
+                active_loans_count__lte=user.get_loan_limit() - len(copies),
+            ).update(active_loans_count=F('active_loans_count') + len(copies))
+            if not reserved:
+                metrics.LOANS_OPENED.inc(len(copies), outcome='limit_reached')
+                raise CirculationError(
+                    f'El socio tiene {user.active_loans_count} préstamos en curso y su límite es '
+                    f'{user.get_loan_limit()}'
+                )
+
+            borrowed = BookStock.objects.filter(
+                pk__in=[copy.pk for copy in copies], status__in=('available', 'reserved')
+            ).set_status('borrowed')
+            if borrowed != len(copies):
+                # Otro mostrador se llevó alguno entre la lectura y el UPDATE: se deshace todo
+                raise CirculationError('Un ejemplar se acaba de prestar en otro mostrador, volvé a escanear')
+
+            loans = Loan.objects.bulk_create(
+                Loan(
+                    user=user,
+                    book=copy.book,
+                    copy=copy,
+                    loan_date=today,
+                    due_date=today + timedelta(days=days),
+                    status='active',
+                )
+                for copy in copies
+            )
+            book_ids = {copy.book_id for copy in copies}
+            # Las solicitudes pendientes de estos libros quedan atendidas
+            pending = LoanRequest.objects.filter(user=user, book_id__in=book_ids, status='pending')
+            scanned = {copy.pk for copy in copies}
+            orphaned = [
+                (copy_id, book_id)
+                for copy_id, book_id in pending.filter(copy__isnull=False).values_list('copy_id', 'book_id')
+                if copy_id not in scanned
+            ]
+            pending.update(status='approved', approved_by=librarian, approved_date=timezone.now())
+            # Si se llevó otro ejemplar del libro, el que tenía apartado pasa al siguiente de la lista
+            if orphaned:
+                HoldService.shelve(orphaned)
+            transaction.on_commit(lambda: metrics.LOANS_OPENED.inc(len(loans), outcome='opened'))
+            events.publish(
+                [events.LIBRARIANS, events.user_channel(user.pk)],
+                'loan_approved', book=', '.join(copy.book.title for copy in copies),
+            )
+
+        user.active_loans_count += len(copies)
+        return loans
+
+    @staticmethod
+    def checkin(barcodes, user=None):
+        """
+        Registra la devolución de los ejemplares (con la mora que corresponda,
+        ver LoanService.return_loan) y los aparta para la lista de espera de su
+        libro (HoldService.shelve). Con `user`, sólo acepta ejemplares que
+        tenga prestados ese socio. Devuelve [(préstamo, días de atraso,
+        solicitud a la que quedó apartado o None)].
+        """
+        with transaction.atomic():
+            copies = CirculationService._copies(barcodes)
+            loans = {
+                loan.copy_id: loan
+                for loan in Loan.objects.select_related('user', 'book').filter(
+                    copy__in=copies, status__in=Loan.OPEN_STATUSES
+                )
+            }
+            problems = {}
+            for copy in copies:
+                loan = loans.get(copy.pk)
+                if loan is None:
+                    problems[copy.physical_id] = 'No tiene un préstamo en curso'
+                elif user is not None and loan.user_id != user.pk:
+                    problems[copy.physical_id] = f'Está prestado a otro socio ({loan.user.username})'
+            if problems:
+                raise CirculationError('Hay ejemplares que no se pueden devolver', problems)
+
+            returned = []
+            for copy in copies:
+                loan = loans[copy.pk]
+                returned.append((loan, LoanService.return_loan(loan)))
+            holds = HoldService.shelve([(copy.pk, copy.book_id) for copy in copies])
+            events.publish_many([
+                ([events.LIBRARIANS, events.user_channel(loan.user_id)], 'loan_returned', {'book': loan.book.title})
+                for loan, _ in returned
+            ])
+        return [(loan, days_overdue, holds.get(loan.copy_id)) for loan, days_overdue in returned]
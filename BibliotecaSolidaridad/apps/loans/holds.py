@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from apps.books.models import BookStock
+from apps.dashboard import events, metrics
+from apps.dashboard.notifications import NotificationService
+from .models import LoanRequest
+
+# Puntaje mínimo de cada nivel de la lista de espera (los mismos cortes que User.get_loan_limit)
+DEFAULT_HOLD_PRIORITY_SCORES = (4.5, 3.0)
+
+
+class HoldService:
+    """
+    Lista de espera por libro. Las solicitudes pendientes sin ejemplar
+    apartado forman la cola de cada libro: primero por nivel de prioridad
+    (según el puntaje del socio al pedirlo), después por orden de llegada.
+    Cada socio tiene a lo sumo una solicitud pendiente por libro
+    (loan_requests_one_pending).
+
+    Cuando vuelve un ejemplar, se aparta para la primera de la cola de su libro
+    en la misma transacción de la devolución: una consulta por el índice
+    loan_requests_queue_idx con LIMIT 1, sin recorrer las solicitudes. Los
+    ejemplares de libros sin cola (lo habitual en un inventario) no hacen
+    consultas por ejemplar: pasan a disponibles con un solo cambio de estado.
+    """
+
+    @staticmethod
+    def priority(user):
+        """Nivel de prioridad del socio: 0 para los mejores puntajes"""
+        scores = settings.LOANS_CONFIG.get('HOLD_PRIORITY_SCORES', DEFAULT_HOLD_PRIORITY_SCORES)
+        return next((tier for tier, minimum in enumerate(scores) if user.score >= minimum), len(scores))
+
+    @staticmethod
+    def place(user, book):
+        """
+        Pone al socio en la lista de espera del libro. Devuelve (solicitud, creada);
+        si ya tenía una pendiente la devuelve sin crear otra.
+        """
+        try:
+            with transaction.atomic():
+                loan_request = LoanRequest.objects.create(
+                    user=user, book=book, status='pending', priority=HoldService.priority(user),
+                )
+        except IntegrityError:
+            return LoanRequest.objects.get(user=user, book=book, status='pending'), False
+        metrics.LOAN_REQUESTS.inc(status='pending')
+        return loan_request, True
+
+    @staticmethod
+    def position(loan_request):
+        """Puesto en la lista de espera (1 es la próxima), o None si ya tiene ejemplar o no está pendiente"""
+        return (
+            LoanRequest.objects.waiting()
+            .filter(pk=loan_request.pk)
+            .with_queue_position()
+            .values_list('queue_position', flat=True)
+            .first()
+        )
+
+    @staticmethod
+    def queue_length(book_id):
+        """Cuántas solicitudes esperan ejemplar del libro"""
+        return LoanRequest.objects.waiting().filter(book_id=book_id).count()
+
+    @staticmethod
+    def head(book_id):
+        return (
+            LoanRequest.objects.waiting()
+            .filter(book_id=book_id)
+            .queue_order()
+            .select_related('user', 'book')
+            .first()
+        )
+
+    @staticmethod
+    def shelve(copies):
+        """
+        Ejemplares que vuelven, como pares (id del ejemplar, id del libro): cada
+        uno queda apartado para la primera solicitud de la lista de espera de
+        su libro, o disponible si no espera nadie. Devuelve {id del ejemplar:
+        solicitud a la que se apartó}.
+        """
+        copies = list(copies)
+        allocated = {}
+        with transaction.atomic():
+            # Una consulta para saber qué libros tienen cola; sólo esos buscan a quién apartarle
+            waited = set(
+                LoanRequest.objects.waiting()
+                .filter(book_id__in={book_id for _, book_id in copies})
+                .order_by()
+                .values_list('book_id', flat=True)
+                .distinct()
+            )
+            for copy_id, book_id in copies:
+                if book_id not in waited:
+                    continue
+                # El UPDATE condicional evita apartar dos ejemplares para la misma solicitud
+                head = HoldService.head(book_id)
+                while head is not None and not LoanRequest.objects.waiting().filter(pk=head.pk).update(copy_id=copy_id):
+                    head = HoldService.head(book_id)
+                if head is None:
+                    waited.discard(book_id)
+                else:
+                    head.copy_id = copy_id
+                    allocated[copy_id] = head
+
+            BookStock.objects.filter(pk__in=list(allocated)).set_status('reserved')
+            BookStock.objects.filter(
+                pk__in=[copy_id for copy_id, _ in copies if copy_id not in allocated]
+            ).set_status('available')
+            if allocated:
+                NotificationService.notify_many(
+                    (hold.user_id, f'Llegó tu ejemplar de "{hold.book.title}": está reservado a tu nombre, '
+                                   f'retiralo en el mostrador.')
+                    for hold in allocated.values()
+                )
+                events.publish_many([
+                    ([events.LIBRARIANS, events.user_channel(hold.user_id)], 'hold_ready', {'book': hold.book.title})
+                    for hold in allocated.values()
+                ])
+        return allocated
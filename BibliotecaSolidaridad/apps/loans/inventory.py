@@ -0,0 +1,127 @@
+from collections import Counter, defaultdict
+from django.db import transaction
+from apps.books.models import BookStock
+from .holds import HoldService
+from .models import Loan
+
+# Ejemplares por consulta al recorrer BookStock (y por UPDATE al aplicar los cambios)
+AUDIT_CHUNK_SIZE = 900
+
+# Según el estado de un ejemplar y si apareció o no en el escaneo: (hallazgo, estado que le corresponde).
+# Las combinaciones que no figuran están en orden.
+FINDINGS = {
+    ('available', False): ('missing', 'lost'),
+    ('lost', True): ('found', 'available'),
+    ('borrowed', True): ('borrowed_on_shelf', 'available'),
+    ('maintenance', True): ('maintenance_on_shelf', None),
+}
+
+FINDING_LABELS = {
+    'missing': 'Faltantes (disponibles que no aparecieron)',
+    'unexpected': 'Inesperados (códigos que no son de ningún ejemplar)',
+    'found': 'Perdidos que aparecieron',
+    'borrowed_on_shelf': 'Prestados en el estante sin préstamo en curso',
+    'open_loan_on_shelf': 'Prestados en el estante con préstamo en curso (devolver en el mostrador)',
+    'maintenance_on_shelf': 'En mantenimiento pero en el estante',
+}
+
+
+class InventoryService:
+    """
+    Inventario de estantes: concilia los códigos escaneados (BookStock.physical_id)
+    con el estado de cada ejemplar en una sola pasada.
+
+    Los códigos escaneados se guardan en un set; BookStock se recorre por
+    tramos de clave primaria (AUDIT_CHUNK_SIZE filas de id, código, estado y
+    libro), y cada código encontrado se saca del set, así lo que queda al
+    final son los inesperados. La memoria depende del tamaño del escaneo y
+    del tramo, no del total de ejemplares, y los hallazgos se entregan a
+    `report` a medida que aparecen en vez de acumularse.
+    """
+
+    @staticmethod
+    def read_barcodes(lines):
+        """Un código por línea; se ignoran los espacios, las líneas vacías y los repetidos"""
+        barcodes = {line.strip() for line in lines}
+        barcodes.discard('')
+        return barcodes
+
+    @staticmethod
+    def reconcile(barcodes, apply=False, report=None, chunk_size=AUDIT_CHUNK_SIZE):
+        """
+        Compara el escaneo con BookStock. `report(physical_id, book_id, estado,
+        hallazgo, nuevo estado)` recibe cada diferencia. Con `apply`, los
+        cambios de estado se aplican tramo por tramo (los contadores de los
+        libros se ajustan en la misma transacción). Devuelve los totales por hallazgo.
+        """
+        pending = set(barcodes)
+        counts = Counter(scanned=len(pending), copies=0, ok=0, updated=0)
+        last_pk = 0
+        while True:
+            chunk = list(
+                BookStock.objects.filter(pk__gt=last_pk)
+                .order_by('pk')
+                .values_list('pk', 'physical_id', 'status', 'book_id')[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_pk = chunk[-1][0]
+            counts['copies'] += len(chunk)
+
+            findings = []
+            for pk, physical_id, status, book_id in chunk:
+                seen = physical_id in pending
+                if seen:
+                    pending.discard(physical_id)
+                finding = FINDINGS.get((status, seen))
+                if finding is None:
+                    counts['ok'] += 1
+                else:
+                    findings.append((pk, physical_id, status, book_id, *finding))
+
+            # Un ejemplar "prestado" en el estante sólo se libera si no tiene un préstamo abierto
+            on_shelf = [pk for pk, _, _, _, finding, _ in findings if finding == 'borrowed_on_shelf']
+            lent = set(
+                Loan.objects.filter(copy_id__in=on_shelf, status__in=Loan.OPEN_STATUSES)
+                .values_list('copy_id', flat=True)
+            ) if on_shelf else set()
+
+            changes = defaultdict(list)
+            for pk, physical_id, status, book_id, finding, new_status in findings:
+                if pk in lent:
+                    finding, new_status = 'open_loan_on_shelf', None
+                counts[finding] += 1
+                if report:
+                    report(physical_id, book_id, status, finding, new_status)
+                if new_status:
+                    changes[status, new_status].append(pk)
+
+            if apply and changes:
+                counts['updated'] += InventoryService._apply(changes)
+
+        counts['unexpected'] = len(pending)
+        if report:
+            for physical_id in sorted(pending):
+                report(physical_id, None, None, 'unexpected', None)
+        return counts
+
+    @staticmethod
+    def _apply(changes):
+        """
+        Un cambio de estado por cada par (estado actual, nuevo). La condición
+        sobre el estado actual respeta los ejemplares que el mostrador movió
+        mientras corría el inventario. Los que vuelven al estante pasan por la
+        lista de espera de su libro (HoldService.shelve) en vez de quedar
+        disponibles para cualquiera.
+        """
+        updated = 0
+        with transaction.atomic():
+            for (status, new_status), pks in changes.items():
+                copies = BookStock.objects.filter(pk__in=pks, status=status)
+                if new_status == 'available':
+                    freed = list(copies.select_for_update().values_list('pk', 'book_id'))
+                    HoldService.shelve(freed)
+                    updated += len(freed)
+                else:
+                    updated += copies.set_status(new_status)
+        return updated
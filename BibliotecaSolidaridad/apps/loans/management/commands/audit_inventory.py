@@ -0,0 +1,45 @@
+import csv
+import sys
+from django.core.management.base import BaseCommand
+from apps.loans.inventory import FINDING_LABELS, InventoryService
+
+class Command(BaseCommand):
+    help = (
+        'Concilia un inventario de estantes (un código de ejemplar por línea) con el estado '
+        'de cada ejemplar. Sin --apply sólo informa las diferencias.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scan', help="Archivo con los códigos escaneados ('-' para leer de la entrada estándar)")
+        parser.add_argument('--apply', action='store_true',
+                            help='Aplicar los cambios de estado (faltantes a perdidos, aparecidos a disponibles)')
+        parser.add_argument('--report', help='Guardar cada diferencia en este archivo CSV')
+
+    def handle(self, *args, **options):
+        if options['scan'] == '-':
+            barcodes = InventoryService.read_barcodes(sys.stdin)
+        else:
+            with open(options['scan'], encoding='utf-8') as scan:
+                barcodes = InventoryService.read_barcodes(scan)
+
+        report_file = writer = None
+        if options['report']:
+            report_file = open(options['report'], 'w', newline='', encoding='utf-8')
+            writer = csv.writer(report_file)
+            writer.writerow(['physical_id', 'book_id', 'estado', 'hallazgo', 'nuevo_estado'])
+        try:
+            counts = InventoryService.reconcile(
+                barcodes, apply=options['apply'],
+                report=(lambda *row: writer.writerow(row)) if writer else None,
+            )
+        finally:
+            if report_file:
+                report_file.close()
+
+        self.stdout.write(f"Códigos escaneados: {counts['scanned']}, ejemplares: {counts['copies']}, en orden: {counts['ok']}")
+        for finding, label in FINDING_LABELS.items():
+            self.stdout.write(f'{label}: {counts[finding]}')
+        if options['apply']:
+            self.stdout.write(self.style.SUCCESS(f"Ejemplares actualizados: {counts['updated']}"))
+        else:
+            self.stdout.write(self.style.WARNING('No se aplicó ningún cambio (usar --apply)'))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from apps.loans.services import LoanService
+
+class Command(BaseCommand):
+    help = 'Recalcula el contador de préstamos en curso de cada usuario a partir de la tabla de préstamos'
+
+    def handle(self, *args, **options):
+        fixed = LoanService.reconcile_active_loan_counts()
+        self.stdout.write(self.style.SUCCESS(f'Contadores corregidos: {fixed}'))
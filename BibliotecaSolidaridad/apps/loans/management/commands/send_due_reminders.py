@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from apps.loans.services import LoanService
+
+class Command(BaseCommand):
+    help = 'Recuerda a los socios los préstamos que vencen en los próximos días (notificación y email)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+                            help="Días de anticipación (por defecto LOANS_CONFIG['DUE_REMINDER_DAYS'])")
+
+    def handle(self, *args, **options):
+        result = LoanService.send_due_reminders(days=options['days'])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Préstamos recordados: {result['loans']}, socios: {result['users']}, "
+                f"emails enviados: {result['emails_sent']}, fallidos: {result['emails_failed']}"
+            )
+        )
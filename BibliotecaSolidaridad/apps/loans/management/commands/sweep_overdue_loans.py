@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from apps.loans.services import LoanService
+
+class Command(BaseCommand):
+    help = 'Marca como vencidos los préstamos activos fuera de término y aplica la penalización por mora'
+
+    def handle(self, *args, **options):
+        result = LoanService.sweep_overdue()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Préstamos marcados como vencidos: {result['overdue']}, "
+                f"usuarios penalizados: {result['penalized_users']}"
+            )
+        )
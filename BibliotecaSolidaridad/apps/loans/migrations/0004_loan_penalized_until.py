@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0003_loanrequest_loan_date_loanrequest_return_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='penalized_until',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
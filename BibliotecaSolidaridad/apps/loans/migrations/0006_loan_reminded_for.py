@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loans', '0005_loan_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='reminded_for',
+            field=models.DateField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_alter_book_openlibrary_id'),
+        ('loans', '0006_loan_reminded_for'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loan',
+            name='copy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='loans', to='books.bookstock'),
+        ),
+    ]
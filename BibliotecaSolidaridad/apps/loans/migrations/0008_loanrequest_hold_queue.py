@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def reject_duplicate_pending(apps, schema_editor):
+    """Antes de la restricción: de cada (usuario, libro) queda sólo la solicitud pendiente más antigua"""
+    LoanRequest = apps.get_model('loans', 'LoanRequest')
+    seen = set()
+    duplicates = []
+    for pk, user_id, book_id in (
+        LoanRequest.objects.filter(status='pending')
+        .order_by('request_date', 'pk')
+        .values_list('pk', 'user_id', 'book_id')
+        .iterator()
+    ):
+        if (user_id, book_id) in seen:
+            duplicates.append(pk)
+        seen.add((user_id, book_id))
+    for i in range(0, len(duplicates), 500):
+        LoanRequest.objects.filter(pk__in=duplicates[i:i + 500]).update(status='rejected')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_bookstock_reserved_status'),
+        ('loans', '0007_loan_copy'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='loanrequest',
+            name='copy',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='holds', to='books.bookstock'),
+        ),
+        migrations.AddField(
+            model_name='loanrequest',
+            name='priority',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='loanrequest',
+            index=models.Index(fields=['book', 'status', 'priority', 'request_date'], name='loan_requests_queue_idx'),
+        ),
+        migrations.RunPython(reject_duplicate_pending, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='loanrequest',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'pending')), fields=('user', 'book'), name='loan_requests_one_pending'),
+        ),
+    ]
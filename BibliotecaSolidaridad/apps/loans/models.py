@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from apps.books.models import Book
 from django.utils import timezone
@@ -8,6 +9,13 @@ class LoanQuerySet(models.QuerySet):
     def active(self):
         return self.filter(status='active')
 
+    def overdue(self):
+        """Préstamos vencidos, ya marcados o todavía pendientes del barrido"""
+        return self.filter(
+            models.Q(status='overdue')
+            | models.Q(status='active', due_date__lt=timezone.now().date())
+        )
+
 
 class Loan(models.Model):
     LOAN_TYPES = (
@@ -15,8 +23,14 @@ class Loan(models.Model):
         ('express', 'Express (3 días)'),
         ('summer', 'Verano (2 meses)'),
     )
+    # Estados en los que el libro todavía está en manos del usuario
+    OPEN_STATUSES = ('active', 'overdue')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     book = models.ForeignKey(Book, on_delete=models.CASCADE)
+    # Ejemplar prestado, cuando el préstamo se hizo escaneando su código en el mostrador
+    copy = models.ForeignKey(
+        'books.BookStock', on_delete=models.SET_NULL, null=True, blank=True, related_name='loans'
+    )
     loan_type = models.CharField(max_length=10, choices=LOAN_TYPES, default='normal')
     loan_date = models.DateField(auto_now_add=True)
     due_date = models.DateField()
@@ -29,23 +43,38 @@ class Loan(models.Model):
         ('overdue', 'Vencido'),
         ('lost', 'Perdido')
     ))
+    # Último día hasta el cual ya se descontó puntaje por mora
+    penalized_until = models.DateField(null=True, blank=True)
+    # Vencimiento para el que ya se envió el recordatorio (si se renueva, se recuerda el nuevo)
+    reminded_for = models.DateField(null=True, blank=True)
 
     objects = LoanQuerySet.as_manager()
 
     @property
     def is_overdue(self):
+        if self.status == 'overdue':
+            return True
         return self.status == 'active' and self.due_date < timezone.now().date()
-    
+
     @property
     def days_overdue(self):
         if self.is_overdue:
             return (timezone.now().date() - self.due_date).days
         return 0
 
+    def unpenalized_overdue_days(self, until):
+        """Días de mora hasta `until` que todavía no fueron penalizados"""
+        start = max(self.due_date, self.penalized_until or self.due_date)
+        return max(0, (until - start).days)
+
     class Meta:
         db_table = 'loans'
         verbose_name = 'Préstamo'
         verbose_name_plural = 'Préstamos'
+        indexes = [
+            models.Index(fields=['status', 'due_date'], name='loans_status_due_idx'),
+            models.Index(fields=['user', 'status'], name='loans_user_status_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user} - {self.book}"
@@ -62,6 +91,43 @@ class Renewal(models.Model):
     def __str__(self):
         return f"Renovación de {self.loan} el {self.renewal_date}"
 
+class LoanRequestQuerySet(models.QuerySet):
+    def waiting(self):
+        """La lista de espera: solicitudes pendientes que todavía no tienen un ejemplar apartado"""
+        return self.filter(status='pending', copy__isnull=True)
+
+    def queue_order(self):
+        """Primero por nivel de prioridad, después por orden de llegada (loan_requests_queue_idx)"""
+        return self.order_by('priority', 'request_date', 'id')
+
+    def with_queue_position(self):
+        """
+        Anota `queue_position` (1 es la próxima) en las solicitudes en espera:
+        una subconsulta que cuenta las que tiene adelante en la lista de su
+        libro, un rango sobre el índice de la cola.
+        """
+        ahead = (
+            LoanRequest.objects.waiting()
+            .filter(book=models.OuterRef('book'))
+            .filter(
+                models.Q(priority__lt=models.OuterRef('priority'))
+                | models.Q(priority=models.OuterRef('priority'), request_date__lt=models.OuterRef('request_date'))
+                | models.Q(
+                    priority=models.OuterRef('priority'),
+                    request_date=models.OuterRef('request_date'),
+                    pk__lt=models.OuterRef('pk'),
+                )
+            )
+            .order_by()
+            .values('book')
+            .annotate(total=models.Count('id'))
+            .values('total')
+        )
+        return self.annotate(
+            queue_position=Coalesce(models.Subquery(ahead), 0) + 1
+        )
+
+
 class LoanRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pendiente'),
@@ -86,11 +152,30 @@ class LoanRequest(models.Model):
     approved = models.BooleanField(default=False)
     approved_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='approved_loans')
     approved_date = models.DateTimeField(null=True, blank=True)
+    # Nivel en la lista de espera según el puntaje al pedirlo (0 es el mejor); ver HoldService
+    priority = models.PositiveSmallIntegerField(default=0)
+    # Ejemplar apartado para esta solicitud cuando le llegó el turno en la lista de espera
+    copy = models.ForeignKey(
+        'books.BookStock', on_delete=models.SET_NULL, null=True, blank=True, related_name='holds'
+    )
+
+    objects = LoanRequestQuerySet.as_manager()
 
     class Meta:
         db_table = 'loan_requests'
         verbose_name = 'Solicitud de Préstamo'
         verbose_name_plural = 'Solicitudes de Préstamo'
+        indexes = [
+            models.Index(fields=['status', 'request_date'], name='loan_requests_status_date_idx'),
+            models.Index(fields=['book', 'status', 'priority', 'request_date'], name='loan_requests_queue_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'book'],
+                condition=models.Q(status='pending'),
+                name='loan_requests_one_pending',
+            ),
+        ]
 
     def __str__(self):
         return f"Solicitud de {self.user} - {self.book}"
@@ -0,0 +1,285 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.template.loader import render_to_string
+from django.utils import timezone
+from apps.books.models import BookStock
+from apps.dashboard import metrics
+from apps.dashboard.notifications import NotificationService
+from apps.newsletter.services import NewsletterService
+from .models import Loan
+import logging
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+# Puntos que se descuentan por cada día de mora
+OVERDUE_PENALTY_PER_DAY = 0.5
+# Cantidad de ids por sentencia UPDATE ... WHERE id IN (...)
+UPDATE_CHUNK_SIZE = 500
+
+
+class LoanService:
+    @staticmethod
+    def open_loan(user, book, days=15, **fields):
+        """
+        Crea un préstamo activo y suma uno al contador del usuario en la misma
+        transacción. El UPDATE condicional sobre la fila del usuario es a la vez
+        el control del límite: devuelve None si ya no le quedan préstamos.
+        """
+        with transaction.atomic():
+            reserved = User.objects.filter(
+                pk=user.pk,
+                active_loans_count__lt=user.get_loan_limit(),
+            ).update(active_loans_count=F('active_loans_count') + 1)
+            if not reserved:
+                metrics.LOANS_OPENED.inc(outcome='limit_reached')
+                return None
+
+            today = timezone.now().date()
+            loan = Loan.objects.create(
+                user=user,
+                book=book,
+                loan_date=today,
+                due_date=today + timedelta(days=days),
+                status='active',
+                **fields
+            )
+            transaction.on_commit(lambda: metrics.LOANS_OPENED.inc(outcome='opened'))
+        user.active_loans_count += 1
+        return loan
+
+    @staticmethod
+    def return_loan(loan, return_date=None):
+        """
+        Registra la devolución y descuenta la mora que el barrido todavía no cobró.
+        Devuelve los días de atraso totales del préstamo.
+        """
+        return_date = return_date or timezone.now().date()
+        unpenalized_days = loan.unpenalized_overdue_days(return_date)
+
+        with transaction.atomic():
+            if not LoanService._close(loan, 'returned', return_date=return_date):
+                return 0
+            if unpenalized_days:
+                Loan.objects.filter(pk=loan.pk).update(penalized_until=return_date)
+                LoanService._apply_penalties(
+                    {loan.user_id: unpenalized_days * OVERDUE_PENALTY_PER_DAY}
+                )
+
+        return max(0, (return_date - loan.due_date).days)
+
+    @staticmethod
+    def mark_lost(loan):
+        """Da por perdido un préstamo en curso y libera el cupo del usuario"""
+        with transaction.atomic():
+            closed = LoanService._close(loan, 'lost')
+            if closed and loan.copy_id:
+                BookStock.objects.filter(pk=loan.copy_id).set_status('lost')
+            return closed
+
+    @staticmethod
+    def _close(loan, status, **fields):
+        """
+        Cierra un préstamo en curso. Sólo descuenta del contador si esta llamada
+        fue la que efectivamente cambió el estado, así dos cierres concurrentes
+        no lo decrementan dos veces.
+        """
+        closed = Loan.objects.filter(
+            pk=loan.pk, status__in=Loan.OPEN_STATUSES
+        ).update(status=status, **fields)
+        if closed:
+            User.objects.filter(pk=loan.user_id).update(
+                active_loans_count=Greatest(F('active_loans_count') - 1, Value(0))
+            )
+            loan.status = status
+            for name, value in fields.items():
+                setattr(loan, name, value)
+            transaction.on_commit(lambda: metrics.LOANS_CLOSED.inc(status=status))
+        return bool(closed)
+
+    @staticmethod
+    def reconcile_active_loan_counts():
+        """
+        Recalcula `User.active_loans_count` a partir de la tabla de préstamos con
+        un único UPDATE. Devuelve la cantidad de usuarios corregidos.
+        """
+        open_loans = (
+            Loan.objects.filter(user=OuterRef('pk'), status__in=Loan.OPEN_STATUSES)
+            .order_by()
+            .values('user')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        actual = Coalesce(Subquery(open_loans), 0)
+        return (
+            User.objects.annotate(actual=actual)
+            .exclude(active_loans_count=F('actual'))
+            .update(active_loans_count=actual)
+        )
+
+    @staticmethod
+    def sweep_overdue(today=None):
+        """
+        Marca como vencidos los préstamos activos cuya fecha de devolución ya pasó
+        y descuenta el puntaje por los días de mora aún no penalizados.
+
+        Es seguro ejecutarlo varias veces: `penalized_until` registra hasta qué día
+        se cobró la mora de cada préstamo, así que una segunda corrida en el mismo
+        día no vuelve a penalizar ni a notificar.
+        """
+        today = today or timezone.now().date()
+
+        with transaction.atomic():
+            pending = Loan.objects.filter(
+                status__in=Loan.OPEN_STATUSES,
+                due_date__lt=today,
+            ).filter(
+                Q(penalized_until__isnull=True) | Q(penalized_until__lt=today)
+            )
+            rows = list(
+                pending.select_for_update().values_list(
+                    'id', 'user_id', 'status', 'due_date', 'penalized_until', 'book__title'
+                )
+            )
+            if not rows:
+                return {'overdue': 0, 'penalized_users': 0}
+
+            penalties = defaultdict(float)
+            notifications = []
+            for loan_id, user_id, status, due_date, penalized_until, title in rows:
+                start = max(due_date, penalized_until or due_date)
+                penalties[user_id] += (today - start).days * OVERDUE_PENALTY_PER_DAY
+                if status == 'active':
+                    notifications.append((
+                        user_id,
+                        f'Tu préstamo de "{title}" venció el {due_date:%d/%m/%Y}. '
+                        'Devolvelo cuanto antes para evitar más penalizaciones.',
+                    ))
+
+            # Una sola sentencia para la transición de estado
+            pending.update(status='overdue', penalized_until=today)
+
+            LoanService._apply_penalties(penalties)
+            NotificationService.notify_many(notifications)
+
+        newly_overdue = len(notifications)
+        metrics.LOANS_MARKED_OVERDUE.inc(newly_overdue)
+        logger.info(
+            f"Barrido de mora: {newly_overdue} préstamos vencidos, "
+            f"{len(penalties)} usuarios penalizados"
+        )
+        return {'overdue': newly_overdue, 'penalized_users': len(penalties)}
+
+    @staticmethod
+    def due_for_reminder(today, days):
+        """Préstamos activos que vencen entre hoy y dentro de `days` días y todavía no se recordaron"""
+        return Loan.objects.filter(
+            status='active',
+            due_date__gte=today,
+            due_date__lte=today + timedelta(days=days),
+        ).exclude(reminded_for=F('due_date'))
+
+    @staticmethod
+    def send_due_reminders(today=None, days=None, connection=None):
+        """
+        Avisa a los socios con préstamos activos que vencen dentro de `days`
+        días (LOANS_CONFIG['DUE_REMINDER_DAYS']): una notificación y un email
+        por socio con todos sus libros.
+
+        La selección es una sola consulta sobre el índice (status, due_date).
+        `reminded_for` guarda el vencimiento ya recordado y se marca en la misma
+        transacción que las notificaciones, antes de enviar los emails: volver
+        a correrlo (o correrlo todos los días) no repite avisos, y un préstamo
+        renovado se recuerda de nuevo para su nueva fecha. Un email que falla
+        se registra y no se reintenta.
+        """
+        today = today or timezone.now().date()
+        days = settings.LOANS_CONFIG.get('DUE_REMINDER_DAYS', 3) if days is None else days
+
+        with transaction.atomic():
+            pending = LoanService.due_for_reminder(today, days)
+            rows = list(
+                pending.select_for_update().order_by('user_id', 'due_date').values_list(
+                    'user_id', 'user__email', 'user__first_name', 'user__username', 'book__title', 'due_date'
+                )
+            )
+            if not rows:
+                return {'loans': 0, 'users': 0, 'emails_sent': 0, 'emails_failed': 0}
+
+            by_user = {}
+            for user_id, email, first_name, username, title, due_date in rows:
+                reminder = by_user.setdefault(
+                    user_id, {'email': email, 'name': first_name or username, 'loans': []}
+                )
+                reminder['loans'].append({'title': title, 'due_date': due_date})
+
+            pending.update(reminded_for=F('due_date'))
+            NotificationService.notify_many(
+                (user_id, LoanService._reminder_message(reminder['loans']))
+                for user_id, reminder in by_user.items()
+            )
+
+        sent, failed = LoanService._email_reminders(
+            [reminder for reminder in by_user.values() if reminder['email']], connection
+        )
+        metrics.LOANS_REMINDED.inc(len(rows))
+        logger.info(
+            f"Recordatorios de vencimiento: {len(rows)} préstamos, {len(by_user)} socios, "
+            f"{sent} emails enviados, {failed} fallidos"
+        )
+        return {'loans': len(rows), 'users': len(by_user), 'emails_sent': sent, 'emails_failed': failed}
+
+    @staticmethod
+    def _reminder_message(loans):
+        if len(loans) == 1:
+            loan = loans[0]
+            return f'Tu préstamo de "{loan["title"]}" vence el {loan["due_date"]:%d/%m/%Y}.'
+        titles = ', '.join(f'"{loan["title"]}" ({loan["due_date"]:%d/%m})' for loan in loans)
+        return f'Tenés {len(loans)} préstamos por vencer: {titles}.'
+
+    @staticmethod
+    def _email_reminders(reminders, connection=None):
+        """Emails de recordatorio en lotes de NEWSLETTER_CONFIG['BATCH_SIZE'], una conexión SMTP por lote"""
+        connection = connection or get_connection()
+        batch_size = settings.NEWSLETTER_CONFIG.get('BATCH_SIZE', 50)
+        sent = failed = 0
+        for i in range(0, len(reminders), batch_size):
+            messages = []
+            for reminder in reminders[i:i + batch_size]:
+                context = {**reminder, 'site_url': settings.SITE_URL, 'current_year': timezone.now().year}
+                email = EmailMultiAlternatives(
+                    subject='Tus préstamos vencen pronto',
+                    body=render_to_string('loans/recordatorio.txt', context),
+                    from_email=settings.DEFAULT_FROM_EMAIL,
+                    to=[reminder['email']],
+                    connection=connection,
+                )
+                email.attach_alternative(render_to_string('loans/recordatorio.html', context), 'text/html')
+                messages.append(email)
+            batch_sent, batch_failed = NewsletterService.send_batch(connection, messages)
+            sent += batch_sent
+            failed += batch_failed
+        return sent, failed
+
+    @staticmethod
+    def _apply_penalties(penalties):
+        """
+        Descuenta puntaje en bloque. Los usuarios se agrupan por monto de la
+        penalización, así cada grupo se resuelve con un UPDATE ... WHERE id IN (...)
+        """
+        by_amount = defaultdict(list)
+        for user_id, amount in penalties.items():
+            if amount > 0:
+                by_amount[amount].append(user_id)
+
+        for amount, user_ids in by_amount.items():
+            for i in range(0, len(user_ids), UPDATE_CHUNK_SIZE):
+                User.objects.filter(pk__in=user_ids[i:i + UPDATE_CHUNK_SIZE]).update(
+                    score=Greatest(F('score') - amount, Value(0.0))
+                )
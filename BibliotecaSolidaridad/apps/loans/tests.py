@@ -1,3 +1,700 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import random
+import tempfile
+from io import StringIO
+from unittest import mock
+from datetime import timedelta
+from django.core import mail
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from apps.books.forms import BookForm
+from apps.books.models import Book, BookStock
+from apps.books.views import ProfileView
+from apps.dashboard.models import Notification
+from apps.dashboard.queryplan import QueryPlanAssertionsMixin, analyze
+from apps.users.models import User, UserProfile
+from .circulation import CirculationService
+from .holds import HoldService
+from .inventory import InventoryService
+from .models import Loan, LoanRequest
+from .services import LoanService
+from .views import LoansManagerView, UserLoansView
 
-# Create your tests here.
+
+class OverdueSweepTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        cls.book = Book.objects.create(title='Rayuela', authors=['Julio Cortázar'])
+        cls.reader = User.objects.create_user('lector', 'lector@example.com', 'x', dni='1')
+
+    def _loan(self, days_late, status='active'):
+        return Loan.objects.create(
+            user=self.reader,
+            book=self.book,
+            due_date=self.today - timedelta(days=days_late),
+            status=status,
+        )
+
+    def test_marks_late_loans_overdue_and_penalizes(self):
+        late = self._loan(4)
+        on_time = self._loan(-2)
+
+        result = LoanService.sweep_overdue(self.today)
+
+        late.refresh_from_db()
+        on_time.refresh_from_db()
+        self.reader.refresh_from_db()
+        self.assertEqual(result['overdue'], 1)
+        self.assertEqual(late.status, 'overdue')
+        self.assertEqual(late.penalized_until, self.today)
+        self.assertEqual(on_time.status, 'active')
+        self.assertEqual(self.reader.score, 3.0)
+        self.assertEqual(Notification.objects.filter(user=self.reader).count(), 1)
+
+    def test_rerun_is_idempotent(self):
+        self._loan(2)
+        LoanService.sweep_overdue(self.today)
+        result = LoanService.sweep_overdue(self.today)
+
+        self.reader.refresh_from_db()
+        self.assertEqual(result['overdue'], 0)
+        self.assertEqual(self.reader.score, 4.0)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_next_day_only_charges_new_days(self):
+        self._loan(2)
+        LoanService.sweep_overdue(self.today)
+        LoanService.sweep_overdue(self.today + timedelta(days=1))
+
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.score, 3.5)
+        self.assertEqual(Notification.objects.count(), 1)
+
+    def test_score_never_goes_below_zero(self):
+        self._loan(30)
+        LoanService.sweep_overdue(self.today)
+
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.score, 0)
+
+
+@override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 2}, LOANS_CONFIG={'DUE_REMINDER_DAYS': 3})
+class DueReminderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.today = timezone.now().date()
+        cls.books = Book.objects.bulk_create(Book(title=f'Libro {i}', authors=['Autor']) for i in range(4))
+        cls.readers = [
+            User.objects.create_user(f'recordada{i}', f'recordada{i}@example.com', 'x', dni=f'D{i}')
+            for i in range(3)
+        ]
+
+    def _loan(self, reader, book, days, status='active'):
+        return Loan.objects.create(
+            user=reader, book=book, due_date=self.today + timedelta(days=days), status=status
+        )
+
+    def test_groups_loans_per_user(self):
+        first, second, third = self.readers
+        self._loan(first, self.books[0], 1)
+        self._loan(first, self.books[1], 3)
+        self._loan(second, self.books[2], 0)
+        self._loan(third, self.books[3], 5)  # Todavía falta
+        self._loan(third, self.books[0], 1, status='returned')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            result = LoanService.send_due_reminders(self.today)
+
+        self.assertEqual(result, {'loans': 3, 'users': 2, 'emails_sent': 2, 'emails_failed': 0})
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [first.email, second.email])
+        first_email = next(message for message in mail.outbox if message.to == [first.email])
+        self.assertIn('"Libro 0"', first_email.body)
+        self.assertIn('"Libro 1"', first_email.body)
+        self.assertEqual(Notification.objects.filter(user=first).count(), 1)
+        self.assertFalse(Notification.objects.filter(user=third).exists())
+
+    def test_rerun_never_sends_twice(self):
+        loan = self._loan(self.readers[0], self.books[0], 2)
+        LoanService.send_due_reminders(self.today)
+        result = LoanService.send_due_reminders(self.today)
+        LoanService.send_due_reminders(self.today + timedelta(days=1))
+
+        self.assertEqual(result['loans'], 0)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Notification.objects.count(), 1)
+
+        # Renovado: se recuerda el nuevo vencimiento
+        Loan.objects.filter(pk=loan.pk).update(due_date=self.today + timedelta(days=3))
+        self.assertEqual(LoanService.send_due_reminders(self.today)['loans'], 1)
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_failed_email_still_marks_the_loan(self):
+        self._loan(self.readers[0], self.books[0], 1)
+        with self.assertLogs('apps.newsletter.services', 'ERROR'):
+            with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=ConnectionError):
+                result = LoanService.send_due_reminders(self.today)
+
+        self.assertEqual(result['emails_failed'], 1)
+        self.assertEqual(LoanService.send_due_reminders(self.today)['loans'], 0)
+
+
+class CirculationAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('mostrador', dni='C0', role='librarian')
+        cls.reader = User.objects.create_user('escaneada', dni='C1', score=3.5)  # Límite de 3
+        cls.other = User.objects.create_user('vecina', dni='C2')
+        cls.books = Book.objects.bulk_create(Book(title=f'Tomo {i}', authors=['Autor']) for i in range(3))
+        BookStock.objects.bulk_create(
+            [BookStock(book=book, physical_id=f'EJ-{book.pk}-{n}', status='available')
+             for book in cls.books for n in (1, 2)]
+            + [BookStock(book=cls.books[0], physical_id='EJ-ROTO', status='maintenance')]
+        )
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def barcode(self, book, n=1):
+        return f'EJ-{book.pk}-{n}'
+
+    def post(self, name, **payload):
+        return self.client.post(reverse(name), json.dumps(payload), content_type='application/json')
+
+    def checkout(self, *barcodes, user=None):
+        user = user or self.reader
+        return self.post('circulation_checkout', card=user.profile.virtual_card_id, barcodes=list(barcodes))
+
+    def test_patron_scan(self):
+        self.checkout(self.barcode(self.books[0]))
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('circulation_patron', args=[self.reader.profile.virtual_card_id]))
+
+        data = response.json()
+        self.assertEqual(data['patron']['name'], 'escaneada')
+        self.assertEqual((data['patron']['loan_limit'], data['patron']['active_loans']), (3, 1))
+        self.assertEqual([loan['barcode'] for loan in data['loans']], [self.barcode(self.books[0])])
+        self.assertEqual(self.client.get(reverse('circulation_patron', args=['VCARD-NO'])).status_code, 404)
+
+    def test_checkout_several_copies_in_one_transaction(self):
+        LoanRequest.objects.create(user=self.reader, book=self.books[1])
+        response = self.checkout(self.barcode(self.books[0]), self.barcode(self.books[1]), self.barcode(self.books[1], 2))
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['loans']), 3)
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 3)
+        self.assertEqual(BookStock.objects.filter(status='borrowed').count(), 3)
+        self.assertEqual(Loan.objects.filter(user=self.reader, copy__isnull=False, status='active').count(), 3)
+        # Al libro 1 no le quedan ejemplares; al 0 sí
+        self.assertEqual(
+            dict(Book.objects.filter(pk__in=[self.books[0].pk, self.books[1].pk]).values_list('pk', 'available_copies')),
+            {self.books[0].pk: 1, self.books[1].pk: 0},
+        )
+        self.assertEqual(LoanRequest.objects.get(user=self.reader).status, 'approved')
+
+    def test_checkout_is_all_or_nothing(self):
+        response = self.checkout(self.barcode(self.books[0]), 'EJ-ROTO', 'EJ-NADA')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['barcodes'], {'EJ-NADA': 'Código desconocido'})
+
+        response = self.checkout(self.barcode(self.books[0]), 'EJ-ROTO')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(list(response.json()['barcodes']), ['EJ-ROTO'])
+
+        # Cuatro ejemplares superan su límite de tres
+        response = self.checkout(*[self.barcode(book, n) for book in self.books[:2] for n in (1, 2)])
+        self.assertEqual(response.status_code, 409)
+
+        self.assertFalse(Loan.objects.exists())
+        self.assertFalse(BookStock.objects.filter(status='borrowed').exists())
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 0)
+
+    def test_suspended_patron_cannot_borrow(self):
+        User.objects.filter(pk=self.reader.pk).update(is_active_member=False)
+        self.assertEqual(self.checkout(self.barcode(self.books[0])).status_code, 403)
+
+    def test_return(self):
+        self.checkout(self.barcode(self.books[0]), self.barcode(self.books[1]))
+        Loan.objects.filter(copy__physical_id=self.barcode(self.books[0])).update(
+            due_date=timezone.now().date() - timedelta(days=2)
+        )
+
+        # Con el carnet de otro socio no se aceptan
+        response = self.post(
+            'circulation_return', card=self.other.profile.virtual_card_id, barcodes=[self.barcode(self.books[0])]
+        )
+        self.assertEqual(response.status_code, 409)
+
+        response = self.post('circulation_return', barcodes=[self.barcode(self.books[0]), self.barcode(self.books[1])])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([loan['days_overdue'] for loan in response.json()['loans']], [2, 0])
+        self.assertFalse(BookStock.objects.filter(status='borrowed').exists())
+        self.assertFalse(Loan.objects.filter(status__in=Loan.OPEN_STATUSES).exists())
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 0)
+        self.assertEqual(self.reader.score, 2.5)
+
+        # Ya devuelto
+        response = self.post('circulation_return', barcodes=[self.barcode(self.books[0])])
+        self.assertEqual(response.status_code, 409)
+
+    def test_only_librarians(self):
+        self.client.force_login(self.reader)
+        self.assertEqual(self.checkout(self.barcode(self.books[0])).status_code, 403)
+        self.assertEqual(self.post('circulation_return', barcodes='EJ-1').status_code, 403)
+
+
+class LoanApprovalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('aprobadora', dni='A0', role='librarian')
+        cls.readers = [User.objects.create_user(f'solicitante{i}', dni=f'A{i + 1}') for i in range(3)]
+        cls.book = Book.objects.create(title='Dos ejemplares', authors=['Autora'])
+        BookStock.objects.bulk_create(
+            BookStock(book=cls.book, physical_id=f'DOS-{n}', status='available') for n in (1, 2)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.librarian)
+
+    def approve(self, reader):
+        loan_request = LoanRequest.objects.create(user=reader, book=self.book)
+        self.client.post(reverse('approve_loan_request', args=[loan_request.pk]))
+        loan_request.refresh_from_db()
+        return loan_request
+
+    def available_copies(self):
+        return Book.objects.get(pk=self.book.pk).available_copies
+
+    def test_each_approval_lends_one_copy(self):
+        self.assertEqual(self.approve(self.readers[0]).status, 'approved')
+        # Queda otro ejemplar: el libro sigue disponible
+        self.assertEqual(self.available_copies(), 1)
+        self.assertEqual(self.approve(self.readers[1]).status, 'approved')
+        self.assertEqual(self.available_copies(), 0)
+        self.assertEqual(
+            sorted(Loan.objects.values_list('copy__physical_id', flat=True)), ['DOS-1', 'DOS-2']
+        )
+
+        # Sin ejemplares la solicitud queda pendiente
+        waiting = self.approve(self.readers[2])
+        self.assertEqual(waiting.status, 'pending')
+
+        # La devolución le aparta el ejemplar, que no vuelve a estar disponible
+        loan = Loan.objects.get(user=self.readers[0])
+        self.client.post(reverse('return_book', args=[loan.pk]))
+        self.assertEqual(BookStock.objects.get(pk=loan.copy_id).status, 'reserved')
+        self.assertEqual(self.available_copies(), 0)
+        self.client.post(reverse('approve_loan_request', args=[waiting.pk]))
+        self.assertEqual(Loan.objects.get(user=self.readers[2]).copy_id, loan.copy_id)
+
+        # Sin nadie esperando, la devolución lo deja en el estante
+        self.client.post(reverse('return_book', args=[loan.pk + 1]))
+        self.assertEqual(self.available_copies(), 1)
+
+    def test_loan_limit_releases_the_copy(self):
+        User.objects.filter(pk=self.readers[0].pk).update(active_loans_count=self.readers[0].get_loan_limit())
+        self.assertEqual(self.approve(self.readers[0]).status, 'pending')
+        self.assertEqual(self.available_copies(), 2)
+        self.assertFalse(BookStock.objects.filter(status='borrowed').exists())
+
+
+class HoldQueueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.librarian = User.objects.create_user('mostradora', dni='H0', role='librarian')
+        # Prioridad 0 (5.0), 1 (3.5) y 2 (2.0)
+        cls.good, cls.fair, cls.poor, cls.late = [
+            User.objects.create_user(f'espera{i}', dni=f'H{i + 1}', score=score)
+            for i, score in enumerate((5.0, 3.5, 2.0, 5.0))
+        ]
+        cls.book = Book.objects.create(title='Muy pedido', authors=['Autora'])
+        BookStock.objects.bulk_create([BookStock(book=cls.book, physical_id='PEDIDO-1', status='borrowed')])
+        cls.copy = BookStock.objects.get(physical_id='PEDIDO-1')
+        cls.holder = User.objects.create_user('lectora', dni='H9')
+        cls.loan = Loan.objects.create(
+            user=cls.holder, book=cls.book, copy=cls.copy, due_date=timezone.now().date(), status='active'
+        )
+
+    def submit(self, user):
+        self.client.force_login(user)
+        return self.client.post(reverse('submit_loan_request'), {'book_id': self.book.pk}, follow=True)
+
+    def queue(self):
+        return list(LoanRequest.objects.waiting().filter(book=self.book).queue_order().values_list('user__username', flat=True))
+
+    def test_unavailable_book_queues_by_priority_then_arrival(self):
+        for user in (self.poor, self.fair, self.good, self.late):
+            response = self.submit(user)
+        self.assertContains(response, 'puesto 2 de la lista de espera')
+        self.assertEqual(self.queue(), ['espera0', 'espera3', 'espera1', 'espera2'])
+
+        positions = {
+            hold.user_id: hold.queue_position
+            for hold in LoanRequest.objects.filter(book=self.book).with_queue_position()
+        }
+        self.assertEqual(positions, {self.good.pk: 1, self.late.pk: 2, self.fair.pk: 3, self.poor.pk: 4})
+
+        self.client.force_login(self.poor)
+        self.assertContains(self.client.get(reverse('user_loans')), 'Puesto 4 en la lista de espera')
+
+    def test_unavailable_book_offers_the_waiting_list(self):
+        self.submit(self.fair)
+        self.client.force_login(self.good)
+
+        response = self.client.get(reverse('book_detail', args=[self.book.pk]))
+        self.assertContains(response, 'Unirme a la Lista de Espera')
+        self.assertContains(response, '1 en espera')
+        response = self.client.get(reverse('loans'))
+        self.assertContains(response, 'Sin ejemplares libres (lista de espera)')
+        self.assertContains(response, 'Muy pedido — [&#x27;Autora&#x27;] (1 en espera)')
+
+    def test_one_pending_request_per_user_and_book(self):
+        self.submit(self.good)
+        response = self.submit(self.good)
+        self.assertContains(response, 'Ya tenés una solicitud pendiente')
+        self.assertEqual(LoanRequest.objects.filter(user=self.good).count(), 1)
+
+    def test_return_reserves_the_copy_for_the_head_of_the_queue(self):
+        self.submit(self.fair)
+        self.submit(self.good)
+        self.client.force_login(self.librarian)
+
+        # Devolución en el mostrador: la respuesta avisa que va al estante de reservas
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('circulation_return'), json.dumps({'barcodes': ['PEDIDO-1']}), content_type='application/json'
+            )
+        self.assertEqual(response.json()['loans'][0]['reserved_for'], 'espera0')
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, 'reserved')
+        self.assertEqual(LoanRequest.objects.get(user=self.good).copy_id, self.copy.pk)
+        self.assertEqual(self.queue(), ['espera1'])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 0)
+        self.assertTrue(Notification.objects.filter(user=self.good, message__contains='reservado').exists())
+
+        # Otro socio no se lo puede llevar; el de la reserva sí
+        checkout = lambda user: self.client.post(
+            reverse('circulation_checkout'),
+            json.dumps({'card': user.profile.virtual_card_id, 'barcodes': ['PEDIDO-1']}),
+            content_type='application/json',
+        )
+        self.assertEqual(checkout(self.fair).status_code, 409)
+        self.assertEqual(checkout(self.good).status_code, 201)
+        self.assertEqual(LoanRequest.objects.get(user=self.good).status, 'approved')
+
+    def test_copies_freed_elsewhere_go_to_the_queue(self):
+        self.submit(self.good)
+        self.submit(self.fair)
+
+        # Un ejemplar perdido que aparece en el inventario
+        BookStock.objects.bulk_create([BookStock(book=self.book, physical_id='PEDIDO-2', status='lost')])
+        InventoryService.reconcile({'PEDIDO-1', 'PEDIDO-2'}, apply=True)
+        found = BookStock.objects.get(physical_id='PEDIDO-2')
+        self.assertEqual(found.status, 'reserved')
+        self.assertEqual(LoanRequest.objects.get(user=self.good).copy_id, found.pk)
+
+        # Ejemplares nuevos desde el alta: uno para la cola, el otro al estante
+        form = BookForm(instance=self.book)
+        form.cleaned_data = {'copies': 2}
+        form.save_copies()
+        self.assertEqual(LoanRequest.objects.get(user=self.fair).copy.status, 'reserved')
+        self.assertEqual(self.queue(), [])
+        self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 1)
+
+    def test_checkout_of_another_copy_releases_the_reserved_one(self):
+        self.submit(self.good)
+        self.submit(self.fair)
+        LoanService.return_loan(self.loan)
+        HoldService.shelve([(self.copy.pk, self.book.pk)])
+        other = BookStock.objects.create(book=self.book, physical_id='PEDIDO-2', status='available')
+
+        # El socio se lleva otro ejemplar del mismo libro: el apartado pasa al siguiente
+        CirculationService.checkout(self.good, ['PEDIDO-2'], librarian=self.librarian)
+        self.assertEqual(LoanRequest.objects.get(user=self.good).status, 'approved')
+        self.assertEqual(BookStock.objects.get(pk=other.pk).status, 'borrowed')
+        self.assertEqual(LoanRequest.objects.get(user=self.fair).copy_id, self.copy.pk)
+        self.assertEqual(BookStock.objects.get(pk=self.copy.pk).status, 'reserved')
+
+        # Sin nadie más esperando, el siguiente cambio de ejemplar lo deja disponible
+        LoanRequest.objects.filter(user=self.fair).update(status='rejected')
+        LoanRequest.objects.create(user=self.poor, book=self.book, status='pending', copy=self.copy)
+        third = BookStock.objects.create(book=self.book, physical_id='PEDIDO-3', status='available')
+        CirculationService.checkout(self.poor, ['PEDIDO-3'])
+        self.assertEqual(BookStock.objects.get(pk=self.copy.pk).status, 'available')
+        self.assertEqual(BookStock.objects.get(pk=third.pk).status, 'borrowed')
+        self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 1)
+
+    def test_shelve_only_looks_up_queues_of_waited_books(self):
+        self.submit(self.good)
+        quiet = Book.objects.bulk_create(Book(title=f'Sin cola {n}', authors=['Autora']) for n in range(20))
+        BookStock.objects.bulk_create(
+            BookStock(book=book, physical_id=f'QUIETO-{book.pk}', status='lost') for book in quiet
+        )
+        freed = [(copy.pk, copy.book_id) for copy in BookStock.objects.filter(physical_id__startswith='QUIETO-')]
+
+        # Cola de un libro, ejemplares sin cola, cambio de estado, aviso: no depende de cuántos vuelven
+        with self.assertNumQueries(15):
+            allocated = HoldService.shelve(freed + [(self.copy.pk, self.book.pk)])
+        self.assertEqual(list(allocated), [self.copy.pk])
+        self.assertEqual(Book.objects.filter(pk__in=[book.pk for book in quiet], available_copies=1).count(), 20)
+
+    def test_rejecting_a_ready_hold_passes_the_copy_on(self):
+        self.submit(self.good)
+        self.submit(self.fair)
+        LoanService.return_loan(self.loan)
+        HoldService.shelve([(self.copy.pk, self.book.pk)])
+
+        self.client.force_login(self.librarian)
+        ready = LoanRequest.objects.get(user=self.good)
+        self.client.post(reverse('reject_loan_request', args=[ready.pk]))
+        self.assertEqual(LoanRequest.objects.get(user=self.fair).copy_id, self.copy.pk)
+
+        self.client.post(reverse('reject_loan_request', args=[LoanRequest.objects.get(user=self.fair).pk]))
+        self.copy.refresh_from_db()
+        self.assertEqual(self.copy.status, 'available')
+        self.assertEqual(Book.objects.get(pk=self.book.pk).available_copies, 1)
+
+
+class InventoryAuditTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader = User.objects.create_user('inventariada', dni='I1')
+        cls.books = Book.objects.bulk_create(Book(title=f'Estante {i}', authors=['Autor']) for i in range(2))
+        statuses = {
+            'INV-1': 'available', 'INV-2': 'available', 'INV-3': 'lost', 'INV-4': 'borrowed',
+            'INV-5': 'borrowed', 'INV-6': 'maintenance', 'INV-7': 'borrowed', 'INV-8': 'lost',
+        }
+        copies = BookStock.objects.bulk_create(
+            BookStock(book=cls.books[0] if barcode != 'INV-2' else cls.books[1], physical_id=barcode, status=status)
+            for barcode, status in statuses.items()
+        )
+        cls.copies = {copy.physical_id: copy for copy in copies}
+        # INV-5 está en el estante pero su préstamo sigue abierto
+        Loan.objects.create(
+            user=cls.reader, book=cls.books[0], copy=cls.copies['INV-5'],
+            due_date=timezone.now().date(), status='active',
+        )
+
+    def scan(self, apply=False):
+        rows = []
+        counts = InventoryService.reconcile(
+            InventoryService.read_barcodes(['INV-1\n', ' INV-3 ', 'INV-4', 'INV-5', 'INV-6', 'INV-1', 'NADA-9', '\n']),
+            apply=apply, report=lambda *row: rows.append(row), chunk_size=3,
+        )
+        return counts, {row[0]: row[3:] for row in rows}
+
+    def status(self, barcode):
+        return BookStock.objects.get(physical_id=barcode).status
+
+    def test_report(self):
+        counts, rows = self.scan()
+
+        self.assertEqual(rows, {
+            'INV-2': ('missing', 'lost'),
+            'INV-3': ('found', 'available'),
+            'INV-4': ('borrowed_on_shelf', 'available'),
+            'INV-5': ('open_loan_on_shelf', None),
+            'INV-6': ('maintenance_on_shelf', None),
+            'NADA-9': ('unexpected', None),
+        })
+        self.assertEqual(
+            (counts['scanned'], counts['copies'], counts['ok'], counts['unexpected'], counts['updated']),
+            (6, 8, 3, 1, 0),
+        )
+        # Sin apply no cambia nada
+        self.assertEqual(self.status('INV-2'), 'available')
+
+    def test_apply(self):
+        counts, _ = self.scan(apply=True)
+
+        self.assertEqual(counts['updated'], 3)
+        self.assertEqual(
+            [self.status(barcode) for barcode in ('INV-1', 'INV-2', 'INV-3', 'INV-4', 'INV-5', 'INV-7', 'INV-8')],
+            ['available', 'lost', 'available', 'available', 'borrowed', 'borrowed', 'lost'],
+        )
+        # El libro 1 se quedó sin ejemplares disponibles; el 0 recuperó dos y perdió uno prestado
+        self.assertEqual(
+            list(Book.objects.filter(pk__in=[book.pk for book in self.books]).order_by('pk').values_list(
+                'available_copies', 'total_copies'
+            )),
+            [(3, 7), (0, 1)],
+        )
+
+    def test_apply_respects_concurrent_changes(self):
+        original = InventoryService._apply
+
+        def checkout_first(changes):
+            # El mostrador presta INV-2 entre la lectura y el UPDATE
+            BookStock.objects.filter(physical_id='INV-2').set_status('borrowed')
+            return original(changes)
+
+        with mock.patch.object(InventoryService, '_apply', checkout_first):
+            self.scan(apply=True)
+        self.assertEqual(self.status('INV-2'), 'borrowed')
+
+    def test_command(self):
+        scan = self.tmp_file('INV-1\nINV-3\n')
+        report = self.tmp_file('')
+        out = StringIO()
+        call_command('audit_inventory', scan, '--apply', '--report', report, stdout=out)
+
+        self.assertIn('Ejemplares actualizados: 2', out.getvalue())
+        with open(report, encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], ['physical_id', 'book_id', 'estado', 'hallazgo', 'nuevo_estado'])
+        self.assertEqual({row[0]: row[3] for row in rows[1:]}, {'INV-2': 'missing', 'INV-3': 'found'})
+
+    def tmp_file(self, content):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False, encoding='utf-8')
+        with handle:
+            handle.write(content)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+
+class ActiveLoanCounterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(title='Ficciones', authors=['Jorge Luis Borges'])
+
+    def setUp(self):
+        # Puntaje 1.0: límite de un préstamo
+        self.reader = User.objects.create_user('lector', 'lector@example.com', 'x', dni='1', score=1.0)
+
+    def test_open_loan_increments_and_enforces_limit(self):
+        self.assertIsNotNone(LoanService.open_loan(self.reader, self.book))
+        self.assertIsNone(LoanService.open_loan(self.reader, self.book))
+
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 1)
+        self.assertEqual(self.reader.loan_headroom, 0)
+        self.assertEqual(Loan.objects.filter(user=self.reader).count(), 1)
+
+    def test_return_and_loss_release_the_slot_once(self):
+        returned = LoanService.open_loan(self.reader, self.book)
+        LoanService.return_loan(returned)
+        LoanService.return_loan(returned)
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 0)
+
+        lost = LoanService.open_loan(self.reader, self.book)
+        self.assertTrue(LoanService.mark_lost(lost))
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 0)
+        self.assertEqual(Loan.objects.get(pk=lost.pk).status, 'lost')
+
+    def test_reconcile_fixes_drift(self):
+        Loan.objects.create(user=self.reader, book=self.book, due_date=timezone.now().date(), status='overdue')
+        User.objects.filter(pk=self.reader.pk).update(active_loans_count=4)
+
+        self.assertEqual(LoanService.reconcile_active_loan_counts(), 1)
+        self.reader.refresh_from_db()
+        self.assertEqual(self.reader.active_loans_count, 1)
+        self.assertEqual(LoanService.reconcile_active_loan_counts(), 0)
+
+
+class QueryPlanTests(QueryPlanAssertionsMixin, TestCase):
+    """
+    Los querysets de las vistas de préstamos no deben recorrer tablas completas
+    sobre un volumen realista, con estadísticas del planificador actualizadas.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(28)
+        today = timezone.now().date()
+        User.objects.bulk_create(
+            User(username=f'lector{i}', dni=f'{i:08d}', email=f'lector{i}@example.com')
+            for i in range(1000)
+        )
+        Book.objects.bulk_create(
+            Book(title=f'Libro {i}', authors=[f'Autor {i % 50}']) for i in range(200)
+        )
+        user_ids = list(User.objects.values_list('id', flat=True))
+        book_ids = list(Book.objects.values_list('id', flat=True))
+
+        statuses = rng.choices(['returned', 'active', 'overdue', 'lost'], [90, 7, 2, 1], k=30000)
+        Loan.objects.bulk_create(
+            (
+                Loan(
+                    user_id=rng.choice(user_ids),
+                    book_id=rng.choice(book_ids),
+                    due_date=today + timedelta(days=rng.randint(-400, 15)),
+                    status=status,
+                )
+                for status in statuses
+            ),
+            batch_size=2000,
+        )
+        request_statuses = rng.choices(['approved', 'rejected', 'pending'], [80, 15, 5], k=5000)
+        LoanRequest.objects.bulk_create(
+            (
+                LoanRequest(user_id=rng.choice(user_ids), book_id=rng.choice(book_ids), status=status)
+                for status in request_statuses
+            ),
+            batch_size=2000,
+            ignore_conflicts=True,
+        )
+        cls.reader = User.objects.create_user('lectora', dni='R1')
+        cls.librarian = User.objects.create_user('bibliotecaria', dni='L1', role='librarian')
+        analyze()
+
+    def _view(self, view_class, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        view = view_class()
+        view.setup(request)
+        return view
+
+    def test_loans_manager_querysets(self):
+        view = self._view(LoansManagerView, self.librarian)
+        view.object_list = view.get_queryset()
+        context = view.get_context_data()
+
+        self.assertUsesIndexes(view.object_list)
+        self.assertUsesIndexes(context['active_loans'])
+        self.assertUsesIndexes(context['overdue_loans'])
+
+    def test_user_loans_querysets(self):
+        self.assertUsesIndexes(self._view(UserLoansView, self.reader).get_queryset())
+
+        view = self._view(ProfileView, self.reader)
+        view.object = view.get_object()
+        context = view.get_context_data()
+        self.assertUsesIndexes(context['active_loans'])
+        self.assertUsesIndexes(context['loan_history'])
+
+    def test_status_counters(self):
+        self.assertUsesIndexes(Loan.objects.active())
+        self.assertUsesIndexes(Loan.objects.filter(status='overdue'))
+        self.assertUsesIndexes(LoanRequest.objects.filter(status='pending'))
+
+    def test_circulation_lookups(self):
+        self.assertUsesIndexes(UserProfile.objects.filter(virtual_card_id='VCARD-00001'))
+        self.assertUsesIndexes(BookStock.objects.filter(physical_id__in=['BS-1', 'BS-2']))
+        self.assertUsesIndexes(Loan.objects.filter(copy_id__in=[1, 2], status__in=Loan.OPEN_STATUSES))
+
+    def test_available_books(self):
+        self.assertUsesIndexes(Book.objects.filter(available_copies__gt=0))
+
+    def test_hold_queue_lookups(self):
+        self.assertUsesIndexes(LoanRequest.objects.waiting().filter(book_id=1).queue_order()[:1])
+        self.assertUsesIndexes(LoanRequest.objects.filter(user=self.reader, status='pending').with_queue_position())
+
+    def test_due_reminder_selection(self):
+        self.assertUsesIndexes(LoanService.due_for_reminder(timezone.now().date(), 3))
+
+    def test_overdue_sweep_selection(self):
+        self.assertUsesIndexes(
+            Loan.objects.filter(
+                status__in=Loan.OPEN_STATUSES,
+                due_date__lt=timezone.now().date(),
+            )
+        )
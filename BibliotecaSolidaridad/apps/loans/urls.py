@@ -1,5 +1,6 @@
 from django.urls import path
 from .views import LoanRequestView, SubmitLoanRequestView, UserLoansView, LoansManagerView, ApproveLoanRequestView, RejectLoanRequestView, ReturnBookView
+from .views import CirculationPatronView, CirculationCheckoutView, CirculationReturnView
 
 urlpatterns = [
     path('', LoanRequestView.as_view(), name='loans'),
@@ -9,4 +10,8 @@ urlpatterns = [
     path('my/', UserLoansView.as_view(), name='user_loans'),
     path('gestionar/', LoansManagerView.as_view(), name='manage_loans'),
     path('return/<int:loan_id>/', ReturnBookView.as_view(), name='return_book'),
+    # API JSON del mostrador (lector de códigos)
+    path('api/patrons/<str:card_id>/', CirculationPatronView.as_view(), name='circulation_patron'),
+    path('api/checkout/', CirculationCheckoutView.as_view(), name='circulation_checkout'),
+    path('api/return/', CirculationReturnView.as_view(), name='circulation_return'),
 ]
@@ -1,12 +1,20 @@
+import json
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.http import JsonResponse
 from django.views.generic import TemplateView, ListView, CreateView, View
 from django.shortcuts import get_object_or_404, redirect
 from django.contrib import messages
 from django.urls import reverse_lazy
+from .circulation import CirculationError, CirculationService
+from .holds import HoldService
 from .models import LoanRequest, Loan
-from apps.books.models import Book
+from .services import LoanService
+from apps.books.models import Book, BookStock
+from apps.dashboard import events, metrics
+from apps.dashboard.notifications import NotificationService
+from django.db import transaction
+from django.db.models import Count, Q
 from django.utils import timezone
-from datetime import timedelta
 
 
 class LoanRequestView(LoginRequiredMixin, TemplateView):
@@ -14,7 +22,11 @@ class LoanRequestView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context["available_books"] = Book.objects.filter(available=True)
+        context["available_books"] = Book.objects.filter(available_copies__gt=0)
+        # Los que tienen ejemplares pero ninguno libre se piden para la lista de espera
+        context["waiting_books"] = Book.objects.filter(available_copies=0, total_copies__gt=0).annotate(
+            waiting=Count("loanrequest", filter=Q(loanrequest__status="pending", loanrequest__copy__isnull=True))
+        )
         return context
 
 
@@ -27,16 +39,21 @@ class SubmitLoanRequestView(LoginRequiredMixin, CreateView):
         book_id = request.POST.get("book_id")
         book = get_object_or_404(Book, id=book_id)
 
-        if not book.available:
-            messages.error(request, "Este libro no está disponible para préstamo.")
-            return redirect("loans")
+        # Sin ejemplares disponibles la solicitud queda en la lista de espera del libro
+        loan_request, created = HoldService.place(request.user, book)
+        if not created:
+            messages.info(request, f'Ya tenés una solicitud pendiente de "{book.title}".')
+            return redirect("user_loans")
 
-        LoanRequest.objects.create(
-            user=request.user,
-            book=book,
-            status="pending"
-        )
-        messages.success(request, f'Solicitud de préstamo para "{book.title}" enviada correctamente.')
+        events.publish([events.LIBRARIANS], 'loan_request', book=book.title, user=request.user.get_full_name())
+        if book.is_available:
+            messages.success(request, f'Solicitud de préstamo para "{book.title}" enviada correctamente.')
+        else:
+            messages.info(
+                request,
+                f'"{book.title}" no tiene ejemplares disponibles: quedaste en el puesto '
+                f'{HoldService.position(loan_request)} de la lista de espera.',
+            )
         return redirect("user_loans")
     
 class LoansManagerView(LoginRequiredMixin, UserPassesTestMixin, ListView):
@@ -62,14 +79,13 @@ class LoansManagerView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         """
         return LoanRequest.objects.filter(
             status='pending'
-        ).select_related('user', 'book').order_by('request_date')
+        ).select_related('user', 'book', 'copy').order_by('request_date')
     
     def get_context_data(self, **kwargs):
         """
         Agrega información adicional al contexto del template
         """
         context = super().get_context_data(**kwargs)
-        context['active_loans'] = Loan.objects.filter(status='active').select_related('user', 'book')
         
         # Agregar préstamos activos para referencia
         context['active_loans'] = Loan.objects.filter(
@@ -77,17 +93,15 @@ class LoansManagerView(LoginRequiredMixin, UserPassesTestMixin, ListView):
         ).select_related('user', 'book').order_by('-due_date')[:10]
         
         # Agregar préstamos vencidos
-        context['overdue_loans'] = Loan.objects.filter(
-            status='active',
-            due_date__lt=timezone.now().date()
-        ).select_related('user', 'book')
+        context['overdue_loans'] = Loan.objects.overdue().select_related('user', 'book')
         
-        # Estadísticas rápidas
+        # Estadísticas rápidas. Las dos listas se muestran completas, así que
+        # len() las evalúa una sola vez y el template reutiliza el resultado
         context['stats'] = {
-            'pending_requests': self.get_queryset().count(),
+            'pending_requests': len(context['loan_requests']),
             'active_loans': Loan.objects.filter(status='active').count(),
-            'overdue_loans': context['overdue_loans'].count(),
-            'total_books': Book.objects.filter(available=True).count(),
+            'overdue_loans': len(context['overdue_loans']),
+            'total_books': Book.objects.total_available(),
         }
         
         return context
@@ -101,44 +115,55 @@ class ApproveLoanRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
         return self.request.user.role in ['librarian', 'admin']
     
     def post(self, request, loan_request_id):
-        loan_request = get_object_or_404(LoanRequest, id=loan_request_id, status='pending')
-        
-        # Verificar que el libro todavía esté disponible
-        if not loan_request.book.available:
-            messages.error(request, f'El libro "{loan_request.book.title}" ya no está disponible.')
-            return redirect('loans_manager')
-        
-        # Verificar que el usuario no tenga demasiados préstamos activos
-        user_active_loans = Loan.objects.filter(user=loan_request.user, status='active').count()
-        max_loans = loan_request.user.get_loan_limit()
-        
-        if user_active_loans >= max_loans:
-            messages.warning(
-                request, 
-                f'El usuario {loan_request.user.get_full_name()} ya tiene {user_active_loans} préstamos activos (límite: {max_loans}).'
-            )
-            return redirect('loans_manager')
+        loan_request = get_object_or_404(
+            LoanRequest.objects.select_related('user', 'book', 'copy'),
+            id=loan_request_id,
+            status='pending'
+        )
         
         try:
-            # Crear el préstamo
-            loan = Loan.objects.create(
-                user=loan_request.user,
-                book=loan_request.book,
-                loan_date=timezone.now().date(),
-                due_date=timezone.now().date() + timedelta(days=15),  # 15 días por defecto
-                status='active'
+            with transaction.atomic():
+                # El ejemplar que la lista de espera le apartó, o uno disponible;
+                # si no queda ninguno, el libro ya no está disponible
+                if loan_request.copy_id:
+                    reserved = BookStock.objects.filter(pk=loan_request.copy_id, status='reserved')
+                    copy = loan_request.copy if reserved.set_status('borrowed') else None
+                else:
+                    copy = BookStock.objects.lend_one(loan_request.book)
+                if copy is None:
+                    messages.error(request, f'El libro "{loan_request.book.title}" ya no está disponible.')
+                    return redirect('manage_loans')
+
+                # Crear el préstamo; el límite se controla contra el contador del usuario
+                loan = LoanService.open_loan(loan_request.user, loan_request.book, copy=copy)
+                if loan is None:
+                    # Sin cupo: el ejemplar vuelve a estar disponible
+                    transaction.set_rollback(True)
+                    messages.warning(
+                        request, 
+                        f'El usuario {loan_request.user.get_full_name()} ya tiene '
+                        f'{loan_request.user.active_loans_count} préstamos activos '
+                        f'(límite: {loan_request.user.get_loan_limit()}).'
+                    )
+                    return redirect('manage_loans')
+                
+                # Actualizar la solicitud
+                loan_request.status = 'approved'
+                loan_request.approved_by = request.user
+                loan_request.approved_date = timezone.now()
+                loan_request.save()
+
+                NotificationService.notify(
+                    loan_request.user,
+                    f'Tu solicitud de "{loan_request.book.title}" fue aprobada. '
+                    f'Devolvelo antes del {loan.due_date:%d/%m/%Y}.',
+                )
+            metrics.LOAN_REQUESTS.inc(status='approved')
+            events.publish(
+                [events.LIBRARIANS, events.user_channel(loan_request.user_id)],
+                'loan_approved', book=loan_request.book.title,
             )
             
-            # Actualizar la solicitud
-            loan_request.status = 'approved'
-            loan_request.approved_by = request.user
-            loan_request.approved_date = timezone.now()
-            loan_request.save()
-            
-            # Marcar el libro como no disponible
-            loan_request.book.available = False
-            loan_request.book.save()
-            
             messages.success(
                 request, 
                 f'Préstamo aprobado para {loan_request.user.get_full_name()} - "{loan_request.book.title}"'
@@ -149,35 +174,6 @@ class ApproveLoanRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
         
         return redirect('manage_loans')
     
-class ReturnBookView(LoginRequiredMixin, UserPassesTestMixin, View):
-    
-    def test_func(self):
-        return self.request.user.role in ['librarian', 'admin']
-    
-    def post(self, request, loan_id):
-        loan = get_object_or_404(Loan, id=loan_id, status='active')
-        
-        try:
-            # Actualizar el préstamo
-            loan.status = 'returned'
-            loan.return_date = timezone.now().date()
-            loan.save()
-            
-            # Marcar el libro como disponible
-            loan.book.available = True
-            loan.book.save()
-            
-            messages.success(
-                request, 
-                f'Libro "{loan.book.title}" devuelto por {loan.user.get_full_name()}'
-            )
-            
-        except Exception as e:
-            messages.error(request, f'Error al registrar la devolución: {str(e)}')
-        
-        return redirect('manage_loans')
-
-
 class RejectLoanRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
     """
     Vista para rechazar una solicitud de préstamo
@@ -186,13 +182,30 @@ class RejectLoanRequestView(LoginRequiredMixin, UserPassesTestMixin, View):
         return self.request.user.role in ['librarian', 'admin']
     
     def post(self, request, loan_request_id):
-        loan_request = get_object_or_404(LoanRequest, id=loan_request_id, status='pending')
+        loan_request = get_object_or_404(
+            LoanRequest.objects.select_related('user', 'book'),
+            id=loan_request_id,
+            status='pending'
+        )
         
         try:
-            loan_request.status = 'rejected'
-            loan_request.approved_by = request.user
-            loan_request.approved_date = timezone.now()
-            loan_request.save()
+            with transaction.atomic():
+                loan_request.status = 'rejected'
+                loan_request.approved_by = request.user
+                loan_request.approved_date = timezone.now()
+                loan_request.save()
+                # El ejemplar que tenía apartado pasa al siguiente de la lista de espera
+                if loan_request.copy_id:
+                    HoldService.shelve([(loan_request.copy_id, loan_request.book_id)])
+            NotificationService.notify(
+                loan_request.user,
+                f'Tu solicitud de "{loan_request.book.title}" no pudo ser aprobada.',
+            )
+            metrics.LOAN_REQUESTS.inc(status='rejected')
+            events.publish(
+                [events.LIBRARIANS, events.user_channel(loan_request.user_id)],
+                'loan_rejected', book=loan_request.book.title,
+            )
             
             messages.info(
                 request, 
@@ -212,25 +225,26 @@ class ReturnBookView(LoginRequiredMixin, UserPassesTestMixin, View):
         return self.request.user.role in ['librarian', 'admin']
     
     def post(self, request, loan_id):
-        loan = get_object_or_404(Loan, id=loan_id, status='active')
+        loan = get_object_or_404(
+            Loan.objects.select_related('user', 'book'),
+            id=loan_id,
+            status__in=Loan.OPEN_STATUSES
+        )
         
         try:
-            # Marcar préstamo como devuelto
-            loan.status = 'returned'
-            loan.return_date = timezone.now().date()
-            loan.save()
-            
-            # Marcar libro como disponible
-            loan.book.available = True
-            loan.book.save()
-            
-            # Calcular si hubo mora
-            if loan.return_date > loan.due_date:
-                days_overdue = (loan.return_date - loan.due_date).days
-                # Aplicar penalización por mora
-                loan.user.score = max(0, loan.user.score - (days_overdue * 0.5))
-                loan.user.save()
+            with transaction.atomic():
+                # Marcar préstamo como devuelto y aplicar la mora pendiente
+                days_overdue = LoanService.return_loan(loan)
                 
+                # El ejemplar vuelve al estante o queda apartado para la lista de espera
+                # (los préstamos anteriores a los ejemplares no tienen uno)
+                if loan.copy_id:
+                    HoldService.shelve([(loan.copy_id, loan.book_id)])
+                events.publish(
+                    [events.LIBRARIANS, events.user_channel(loan.user_id)], 'loan_returned', book=loan.book.title,
+                )
+            
+            if days_overdue:
                 messages.warning(
                     request, 
                     f'Libro devuelto con {days_overdue} días de mora. Puntuación del usuario actualizada.'
@@ -241,7 +255,7 @@ class ReturnBookView(LoginRequiredMixin, UserPassesTestMixin, View):
         except Exception as e:
             messages.error(request, f'Error al registrar devolución: {str(e)}')
         
-        return redirect('loans_manager')
+        return redirect('manage_loans')
 
 class UserLoansView(LoginRequiredMixin, ListView):
     template_name = "loans/user_loans.html"
@@ -249,3 +263,109 @@ class UserLoansView(LoginRequiredMixin, ListView):
 
     def get_queryset(self):
         return Loan.objects.filter(user=self.request.user).select_related("book").order_by("-loan_date")
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Solicitudes pendientes con su puesto en la lista de espera, en una consulta
+        context["holds"] = (
+            LoanRequest.objects.filter(user=self.request.user, status='pending')
+            .with_queue_position()
+            .select_related('book', 'copy')
+            .order_by('request_date')
+        )
+        return context
+
+
+class CirculationAPIView(LoginRequiredMixin, UserPassesTestMixin, View):
+    """
+    Base de la API JSON del mostrador: sólo bibliotecarios, responde 403 en
+    vez de redirigir al login y convierte los CirculationError en JSON.
+    """
+    raise_exception = True
+
+    def test_func(self):
+        return self.request.user.role in ['librarian', 'admin']
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except CirculationError as e:
+            return JsonResponse({'error': e.message, 'barcodes': e.barcodes}, status=e.status)
+
+    def payload(self):
+        try:
+            data = json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise CirculationError('El cuerpo no es JSON válido', status=400)
+        barcodes = data.get('barcodes')
+        if not isinstance(barcodes, list) or not all(isinstance(code, str) for code in barcodes):
+            raise CirculationError('"barcodes" tiene que ser una lista de códigos', status=400)
+        return data.get('card'), [code.strip() for code in barcodes]
+
+    @staticmethod
+    def loan_json(loan, days_overdue=None):
+        data = {
+            'id': loan.id,
+            'barcode': loan.copy.physical_id if loan.copy else None,
+            'title': loan.book.title,
+            'due_date': loan.due_date.isoformat(),
+            'status': loan.status,
+        }
+        if days_overdue is not None:
+            data['days_overdue'] = days_overdue
+        return data
+
+    @staticmethod
+    def patron_json(user):
+        return {
+            'id': user.id,
+            'card': user.profile.virtual_card_id,
+            'name': user.get_full_name() or user.username,
+            'score': user.score,
+            'loan_limit': user.get_loan_limit(),
+            'active_loans': user.active_loans_count,
+            'blocked': CirculationService.blocked_reason(user),
+        }
+
+
+class CirculationPatronView(CirculationAPIView):
+    """Escaneo del carnet: el socio y sus préstamos en curso"""
+
+    def get(self, request, card_id):
+        patron = CirculationService.patron(card_id)
+        loans = Loan.objects.filter(user=patron, status__in=Loan.OPEN_STATUSES).select_related('book', 'copy')
+        return JsonResponse({
+            'patron': self.patron_json(patron),
+            'loans': [self.loan_json(loan) for loan in loans.order_by('due_date')],
+        })
+
+
+class CirculationCheckoutView(CirculationAPIView):
+    """Presta los ejemplares escaneados al socio del carnet, todos o ninguno"""
+
+    def post(self, request):
+        card, barcodes = self.payload()
+        if not card:
+            raise CirculationError('Falta escanear el carnet del socio', status=400)
+        patron = CirculationService.patron(card)
+        loans = CirculationService.checkout(patron, barcodes, librarian=request.user)
+        return JsonResponse({
+            'patron': self.patron_json(patron),
+            'loans': [self.loan_json(loan) for loan in loans],
+        }, status=201)
+
+
+class CirculationReturnView(CirculationAPIView):
+    """Devuelve los ejemplares escaneados; con carnet, sólo si son de ese socio"""
+
+    def post(self, request):
+        card, barcodes = self.payload()
+        patron = CirculationService.patron(card) if card else None
+        returned = CirculationService.checkin(barcodes, user=patron)
+        loans = []
+        for loan, days_overdue, hold in returned:
+            data = self.loan_json(loan, days_overdue)
+            # Reservado para la lista de espera: va al estante de reservas
+            data['reserved_for'] = (hold.user.get_full_name() or hold.user.username) if hold else None
+            loans.append(data)
+        return JsonResponse({'loans': loans})
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished
 
 
 class NewsletterConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.newsletter'
+
+    def ready(self):
+        from .tracking import BUFFER
+        # Cualquier request escribe los eventos de seguimiento atrasados, no sólo los del píxel
+        request_finished.connect(lambda **kwargs: BUFFER.maybe_flush(), weak=False, dispatch_uid='newsletter_tracking_flush')
@@ -0,0 +1,203 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+from apps.books.models import Book
+from apps.loans.models import Loan
+from apps.users.models import User, UserProfile
+from .models import NewsletterCampaign, NewsletterSubscriber
+
+DEFAULT_DIGEST_CONFIG = {
+    'NEW_BOOKS_DAYS': 7,  # Sin un resumen anterior, libros agregados en los últimos N días
+    'DUE_SOON_DAYS': 3,  # Préstamos que vencen dentro de N días
+    'POPULAR_DAYS': 90,  # Las recomendaciones salen de los libros más prestados en este período
+    'POPULAR_POOL': 200,  # Libros candidatos a recomendar, para toda la audiencia
+    'ITEMS_PER_SECTION': 5,
+}
+
+
+def get_config():
+    return {**DEFAULT_DIGEST_CONFIG, **settings.NEWSLETTER_CONFIG.get('DIGEST', {})}
+
+
+class DigestService:
+    """
+    Secciones personalizadas de las campañas de tipo resumen: libros nuevos
+    en las categorías favoritas, préstamos por vencer y recomendaciones.
+
+    build() las calcula para toda la audiencia con un puñado de consultas
+    agrupadas (la cantidad no depende de cuántos suscriptores haya) y devuelve
+    sólo ids, que el outbox guarda en cada destinatario. Al enviar, resolve()
+    carga los libros de todo un lote en una consulta.
+    """
+
+    @staticmethod
+    def audience():
+        """Socios que reciben el resumen: con suscripción activa vinculada o con el mismo email"""
+        active = NewsletterSubscriber.objects.filter(is_active=True)
+        return User.objects.filter(
+            Q(newsletter_subscription__is_active=True)
+            | Q(email__in=active.filter(user__isnull=True).values('email'))
+        )
+
+    @staticmethod
+    def since(campaign=None):
+        """Desde cuándo un libro es "nuevo": el último resumen enviado o NEW_BOOKS_DAYS"""
+        previous = NewsletterCampaign.objects.filter(kind='digest', is_sent=True)
+        if campaign is not None:
+            previous = previous.exclude(pk=campaign.pk)
+        last = previous.order_by('-sent_at').values_list('sent_at', flat=True).first()
+        return last or timezone.now() - timedelta(days=get_config()['NEW_BOOKS_DAYS'])
+
+    @staticmethod
+    def build(campaign=None, today=None):
+        """
+        Secciones de cada suscriptor activo como {email: {'new_books': [id, ...],
+        'due_soon': [[id, 'dd/mm/aaaa'], ...], 'recommendations': [id, ...]}}.
+        """
+        config = get_config()
+        limit = config['ITEMS_PER_SECTION']
+        today = today or timezone.now().date()
+        audience = DigestService.audience()
+
+        # Suscriptor -> socio: por la relación o, si no la tiene, por el email
+        subscribers = dict(
+            NewsletterSubscriber.objects.filter(is_active=True).values_list('email', 'user_id')
+        )
+        by_email = dict(
+            User.objects.filter(
+                email__in=NewsletterSubscriber.objects.filter(is_active=True, user__isnull=True).values('email')
+            ).values_list('email', 'id')
+        )
+
+        favorites = defaultdict(set)
+        for user_id, category_id in (
+            UserProfile.favorite_categories.through.objects
+            .filter(userprofile__user__in=audience)
+            .values_list('userprofile__user_id', 'category_id')
+            .iterator()
+        ):
+            favorites[user_id].add(category_id)
+
+        # Libros nuevos por categoría, del más reciente al más viejo
+        new_by_category = defaultdict(list)
+        newest = {}
+        for category_id, book_id in (
+            Book.categories.through.objects
+            .filter(book__created_at__gte=DigestService.since(campaign))
+            .order_by('-book__created_at', '-book_id')
+            .values_list('category_id', 'book_id')
+        ):
+            new_by_category[category_id].append(book_id)
+            newest.setdefault(book_id, len(newest))
+
+        due_soon = defaultdict(list)
+        for user_id, book_id, due_date in (
+            Loan.objects.filter(
+                user__in=audience,
+                status='active',
+                due_date__gte=today,
+                due_date__lte=today + timedelta(days=config['DUE_SOON_DAYS']),
+            )
+            .order_by('due_date', 'id')
+            .values_list('user_id', 'book_id', 'due_date')
+            .iterator()
+        ):
+            due_soon[user_id].append([book_id, f'{due_date:%d/%m/%Y}'])
+
+        # Candidatos a recomendar: los más prestados del período, con algún ejemplar disponible
+        pool = list(
+            Loan.objects.filter(
+                loan_date__gte=today - timedelta(days=config['POPULAR_DAYS']), book__available_copies__gt=0
+            )
+            .values('book_id')
+            .annotate(loans=Count('id'))
+            .order_by('-loans', 'book_id')
+            .values_list('book_id', flat=True)[:config['POPULAR_POOL']]
+        )
+        pool_categories = defaultdict(set)
+        for book_id, category_id in Book.categories.through.objects.filter(book_id__in=pool).values_list(
+            'book_id', 'category_id'
+        ):
+            pool_categories[book_id].add(category_id)
+        already_read = defaultdict(set)
+        for user_id, book_id in (
+            Loan.objects.filter(user__in=audience, book_id__in=pool)
+            .values_list('user_id', 'book_id')
+            .distinct()
+            .iterator()
+        ):
+            already_read[user_id].add(book_id)
+
+        # Candidatos por combinación de categorías favoritas: muchos socios comparten la misma
+        candidates = {}
+
+        def candidates_for(categories):
+            if categories not in candidates:
+                # Sin categorías favoritas (o sin socio) se recomiendan los más prestados
+                candidates[categories] = [
+                    book_id for book_id in pool
+                    if not categories or categories & pool_categories.get(book_id, set())
+                ]
+            return candidates[categories]
+
+        digests = {}
+        for email, user_id in subscribers.items():
+            user_id = user_id or by_email.get(email)
+            categories = frozenset(favorites.get(user_id, ()))
+            read = already_read.get(user_id, set())
+
+            new_books = []
+            for category_id in categories:
+                new_books.extend(new_by_category.get(category_id, ()))
+            new_books = sorted(set(new_books), key=newest.__getitem__)[:limit]
+
+            recommendations = []
+            for book_id in candidates_for(categories):
+                if book_id in read or book_id in new_books:
+                    continue
+                recommendations.append(book_id)
+                if len(recommendations) == limit:
+                    break
+
+            digests[email] = {
+                'new_books': new_books,
+                'due_soon': due_soon.get(user_id, [])[:limit],
+                'recommendations': recommendations,
+            }
+        return digests
+
+    @staticmethod
+    def resolve(sections_list):
+        """
+        Convierte las secciones guardadas (ids) en el contexto de la plantilla,
+        para todo un lote de destinatarios con una sola consulta de libros.
+        """
+        ids = set()
+        for sections in sections_list:
+            ids.update(sections.get('new_books', ()))
+            ids.update(sections.get('recommendations', ()))
+            ids.update(book_id for book_id, _ in sections.get('due_soon', ()))
+        books = {
+            pk: {
+                'title': title,
+                'authors': ', '.join(authors) if isinstance(authors, list) else (authors or ''),
+                'url': f"{settings.SITE_URL}/books/{pk}/",
+            }
+            for pk, title, authors in Book.objects.filter(pk__in=ids).values_list('id', 'title', 'authors')
+        } if ids else {}
+
+        contexts = []
+        for sections in sections_list:
+            if not sections:
+                contexts.append({})
+                continue
+            contexts.append({
+                'new_books': [books[pk] for pk in sections.get('new_books', ()) if pk in books],
+                'due_soon': [
+                    {**books[pk], 'due_date': due} for pk, due in sections.get('due_soon', ()) if pk in books
+                ],
+                'recommendations': [books[pk] for pk in sections.get('recommendations', ()) if pk in books],
+            })
+        return contexts
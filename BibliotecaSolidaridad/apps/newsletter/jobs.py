@@ -0,0 +1,28 @@
+from apps.jobs.services import heartbeat, job
+from .models import NewsletterCampaign, NewsletterSubscriber
+from .outbox import NewsletterOutbox
+from .services import NewsletterService
+
+
+@job('newsletter.welcome')
+def send_welcome_email(subscriber_id):
+    """Email de bienvenida, encolado por la vista de suscripción"""
+    subscriber = NewsletterSubscriber.objects.filter(pk=subscriber_id, is_active=True).first()
+    if subscriber is None:
+        # Se dio de baja (o se borró) antes de que corriera la tarea
+        return
+    NewsletterService.send_welcome_email(subscriber)
+
+
+@job('newsletter.send_campaign')
+def send_campaign(campaign_id):
+    """
+    Envía (o retoma) una campaña programada, encolada por el scheduler.
+    Si el envío se corta, el reintento de la tarea lo retoma desde el outbox.
+    Cada lote renueva el claim, así una campaña que tarda más que
+    CLAIM_TIMEOUT_SECONDS no la retoma otro worker mientras sigue enviándose.
+    """
+    campaign = NewsletterCampaign.objects.filter(pk=campaign_id, is_sent=False).first()
+    if campaign is None:
+        return
+    NewsletterOutbox.run(campaign, on_batch=heartbeat())
@@ -0,0 +1,227 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from django.conf import settings
+from django.template import Context
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from apps.newsletter import tracking
+from apps.newsletter.digest import DigestService
+from apps.newsletter.models import NewsletterCampaign, NewsletterDelivery
+from apps.newsletter.ratelimit import TokenBucket
+from apps.newsletter.services import CompiledNewsletter, NewsletterService
+from apps.newsletter.smtp_sink import SMTPSink
+from apps.newsletter.views import track_open
+
+HTML = (
+    '<html><body><h1>Novedades de {{ site_name }}</h1><p>Hola {{ recipient_email }}</p>'
+    + ''.join(
+        f'<h2>Libro {i}</h2>{{% if recipient_email %}}<p>{{{{ site_name|upper }}}} recomienda '
+        f'este título.</p>{{% endif %}}<p>Reseña de ejemplo {i}.</p>'
+        for i in range(20)
+    )
+    + '<a href="{{ unsubscribe_url }}">Desuscribirse</a> &copy; {{ current_year }}</body></html>'
+)
+TEXT = 'Hola {{ recipient_email }}. Para desuscribirte: {{ unsubscribe_url }}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el envío de un newsletter contra un servidor SMTP local que simula '
+        'el costo de abrir cada sesión, para distintos tamaños de lote'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=2000)
+        parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 50, 200],
+                            help='Tamaños de lote a comparar (1 = una conexión por email)')
+        parser.add_argument('--connect-delay', type=float, default=0.05,
+                            help='Segundos que tarda el servidor en aceptar una sesión (TCP + TLS + EHLO)')
+        parser.add_argument('--message-delay', type=float, default=0.0,
+                            help='Segundos que tarda el servidor en aceptar cada email')
+        parser.add_argument('--render-only', action='store_true',
+                            help='Medir sólo el render por destinatario: parsear cada vez vs compilar una vez')
+        parser.add_argument('--digest', action='store_true',
+                            help='Medir la personalización de un resumen para los suscriptores de la base')
+        parser.add_argument('--tracking', type=int, metavar='HITS',
+                            help='Medir esta cantidad de aperturas: escritura por apertura vs buffer agrupado')
+        parser.add_argument('--workers', type=int, nargs='+',
+                            help='Comparar envío en paralelo con esta cantidad de workers (usa el primer tamaño de lote)')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Límite de emails por segundo compartido entre los workers')
+        parser.add_argument('--projection', type=int, default=50000,
+                            help='Cantidad de suscriptores para proyectar la duración de una campaña')
+
+    def handle(self, *args, **options):
+        recipients = [f'lector{i}@example.com' for i in range(options['recipients'])]
+        if options['render_only']:
+            return self.benchmark_rendering(recipients)
+        if options['digest']:
+            return self.benchmark_digest(options)
+        if options['tracking']:
+            return self.benchmark_tracking(recipients, options['tracking'])
+        if options['workers']:
+            return self.benchmark_workers(recipients, options)
+        self.stdout.write(
+            f"{len(recipients)} destinatarios, apertura de sesión {options['connect_delay'] * 1000:.0f} ms"
+        )
+        for batch_size in options['batch_sizes']:
+            with SMTPSink(connect_delay=options['connect_delay'], message_delay=options['message_delay']) as sink:
+                connection = get_connection(
+                    'django.core.mail.backends.smtp.EmailBackend',
+                    host='127.0.0.1', port=sink.port, username='', password='',
+                    use_tls=False, use_ssl=False, timeout=10,
+                )
+                config = {**settings.NEWSLETTER_CONFIG, 'BATCH_SIZE': batch_size}
+                started = time.perf_counter()
+                with override_settings(NEWSLETTER_CONFIG=config):
+                    sent, failed = NewsletterService.send_newsletter(
+                        'Benchmark', HTML, TEXT, recipients, connection=connection,
+                    )
+                elapsed = time.perf_counter() - started
+
+            rate = sent / elapsed if elapsed else 0.0
+            projected = options['projection'] / rate / 60 if rate else float('inf')
+            self.stdout.write(
+                f"lote {batch_size:>5}: {elapsed:7.2f} s  {rate:8.1f} emails/s  "
+                f"sesiones SMTP {sink.connections:>5}  enviados {sent}  fallidos {failed}  "
+                f"-> {options['projection']} suscriptores en {projected:.1f} min"
+            )
+
+    def benchmark_workers(self, recipients, options):
+        batch_size = options['batch_sizes'][0]
+        batches = [recipients[i:i + batch_size] for i in range(0, len(recipients), batch_size)]
+        self.stdout.write(
+            f"{len(recipients)} destinatarios, lotes de {batch_size}, "
+            f"{options['message_delay'] * 1000:.0f} ms por email, límite {options['rate'] or 'sin límite'}"
+        )
+        for workers in options['workers']:
+            throttle = TokenBucket(options['rate']) if options['rate'] else None
+            with SMTPSink(connect_delay=options['connect_delay'], message_delay=options['message_delay']) as sink:
+                def send(batch):
+                    newsletter = CompiledNewsletter('Benchmark', HTML, TEXT)
+                    with self.connection(sink) as connection:
+                        messages = [newsletter.message(email, '/baja/', connection) for email in batch]
+                        errors = NewsletterService.deliver_batch(connection, messages, throttle)
+                    return sum(1 for error in errors if error is None)
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    sent = sum(pool.map(send, batches))
+                elapsed = time.perf_counter() - started
+
+            rate = sent / elapsed if elapsed else 0.0
+            projected = options['projection'] / rate / 60 if rate else float('inf')
+            self.stdout.write(
+                f"workers {workers:>3}: {elapsed:7.2f} s  {rate:8.1f} emails/s  enviados {sent}  "
+                f"-> {options['projection']} suscriptores en {projected:.1f} min"
+            )
+
+    @staticmethod
+    def connection(sink):
+        return get_connection(
+            'django.core.mail.backends.smtp.EmailBackend',
+            host='127.0.0.1', port=sink.port, username='', password='',
+            use_tls=False, use_ssl=False, timeout=10,
+        )
+
+    def benchmark_digest(self, options):
+        started = time.perf_counter()
+        with CaptureQueriesContext(connection) as queries:
+            digests = DigestService.build()
+        built = time.perf_counter() - started
+
+        batch_size = options['batch_sizes'][0]
+        sections = list(digests.values())
+        started = time.perf_counter()
+        for i in range(0, len(sections), batch_size):
+            DigestService.resolve(sections[i:i + batch_size])
+        resolved = time.perf_counter() - started
+
+        personalized = sum(1 for digest in sections if any(digest.values()))
+        self.stdout.write(
+            f'{len(digests)} suscriptores ({personalized} con alguna sección): '
+            f'secciones en {built:.2f} s con {len(queries)} consultas'
+        )
+        self.stdout.write(
+            f'libros de cada lote de {batch_size}: {resolved:.2f} s en total '
+            f'({resolved / max(1, len(sections)) * 1e6:.0f} µs/destinatario)'
+        )
+
+    def benchmark_tracking(self, recipients, hits):
+        # Todo corre dentro de una transacción que se descarta al final
+        with transaction.atomic():
+            campaign = NewsletterCampaign.objects.create(
+                title='Benchmark', subject='Benchmark', html_content=HTML, text_content=TEXT,
+            )
+            deliveries = NewsletterDelivery.objects.bulk_create(
+                NewsletterDelivery(campaign=campaign, email=email, token=email, status='sent')
+                for email in recipients
+            )
+            factory = RequestFactory()
+            requests = []
+            for _ in range(hits):
+                delivery = random.choice(deliveries)
+                sig = tracking.signature(campaign.pk, delivery.pk)
+                requests.append((factory.get(f'/newsletter/t/o/{campaign.pk}/{delivery.pk}/{sig}.gif'), delivery.pk))
+
+            self.stdout.write(f'{hits} aperturas sobre {len(deliveries)} destinatarios')
+            # El registro de consultas de Django se corta en 9000: se cuentan con un wrapper
+            queries = Counter()
+
+            def count(execute, sql, params, many, context):
+                queries['total'] += 1
+                return execute(sql, params, many, context)
+
+            # Sin buffer: cada apertura escribe sus contadores en el momento
+            started = time.perf_counter()
+            with connection.execute_wrapper(count):
+                for request, delivery_id in requests:
+                    tracking.TrackingBuffer._write(
+                        Counter({campaign.pk: 1}), Counter(), {campaign.pk: {delivery_id}}, {},
+                    )
+            self.report('por apertura', hits, time.perf_counter() - started, queries.pop('total', 0))
+
+            buffer = tracking.TrackingBuffer()
+            started = time.perf_counter()
+            with mock.patch.object(tracking, 'BUFFER', buffer), connection.execute_wrapper(count):
+                for request, delivery_id in requests:
+                    track_open(request, campaign.pk, delivery_id, request.path.rsplit('/', 1)[1][:-4])
+                buffer.flush()
+            self.report('con buffer', hits, time.perf_counter() - started, queries.pop('total', 0))
+            transaction.set_rollback(True)
+
+    def report(self, label, hits, elapsed, queries):
+        self.stdout.write(
+            f'{label:>13}: {elapsed:6.2f} s  {hits / elapsed if elapsed else 0.0:9.0f} aperturas/s  '
+            f'{queries:>6} consultas'
+        )
+
+    def benchmark_rendering(self, recipients):
+        base = {'current_year': 2026, 'site_name': 'Biblioteca de la Solidaridad'}
+
+        started = time.perf_counter()
+        for recipient in recipients:
+            context = {**base, 'recipient_email': recipient, 'unsubscribe_url': '/baja/'}
+            NewsletterService.render_template(HTML, context)
+            NewsletterService.render_template(TEXT, context)
+        parsed = (time.perf_counter() - started) / len(recipients)
+
+        started = time.perf_counter()
+        html = NewsletterService.compile_template(HTML)
+        text = NewsletterService.compile_template(TEXT)
+        context = Context(base)
+        for recipient in recipients:
+            with context.push(recipient_email=recipient, unsubscribe_url='/baja/'):
+                html.render(context)
+                text.render(context)
+        compiled = (time.perf_counter() - started) / len(recipients)
+
+        self.stdout.write(f'parseando por destinatario: {parsed * 1e6:8.1f} µs/destinatario')
+        self.stdout.write(f'compilando una vez:         {compiled * 1e6:8.1f} µs/destinatario')
+        self.stdout.write(f'mejora: {parsed / compiled:.1f}x')
@@ -2,8 +2,9 @@ from django.core.management.base import BaseCommand
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils import timezone
-from newsletter.models import NewsletterSubscriber, NewsletterCampaign
-from newsletter.services import NewsletterService
+from apps.newsletter.models import NewsletterCampaign
+from apps.newsletter.outbox import NewsletterOutbox
+from apps.newsletter.services import NewsletterService
 
 class Command(BaseCommand):
     help = 'Envía newsletters a todos los suscriptores activos'
@@ -40,27 +41,32 @@ class Command(BaseCommand):
         self.stdout.write(f"Enviando campaña: {campaign.title}")
         
         if test_mode:
-            recipients = ['tu.email@gmail.com']  # Email de prueba
-        else:
-            subscribers = NewsletterSubscriber.objects.filter(is_active=True)
-            recipients = [sub.email for sub in subscribers]
-        
-        success_count, failed_count = NewsletterService.send_newsletter(
-            subject=campaign.subject,
-            html_content=campaign.html_content,
-            text_content=campaign.text_content,
-            recipient_list=recipients
-        )
+            success_count, failed_count = NewsletterService.send_newsletter(
+                subject=campaign.subject,
+                html_content=campaign.html_content,
+                text_content=campaign.text_content,
+                recipient_list=['tu.email@gmail.com']  # Email de prueba
+            )
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'Campaña enviada: {success_count} exitosos, {failed_count} fallidos'
+                )
+            )
+            return
         
-        if not test_mode:
-            campaign.is_sent = True
-            campaign.sent_at = timezone.now()
-            campaign.total_recipients = len(recipients)
-            campaign.total_sent = success_count
-            campaign.save()
+        # Envío por outbox: si se corta, volver a correr el comando lo retoma
+        if campaign.started_at:
+            self.stdout.write(
+                f"Retomando: {campaign.total_sent + campaign.total_failed} de "
+                f"{campaign.total_recipients} destinatarios ya resueltos"
+            )
+        totals = NewsletterOutbox.run(campaign)
+        campaign.refresh_from_db()
         
         self.stdout.write(
             self.style.SUCCESS(
-                f'Campaña enviada: {success_count} exitosos, {failed_count} fallidos'
+                f"Campaña {'enviada' if totals['finished'] else 'en curso'}: "
+                f"{totals['sent']} exitosos, {totals['failed']} fallidos en esta corrida "
+                f"({campaign.total_sent} de {campaign.total_recipients} en total)"
             )
-        )
\ No newline at end of file
+        )
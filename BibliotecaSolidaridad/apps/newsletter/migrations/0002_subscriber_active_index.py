@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='newslettersubscriber',
+            index=models.Index(fields=['is_active', 'id'], name='newsletter_active_idx'),
+        ),
+    ]
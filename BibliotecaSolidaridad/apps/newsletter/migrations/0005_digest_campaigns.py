@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0004_campaign_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='kind',
+            field=models.CharField(choices=[('newsletter', 'Newsletter'), ('digest', 'Resumen personalizado')], default='newsletter', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='newsletterdelivery',
+            name='context',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
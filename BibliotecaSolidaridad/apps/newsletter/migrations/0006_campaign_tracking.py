@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 15:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0005_digest_campaigns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='total_clicks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='total_opens',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='unique_clicks',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newslettercampaign',
+            name='unique_opens',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='newsletterdelivery',
+            name='clicked_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='newsletterdelivery',
+            name='opened_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -17,6 +17,9 @@ class NewsletterSubscriber(models.Model):
     
     class Meta:
         db_table = 'newsletter_subscribers'
+        indexes = [
+            models.Index(fields=['is_active', 'id'], name='newsletter_active_idx'),
+        ]
     
     def __str__(self):
         return self.email
@@ -28,7 +31,14 @@ class NewsletterSubscriber(models.Model):
         super().save(*args, **kwargs)
 
 class NewsletterCampaign(models.Model):
+    KIND_CHOICES = (
+        ('newsletter', 'Newsletter'),
+        # html_content recibe new_books, due_soon y recommendations de cada suscriptor
+        # (ver {% include "newsletter/resumen.html" %})
+        ('digest', 'Resumen personalizado'),
+    )
     title = models.CharField(max_length=200)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='newsletter')
     subject = models.CharField(max_length=200)
     html_content = models.TextField()
     text_content = models.TextField(blank=True)
@@ -38,6 +48,16 @@ class NewsletterCampaign(models.Model):
     is_sent = models.BooleanField(default=False)
     total_recipients = models.IntegerField(default=0)
     total_sent = models.IntegerField(default=0)
+    # Progreso del envío por outbox: cuándo quedó cargada la lista y cuántos fallaron
+    started_at = models.DateTimeField(null=True, blank=True)
+    total_failed = models.IntegerField(default=0)
+    # Lo compara el scheduler para detectar campañas nuevas o reprogramadas
+    updated_at = models.DateTimeField(auto_now=True)
+    # Seguimiento (ver tracking.py): totales de eventos y destinatarios distintos
+    total_opens = models.IntegerField(default=0)
+    total_clicks = models.IntegerField(default=0)
+    unique_opens = models.IntegerField(default=0)
+    unique_clicks = models.IntegerField(default=0)
     
     class Meta:
         db_table = 'newsletter_campaigns'
@@ -45,6 +65,54 @@ class NewsletterCampaign(models.Model):
     def __str__(self):
         return self.title
 
+    @property
+    def open_rate(self):
+        return self.unique_opens / self.total_sent * 100 if self.total_sent else 0
+
+    @property
+    def click_rate(self):
+        return self.unique_clicks / self.total_sent * 100 if self.total_sent else 0
+
+
+class NewsletterDelivery(models.Model):
+    """
+    Un destinatario de una campaña (outbox). Se cargan todos al iniciar el envío
+    y cada fila registra su propio estado, así un envío interrumpido se retoma
+    sin repetir ni saltear destinatarios.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pendiente'),
+        ('sending', 'Enviando'),
+        ('sent', 'Enviado'),
+        ('failed', 'Fallido'),
+    )
+    campaign = models.ForeignKey(NewsletterCampaign, on_delete=models.CASCADE, related_name='deliveries')
+    email = models.EmailField()
+    token = models.CharField(max_length=100)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # Identifica el lote que tomó la fila, para que dos workers no se la repartan
+    claim_id = models.CharField(max_length=32, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # Secciones del resumen personalizado (ids de libros), calculadas al cargar la campaña
+    context = models.JSONField(default=dict, blank=True)
+    opened_at = models.DateTimeField(null=True, blank=True)
+    clicked_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'newsletter_deliveries'
+        constraints = [
+            models.UniqueConstraint(fields=['campaign', 'email'], name='newsletter_delivery_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['campaign', 'status', 'id'], name='newsletter_delivery_claim_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.email} ({self.get_status_display()})"
+
 class NewsletterTemplate(models.Model):
     name = models.CharField(max_length=100)
     html_content = models.TextField()
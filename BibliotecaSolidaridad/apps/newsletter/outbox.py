@@ -0,0 +1,210 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .digest import DigestService
+from .models import NewsletterCampaign, NewsletterDelivery
+from .ratelimit import TokenBucket
+from .services import CompiledNewsletter, NewsletterService
+
+logger = logging.getLogger(__name__)
+
+# Intentos por destinatario antes de darlo por fallido
+MAX_ATTEMPTS = 3
+# Un lote tomado que no se resolvió en este tiempo es de un worker caído y se vuelve a tomar
+CLAIM_TIMEOUT = timedelta(minutes=10)
+# Filas por INSERT al cargar los destinatarios
+ENQUEUE_CHUNK_SIZE = 1000
+
+
+class NewsletterOutbox:
+    """
+    Envío de campañas a través de la tabla de destinatarios (NewsletterDelivery).
+    Cada lote se toma, se envía y se registra en su propia transacción, así
+    un envío interrumpido se retoma volviendo a correr el comando.
+    """
+
+    @staticmethod
+    def enqueue(campaign):
+        """
+        Carga los suscriptores activos como destinatarios de la campaña, en INSERTs
+        por lotes. Si se corta a mitad de camino, volver a llamarla completa la
+        carga sin duplicar filas. Devuelve la cantidad total de destinatarios.
+        """
+        if campaign.started_at:
+            return campaign.total_recipients
+
+        # Los resúmenes se personalizan acá, para toda la audiencia de una vez
+        digests = DigestService.build(campaign) if campaign.kind == 'digest' else {}
+        chunk = []
+        for email, token in NewsletterService.iter_active_subscribers():
+            chunk.append(NewsletterDelivery(
+                campaign=campaign, email=email, token=token, context=digests.get(email, {}),
+            ))
+            if len(chunk) >= ENQUEUE_CHUNK_SIZE:
+                NewsletterDelivery.objects.bulk_create(chunk, ignore_conflicts=True)
+                chunk = []
+        if chunk:
+            NewsletterDelivery.objects.bulk_create(chunk, ignore_conflicts=True)
+
+        campaign.started_at = timezone.now()
+        campaign.total_recipients = campaign.deliveries.count()
+        NewsletterCampaign.objects.filter(pk=campaign.pk).update(
+            started_at=campaign.started_at,
+            total_recipients=campaign.total_recipients,
+        )
+        logger.info(f"Campaña {campaign.pk}: {campaign.total_recipients} destinatarios cargados")
+        return campaign.total_recipients
+
+    @staticmethod
+    def claim(campaign, limit):
+        """
+        Toma hasta `limit` destinatarios pendientes (o abandonados por un worker
+        caído) y los marca como en envío, en un único UPDATE ... WHERE id IN
+        (SELECT ... LIMIT). Como el UPDATE vuelve a verificar el estado, dos
+        workers concurrentes nunca se reparten la misma fila.
+        """
+        now = timezone.now()
+        claimable = Q(status='pending') | Q(status='sending', claimed_at__lt=now - CLAIM_TIMEOUT)
+        claim_id = uuid.uuid4().hex
+        candidates = (
+            NewsletterDelivery.objects.filter(claimable, campaign=campaign)
+            .order_by('id')
+            .values('id')[:limit]
+        )
+        claimed = NewsletterDelivery.objects.filter(claimable, id__in=candidates).update(
+            status='sending',
+            claim_id=claim_id,
+            claimed_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if not claimed:
+            return []
+        return list(NewsletterDelivery.objects.filter(claim_id=claim_id, status='sending').order_by('id'))
+
+    @staticmethod
+    def send_claimed(campaign, deliveries, newsletter, connection, throttle=None):
+        """Envía un lote ya tomado y registra el resultado de cada fila"""
+        messages = []
+        prepared = []
+        errors = {}
+        if campaign.kind == 'digest':
+            contexts = DigestService.resolve([delivery.context for delivery in deliveries])
+        else:
+            contexts = [None] * len(deliveries)
+        for delivery, extra_context in zip(deliveries, contexts):
+            try:
+                unsubscribe_url = NewsletterService.unsubscribe_url(delivery.token)
+                messages.append(newsletter.message(
+                    delivery.email, unsubscribe_url, connection, extra_context, tracking=(campaign.pk, delivery.pk),
+                ))
+                prepared.append(delivery)
+            except Exception as e:
+                errors[delivery.pk] = f"Error preparando el email: {str(e)}"
+        if messages:
+            results = NewsletterService.deliver_batch(connection, messages, throttle)
+            for delivery, error in zip(prepared, results):
+                if error:
+                    errors[delivery.pk] = error
+        return NewsletterOutbox.record(campaign, deliveries, errors)
+
+    @staticmethod
+    def record(campaign, deliveries, errors):
+        """
+        Guarda el resultado del lote y suma al progreso de la campaña en la misma
+        transacción. Los fallos vuelven a pendientes hasta agotar MAX_ATTEMPTS.
+        Devuelve (enviados, fallidos definitivos, reintentos).
+        """
+        now = timezone.now()
+        sent_ids = [delivery.pk for delivery in deliveries if delivery.pk not in errors]
+        retried = []
+        failed = []
+        for delivery in deliveries:
+            if delivery.pk in errors:
+                delivery.last_error = errors[delivery.pk][:1000]
+                delivery.status = 'failed' if delivery.attempts >= MAX_ATTEMPTS else 'pending'
+                (failed if delivery.status == 'failed' else retried).append(delivery)
+
+        with transaction.atomic():
+            if sent_ids:
+                NewsletterDelivery.objects.filter(pk__in=sent_ids).update(
+                    status='sent', sent_at=now, last_error=''
+                )
+            if errors:
+                NewsletterDelivery.objects.bulk_update(retried + failed, ['status', 'last_error'])
+            NewsletterCampaign.objects.filter(pk=campaign.pk).update(
+                total_sent=F('total_sent') + len(sent_ids),
+                total_failed=F('total_failed') + len(failed),
+            )
+        return len(sent_ids), len(failed), len(retried)
+
+    @staticmethod
+    def finish(campaign):
+        """Marca la campaña como enviada cuando ya no quedan destinatarios sin resolver"""
+        if campaign.deliveries.filter(status__in=('pending', 'sending')).exists():
+            return False
+        NewsletterCampaign.objects.filter(pk=campaign.pk, is_sent=False).update(
+            is_sent=True, sent_at=timezone.now()
+        )
+        return True
+
+    @staticmethod
+    def run(campaign, batch_size=None, workers=None, rate_limit=None, connection_factory=get_connection,
+            on_batch=None):
+        """
+        Envía (o retoma) una campaña hasta que no queden destinatarios por tomar.
+        Con varios `workers`, cada hilo usa su propia conexión SMTP y todos
+        comparten un TokenBucket de `rate_limit` emails por segundo. `on_batch`
+        se llama después de cada lote (desde el hilo que lo envió); si lanza
+        una excepción, el envío se corta.
+        Devuelve los totales de esta corrida.
+        """
+        config = settings.NEWSLETTER_CONFIG
+        batch_size = batch_size or config.get('BATCH_SIZE', 50)
+        workers = workers or config.get('WORKERS', 1)
+        rate_limit = rate_limit if rate_limit is not None else config.get('RATE_LIMIT')
+        throttle = TokenBucket(rate_limit) if rate_limit else None
+        NewsletterOutbox.enqueue(campaign)
+
+        totals = {'sent': 0, 'failed': 0, 'retried': 0}
+        lock = threading.Lock()
+
+        def worker():
+            newsletter = CompiledNewsletter(campaign.subject, campaign.html_content, campaign.text_content)
+            connection = connection_factory()
+            while True:
+                deliveries = NewsletterOutbox.claim(campaign, batch_size)
+                if not deliveries:
+                    return
+                sent, failed, retried = NewsletterOutbox.send_claimed(
+                    campaign, deliveries, newsletter, connection, throttle
+                )
+                with lock:
+                    totals['sent'] += sent
+                    totals['failed'] += failed
+                    totals['retried'] += retried
+                if on_batch:
+                    on_batch()
+
+        def threaded_worker():
+            try:
+                worker()
+            finally:
+                # Cada hilo abre su propia conexión a la base
+                db_connection.close()
+
+        if workers == 1:
+            worker()
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in [pool.submit(threaded_worker) for _ in range(workers)]:
+                    future.result()
+
+        totals['finished'] = NewsletterOutbox.finish(campaign)
+        return totals
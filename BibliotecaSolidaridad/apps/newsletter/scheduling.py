@@ -0,0 +1,57 @@
+import logging
+from django.db.models import Count, Max
+from apps.jobs.services import JobService
+from .models import NewsletterCampaign
+
+logger = logging.getLogger(__name__)
+
+
+class CampaignSchedule:
+    """
+    Mantiene en un Scheduler las campañas programadas y sin enviar. check()
+    corre seguido y sólo relee las campañas cuando cambia la huella (cantidad
+    y última modificación), que es una única consulta agregada. Al vencer una
+    campaña se encola su envío para los workers de run_jobs.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.fingerprint = None
+        # pk -> scheduled_for agendado
+        self.scheduled = {}
+
+    @staticmethod
+    def pending():
+        return NewsletterCampaign.objects.filter(
+            is_sent=False, started_at__isnull=True, scheduled_for__isnull=False
+        )
+
+    def check(self):
+        fingerprint = self.pending().aggregate(count=Count('id'), last_change=Max('updated_at'))
+        if fingerprint == self.fingerprint:
+            return False
+        self.fingerprint = fingerprint
+        self.reload()
+        return True
+
+    def reload(self):
+        campaigns = dict(self.pending().values_list('pk', 'scheduled_for'))
+        for pk in set(self.scheduled) - set(campaigns):
+            # Se borró, se envió a mano o dejó de estar programada
+            self.scheduler.cancel(self.key(pk))
+            del self.scheduled[pk]
+        for pk, scheduled_for in campaigns.items():
+            if self.scheduled.get(pk) == scheduled_for:
+                continue
+            self.scheduled[pk] = scheduled_for
+            self.scheduler.at(scheduled_for.timestamp(), self.key(pk), lambda pk=pk: self.dispatch(pk))
+            logger.info(f"Campaña {pk} agendada para {scheduled_for:%Y-%m-%d %H:%M}")
+
+    def dispatch(self, pk):
+        # Queda en `scheduled` para que el próximo check no la vuelva a encolar
+        JobService.enqueue('newsletter.send_campaign', campaign_id=pk)
+        logger.info(f"Campaña {pk} encolada para envío")
+
+    @staticmethod
+    def key(pk):
+        return f'campaign:{pk}'
@@ -1,75 +1,291 @@
-from django.core.mail import EmailMultiAlternatives
+import time
+from smtplib import SMTPRecipientsRefused, SMTPServerDisconnected
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template import Context, Template
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils import timezone
+from apps.dashboard import metrics
+from apps.newsletter.models import NewsletterSubscriber
+from apps.newsletter.tracking import add_tracking
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Errores que indican que la sesión SMTP ya no sirve (a diferencia de un destinatario rechazado)
+CONNECTION_ERRORS = (SMTPServerDisconnected, ConnectionError, TimeoutError)
+# Reintentos de un mismo email ante respuestas temporales (4xx) del servidor
+TEMPORARY_RETRIES = 3
+# Suscriptores por consulta al recorrer la lista de envío
+SUBSCRIBER_CHUNK_SIZE = 1000
+
+
+def smtp_code(error):
+    """Código de respuesta SMTP de una excepción de smtplib, si lo tiene"""
+    if isinstance(error, SMTPRecipientsRefused):
+        codes = [code for code, _ in error.recipients.values()]
+        return codes[0] if codes else None
+    return getattr(error, 'smtp_code', None)
+
+
+class CompiledNewsletter:
+    """
+    Un newsletter listo para personalizar: las plantillas se compilan una sola
+    vez (un error de sintaxis corta el envío antes de empezar) y el contexto
+    común se arma una vez. Por destinatario sólo se apila su email y su link de baja.
+    Como el contexto se reutiliza, cada hilo de envío necesita su propia instancia.
+    """
+
+    def __init__(self, subject, html_content, text_content, from_email=None):
+        self.subject = subject
+        self.from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        self.reply_to = [settings.NEWSLETTER_CONFIG.get('REPLY_TO', self.from_email)]
+        self.html_template = NewsletterService.compile_template(html_content)
+        self.text_template = NewsletterService.compile_template(text_content)
+        self.context = Context({
+            'current_year': timezone.now().year,
+            'site_name': 'Biblioteca de la Solidaridad'
+        })
+
+    def message(self, recipient, unsubscribe_url, connection=None, extra_context=None, tracking=None):
+        """`tracking` = (campaña, destinatario) agrega el píxel y los links de seguimiento"""
+        with self.context.push(recipient_email=recipient, unsubscribe_url=unsubscribe_url, **(extra_context or {})):
+            personalized_html = self.html_template.render(self.context)
+            personalized_text = self.text_template.render(self.context)
+        if tracking:
+            personalized_html = add_tracking(personalized_html, *tracking)
+        email = EmailMultiAlternatives(
+            subject=self.subject,
+            body=personalized_text,
+            from_email=self.from_email,
+            to=[recipient],
+            reply_to=self.reply_to,
+            connection=connection,
+        )
+        email.attach_alternative(personalized_html, "text/html")
+        return email
+
+
 class NewsletterService:
     @staticmethod
-    def send_newsletter(subject, html_content, text_content, recipient_list, from_email=None):
+    def send_newsletter(subject, html_content, text_content, recipient_list, from_email=None, connection=None):
         """
-        Envía un newsletter a una lista de destinatarios
+        Envía un newsletter a una lista de destinatarios. Los emails salen en lotes
+        de NEWSLETTER_CONFIG['BATCH_SIZE'], cada lote por una única conexión SMTP.
+        
+        `recipient_list` puede ser cualquier iterable (se recorre una sola vez) de
+        emails o de pares (email, token). Con los pares, como los que devuelve
+        iter_active_subscribers, el link de baja se arma sin consultar la base.
         """
-        if not from_email:
-            from_email = settings.DEFAULT_FROM_EMAIL
+        batch_size = settings.NEWSLETTER_CONFIG.get('BATCH_SIZE', 50)
+        connection = connection or get_connection()
+        newsletter = CompiledNewsletter(subject, html_content, text_content, from_email)
         
         success_count = 0
         failed_count = 0
+        batch = []
         
         for recipient in recipient_list:
+            if isinstance(recipient, tuple):
+                recipient, token = recipient
+            else:
+                token = None
             try:
                 # Personalizar el contenido para cada destinatario
-                context = {
-                    'recipient_email': recipient,
-                    'unsubscribe_url': NewsletterService.get_unsubscribe_url(recipient),
-                    'current_year': timezone.now().year,
-                    'site_name': 'Biblioteca de la Solidaridad'
-                }
-                
-                # Renderizar contenido personalizado
-                personalized_html = NewsletterService.render_template(html_content, context)
-                personalized_text = NewsletterService.render_template(text_content, context)
-                
-                # Crear email
-                email = EmailMultiAlternatives(
-                    subject=subject,
-                    body=personalized_text,
-                    from_email=from_email,
-                    to=[recipient],
-                    reply_to=[settings.NEWSLETTER_CONFIG.get('REPLY_TO', from_email)]
-                )
-                email.attach_alternative(personalized_html, "text/html")
-                
-                # Enviar email
-                email.send()
-                success_count += 1
-                logger.info(f"Newsletter enviado exitosamente a: {recipient}")
+                if token:
+                    unsubscribe_url = NewsletterService.unsubscribe_url(token)
+                else:
+                    unsubscribe_url = NewsletterService.get_unsubscribe_url(recipient)
+                batch.append(newsletter.message(recipient, unsubscribe_url, connection))
                 
             except Exception as e:
                 failed_count += 1
-                logger.error(f"Error enviando newsletter a {recipient}: {str(e)}")
+                metrics.NEWSLETTER_EMAILS.inc(result='failed')
+                logger.error(f"Error preparando newsletter para {recipient}: {str(e)}")
+            
+            if len(batch) >= batch_size:
+                sent, failed = NewsletterService.send_batch(connection, batch)
+                success_count += sent
+                failed_count += failed
+                batch = []
+        
+        if batch:
+            sent, failed = NewsletterService.send_batch(connection, batch)
+            success_count += sent
+            failed_count += failed
         
         return success_count, failed_count
     
+    @staticmethod
+    def send_batch(connection, messages):
+        """
+        Envía un lote de emails por una sola conexión SMTP (ver deliver_batch).
+        Devuelve (enviados, fallidos).
+        """
+        errors = NewsletterService.deliver_batch(connection, messages)
+        failed = sum(1 for error in errors if error)
+        return len(messages) - failed, failed
+    
+    @staticmethod
+    def deliver_batch(connection, messages, throttle=None):
+        """
+        Envía un lote de emails reutilizando una sola conexión SMTP. Si el servidor
+        corta la sesión, reconecta y reintenta una vez el email en curso. Un
+        destinatario rechazado no afecta al resto del lote. `throttle` (un
+        TokenBucket) se consulta antes de cada email para respetar la cuota.
+        Devuelve, en el orden de `messages`, None por cada email enviado o el
+        motivo del fallo.
+        """
+        try:
+            connection.open()
+        except Exception as e:
+            logger.error(f"No se pudo abrir la conexión SMTP: {str(e)}")
+            metrics.NEWSLETTER_EMAILS.inc(len(messages), result='failed')
+            return [f"Sin conexión SMTP: {str(e)}"] * len(messages)
+        
+        errors = []
+        try:
+            for position, email in enumerate(messages):
+                try:
+                    error = NewsletterService._send_one(connection, email, throttle)
+                except CONNECTION_ERRORS as e:
+                    # Tampoco se pudo reconectar: el resto del lote falla sin reintentos
+                    pending = len(messages) - position
+                    errors.extend([f"Conexión SMTP perdida: {str(e)}"] * pending)
+                    metrics.NEWSLETTER_EMAILS.inc(pending, result='failed')
+                    logger.error(f"Conexión SMTP perdida, {pending} emails sin enviar: {str(e)}")
+                    break
+                errors.append(error)
+                metrics.NEWSLETTER_EMAILS.inc(result='failed' if error else 'sent')
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        
+        failed = sum(1 for error in errors if error)
+        logger.info(f"Lote de newsletter: {len(errors) - failed} enviados, {failed} fallidos")
+        return errors
+    
+    @staticmethod
+    def _send_one(connection, email, throttle=None):
+        """
+        Envía un email por la conexión abierta. Ante una respuesta 4xx (límite
+        del proveedor, greylisting) espera con backoff exponencial y reintenta.
+        Devuelve None o el motivo del fallo; los errores de conexión se propagan.
+        """
+        config = settings.NEWSLETTER_CONFIG
+        backoff = config.get('BACKOFF_SECONDS', 2)
+        max_backoff = config.get('MAX_BACKOFF_SECONDS', 60)
+        for retry in range(TEMPORARY_RETRIES + 1):
+            if throttle:
+                throttle.acquire()
+            try:
+                try:
+                    delivered = NewsletterService._deliver(connection, email)
+                except SMTPServerDisconnected:
+                    logger.warning("Conexión SMTP cortada por el servidor, reconectando")
+                    connection.close()
+                    connection.open()
+                    delivered = NewsletterService._deliver(connection, email)
+                return None if delivered else "El servidor no aceptó el email"
+            except CONNECTION_ERRORS:
+                raise
+            except Exception as e:
+                # Destinatario rechazado u otro error del mensaje: la sesión sigue abierta
+                error = str(e) or e.__class__.__name__
+                code = smtp_code(e)
+                if code and 400 <= code < 500 and retry < TEMPORARY_RETRIES:
+                    delay = min(backoff * 2 ** retry, max_backoff)
+                    metrics.NEWSLETTER_EMAILS.inc(result='deferred')
+                    logger.warning(f"Respuesta {code} para {email.to[0]}, reintentando en {delay:.1f} s")
+                    time.sleep(delay)
+                    continue
+                logger.error(f"Error enviando newsletter a {email.to[0]}: {error}")
+                return error
+    
+    @staticmethod
+    def _deliver(connection, email):
+        # Con la conexión ya abierta, send_messages la reutiliza y no la cierra
+        with metrics.NEWSLETTER_SEND_DURATION.time():
+            return connection.send_messages([email]) == 1
+    
+    @staticmethod
+    def send_welcome_email(subscriber, connection=None):
+        """
+        Envía el email de bienvenida a un suscriptor. Los errores se propagan
+        para que la tarea que lo llama (ver apps/newsletter/jobs.py) se reintente.
+        """
+        html_content = render_to_string('newsletter/bienvenidos.html', {
+            'site_url': settings.SITE_URL,
+            'unsubscribe_url': NewsletterService.unsubscribe_url(subscriber.token),
+            'current_year': timezone.now().year
+        })
+        email = EmailMultiAlternatives(
+            subject="¡Bienvenido a nuestro newsletter!",
+            body="¡Bienvenido a nuestro newsletter!",
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[subscriber.email],
+            reply_to=[settings.NEWSLETTER_CONFIG.get('REPLY_TO', settings.DEFAULT_FROM_EMAIL)],
+            connection=connection,
+        )
+        email.attach_alternative(html_content, "text/html")
+        with metrics.NEWSLETTER_SEND_DURATION.time():
+            email.send()
+        metrics.NEWSLETTER_EMAILS.inc(result='sent')
+    
+    @staticmethod
+    def compile_template(template_content):
+        """
+        Compila una plantilla de string. El resultado se puede renderizar
+        muchas veces sin volver a parsear el texto.
+        """
+        return Template(template_content)
+    
     @staticmethod
     def render_template(template_content, context):
         """
-        Renderiza una plantilla de string con el contexto
+        Renderiza una plantilla (string o ya compilada) con el contexto
+        """
+        if not isinstance(template_content, Template):
+            template_content = NewsletterService.compile_template(template_content)
+        return template_content.render(Context(context))
+    
+    @staticmethod
+    def iter_active_subscribers(chunk_size=None):
+        """
+        Recorre los suscriptores activos como pares (email, token), con una
+        consulta cada `chunk_size`. Pagina por id (keyset) sobre el índice
+        (is_active, id), así los últimos lotes cuestan lo mismo que los primeros.
+        """
+        chunk_size = chunk_size or SUBSCRIBER_CHUNK_SIZE
+        last_id = 0
+        while True:
+            rows = list(
+                NewsletterSubscriber.objects.filter(is_active=True, id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'email', 'token')[:chunk_size]
+            )
+            for _, email, token in rows:
+                yield email, token
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+    
+    @staticmethod
+    def unsubscribe_url(token):
+        """
+        URL para desuscribirse a partir del token, sin consultar la base
         """
-        from django.template import Template, Context
-        template = Template(template_content)
-        return template.render(Context(context))
+        return f"{settings.SITE_URL}/newsletter/unsubscribe/{token}/"
     
     @staticmethod
     def get_unsubscribe_url(email):
         """
-        Genera URL para desuscribirse
+        Genera URL para desuscribirse buscando el token del email
         """
-        from newsletter.models import NewsletterSubscriber
         try:
-            subscriber = NewsletterSubscriber.objects.get(email=email)
-            return f"{settings.SITE_URL}/newsletter/unsubscribe/{subscriber.token}/"
+            subscriber = NewsletterSubscriber.objects.only('token').get(email=email)
+            return NewsletterService.unsubscribe_url(subscriber.token)
         except NewsletterSubscriber.DoesNotExist:
-            return f"{settings.SITE_URL}/newsletter/unsubscribe/"
\ No newline at end of file
+            return f"{settings.SITE_URL}/newsletter/unsubscribe/"
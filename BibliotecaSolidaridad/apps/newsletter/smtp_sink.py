@@ -0,0 +1,87 @@
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Diálogo SMTP mínimo: acepta todo y descarta los mensajes"""
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        server = self.server
+        time.sleep(server.connect_delay)
+        with server.lock:
+            server.connections += 1
+        self.reply('220 sink ESMTP')
+        delivered = 0
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip().upper()
+            if command.startswith(('EHLO', 'HELO')):
+                self.reply('250-sink')
+                self.reply('250 8BITMIME')
+            elif command.startswith('DATA'):
+                self.reply('354 fin con <CRLF>.<CRLF>')
+                while self.rfile.readline() not in (b'.\r\n', b'.\n', b''):
+                    pass
+                time.sleep(server.message_delay)
+                with server.lock:
+                    server.messages += 1
+                delivered += 1
+                self.reply('250 OK')
+                if server.max_messages_per_connection and delivered >= server.max_messages_per_connection:
+                    # Corta la conexión como un servidor con límite por sesión
+                    return
+            elif command.startswith('MAIL') and server.take_temporary_failure():
+                self.reply('451 4.7.1 Demasiados envíos, intente más tarde')
+            elif command.startswith('QUIT'):
+                self.reply('221 chau')
+                return
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Servidor SMTP local para benchmarks y tests. `connect_delay` simula el costo
+    de abrir la sesión (TCP + TLS + EHLO) y `message_delay` el de cada envío.
+    Los primeros `temporary_failures` MAIL FROM reciben un 451.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, connect_delay=0.0, message_delay=0.0,
+                 max_messages_per_connection=None, temporary_failures=0):
+        super().__init__((host, port), _SMTPHandler)
+        self.connect_delay = connect_delay
+        self.message_delay = message_delay
+        self.max_messages_per_connection = max_messages_per_connection
+        self.temporary_failures = temporary_failures
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+
+    def take_temporary_failure(self):
+        with self.lock:
+            if self.temporary_failures <= 0:
+                return False
+            self.temporary_failures -= 1
+            return True
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
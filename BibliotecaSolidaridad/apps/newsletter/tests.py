@@ -1,3 +1,609 @@
-from django.test import TestCase
+import random
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+from django.core import mail
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from apps.books.models import Book, BookStock, Category
+from apps.dashboard.queryplan import QueryPlanAssertionsMixin, analyze
+from apps.jobs.models import Job
+from apps.jobs.scheduler import Scheduler
+from apps.jobs.services import ClaimLost, JobService
+from apps.loans.models import Loan
+from apps.users.models import User
+from .digest import DigestService
+from .models import NewsletterCampaign, NewsletterDelivery, NewsletterSubscriber
+from .outbox import NewsletterOutbox
+from .ratelimit import TokenBucket
+from .scheduling import CampaignSchedule
+from .services import NewsletterService
+from . import tracking
+from .smtp_sink import SMTPSink
 
-# Create your tests here.
+
+class SubscriberQueryPlanTests(QueryPlanAssertionsMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(28)
+        NewsletterSubscriber.objects.bulk_create(
+            (
+                NewsletterSubscriber(
+                    email=f'lector{i}@example.com',
+                    token=f'token-{i}',
+                    is_active=rng.random() < 0.9,
+                )
+                for i in range(20000)
+            ),
+            batch_size=2000,
+        )
+        analyze()
+
+    def test_subscription_lookups(self):
+        # NewsletterSubscriptionForm.clean_email y UnsubscribeByEmailView
+        self.assertUsesIndexes(
+            NewsletterSubscriber.objects.filter(email='lector7@example.com', is_active=True)
+        )
+        # UnsubscribeNewsletterView
+        self.assertUsesIndexes(NewsletterSubscriber.objects.filter(token='token-7'))
+
+    def test_active_subscribers_by_chunks(self):
+        self.assertUsesIndexes(
+            NewsletterSubscriber.objects.filter(is_active=True, id__gt=5000).order_by('id')[:500]
+        )
+
+
+class BatchedSendTests(TestCase):
+    recipients = [f'lector{i}@example.com' for i in range(7)]
+
+    def smtp_connection(self, sink):
+        return get_connection(
+            'django.core.mail.backends.smtp.EmailBackend',
+            host='127.0.0.1', port=sink.port, username='', password='', use_tls=False, timeout=5,
+        )
+
+    def send(self, connection=None):
+        return NewsletterService.send_newsletter(
+            'Novedades', '<p>{{ recipient_email }}</p>', '{{ recipient_email }}',
+            self.recipients, connection=connection,
+        )
+
+    @override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 3, 'REPLY_TO': 'biblioteca@example.com'})
+    def test_one_smtp_session_per_batch(self):
+        with SMTPSink() as sink:
+            result = self.send(self.smtp_connection(sink))
+
+        self.assertEqual(result, (7, 0))
+        self.assertEqual(sink.messages, 7)
+        self.assertEqual(sink.connections, 3)
+
+    @override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 10})
+    def test_reconnects_when_server_drops_the_session(self):
+        with SMTPSink(max_messages_per_connection=2) as sink, self.assertLogs('apps.newsletter.services', 'WARNING'):
+            result = self.send(self.smtp_connection(sink))
+
+        self.assertEqual(result, (7, 0))
+        self.assertEqual(sink.messages, 7)
+        self.assertEqual(sink.connections, 4)
+
+    @override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 10, 'BACKOFF_SECONDS': 0})
+    def test_retries_temporary_rejections(self):
+        with SMTPSink(temporary_failures=2) as sink, self.assertLogs('apps.newsletter.services', 'WARNING') as logs:
+            result = self.send(self.smtp_connection(sink))
+
+        self.assertEqual(result, (7, 0))
+        self.assertEqual(sink.messages, 7)
+        self.assertIn('Respuesta 451', logs.output[0])
+
+    @override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 10})
+    def test_unreachable_server_fails_the_batch(self):
+        with SMTPSink() as sink:
+            connection = self.smtp_connection(sink)
+        with self.assertLogs('apps.newsletter.services', 'ERROR'):
+            result = self.send(connection)
+
+        self.assertEqual(result, (0, 7))
+
+    @override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 4})
+    def test_personalizes_each_email(self):
+        self.assertEqual(self.send(), (7, 0))
+
+        self.assertEqual([message.to for message in mail.outbox], [[r] for r in self.recipients])
+        self.assertEqual(mail.outbox[0].body, self.recipients[0])
+        self.assertEqual(mail.outbox[0].alternatives[0][0], f'<p>{self.recipients[0]}</p>')
+
+    def test_compiles_templates_once_per_send(self):
+        compile_template = NewsletterService.compile_template
+        with mock.patch.object(NewsletterService, 'compile_template', side_effect=compile_template) as compiled:
+            NewsletterService.send_newsletter(
+                'Novedades',
+                '{% if recipient_email %}<p>{{ recipient_email }}</p>{% endif %}{{ site_name }}',
+                '{{ current_year }} {{ unsubscribe_url }}',
+                self.recipients,
+            )
+
+        self.assertEqual(compiled.call_count, 2)
+        self.assertEqual(len(mail.outbox), 7)
+        self.assertEqual(
+            mail.outbox[6].alternatives[0][0],
+            f'<p>{self.recipients[6]}</p>Biblioteca de la Solidaridad',
+        )
+        self.assertIn('/newsletter/unsubscribe/', mail.outbox[6].body)
+
+
+class CampaignRecipientStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        NewsletterSubscriber.objects.bulk_create(
+            NewsletterSubscriber(email=f'lector{i}@example.com', token=f'token-{i}', is_active=i % 5 != 0)
+            for i in range(30)
+        )
+
+    def test_streams_active_pairs_in_chunks(self):
+        with self.assertNumQueries(3):
+            pairs = list(NewsletterService.iter_active_subscribers(chunk_size=10))
+
+        self.assertEqual(len(pairs), 24)
+        self.assertEqual(pairs[0], ('lector1@example.com', 'token-1'))
+        self.assertNotIn(('lector5@example.com', 'token-5'), pairs)
+
+    @override_settings(SITE_URL='https://biblioteca.example', NEWSLETTER_CONFIG={'BATCH_SIZE': 50})
+    def test_campaign_builds_unsubscribe_links_without_per_recipient_queries(self):
+        campaign = NewsletterCampaign.objects.create(
+            title='Primavera', subject='Novedades', html_content='<a href="{{ unsubscribe_url }}">baja</a>',
+        )
+        with mock.patch('apps.newsletter.services.SUBSCRIBER_CHUNK_SIZE', 10):
+            with CaptureQueriesContext(connection) as queries:
+                call_command('send_newsletter', campaign_id=campaign.id, stdout=StringIO())
+
+        # Ninguna consulta por destinatario: el total depende de la cantidad de lotes
+        self.assertLess(len(queries), 24)
+
+        campaign.refresh_from_db()
+        self.assertTrue(campaign.is_sent)
+        self.assertEqual((campaign.total_recipients, campaign.total_sent), (24, 24))
+        # El link de baja no pasa por el contador de clics; después va el píxel de apertura
+        self.assertTrue(
+            mail.outbox[0].alternatives[0][0].startswith(
+                '<a href="https://biblioteca.example/newsletter/unsubscribe/token-1/">baja</a><img '
+            )
+        )
+
+
+@override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 4})
+class NewsletterOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        NewsletterSubscriber.objects.bulk_create(
+            NewsletterSubscriber(email=f'lector{i}@example.com', token=f'token-{i}') for i in range(10)
+        )
+
+    def setUp(self):
+        self.campaign = NewsletterCampaign.objects.create(
+            title='Otoño', subject='Novedades', html_content='<p>{{ recipient_email }}</p>',
+        )
+
+    def test_resumes_after_a_crash_without_resending(self):
+        deliver_batch = NewsletterService.deliver_batch
+        calls = []
+
+        def crash_on_second_batch(connection, messages, throttle=None):
+            calls.append(len(messages))
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return deliver_batch(connection, messages, throttle)
+
+        with mock.patch.object(NewsletterService, 'deliver_batch', side_effect=crash_on_second_batch):
+            with self.assertRaises(KeyboardInterrupt):
+                NewsletterOutbox.run(self.campaign)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.total_recipients, self.campaign.total_sent), (10, 4))
+        self.assertFalse(self.campaign.is_sent)
+
+        # El lote que quedó tomado por el proceso caído se libera al vencer el plazo
+        with mock.patch('apps.newsletter.outbox.CLAIM_TIMEOUT', timedelta(0)):
+            totals = NewsletterOutbox.run(self.campaign)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual(totals['sent'], 6)
+        self.assertTrue(self.campaign.is_sent)
+        self.assertEqual(self.campaign.total_sent, 10)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), sorted(f'lector{i}@example.com' for i in range(10)))
+
+    def test_a_failing_batch_callback_stops_the_send(self):
+        beats = mock.Mock(side_effect=[None, ClaimLost('tomada por otro worker')])
+        with self.assertRaises(ClaimLost):
+            NewsletterOutbox.run(self.campaign, on_batch=beats)
+
+        # Se llama después de cada lote; al segundo se corta antes de tomar el tercero
+        self.assertEqual(beats.call_count, 2)
+        self.assertEqual(len(mail.outbox), 8)
+
+    def test_retries_failures_up_to_the_limit(self):
+        deliver_batch = NewsletterService.deliver_batch
+
+        def reject_one(connection, messages, throttle=None):
+            errors = deliver_batch(connection, messages, throttle)
+            return ['550 buzón inexistente' if m.to[0] == 'lector3@example.com' else e for m, e in zip(messages, errors)]
+
+        with mock.patch.object(NewsletterService, 'deliver_batch', side_effect=reject_one):
+            totals = NewsletterOutbox.run(self.campaign)
+
+        self.assertEqual((totals['sent'], totals['failed'], totals['retried']), (9, 1, 2))
+        failed = NewsletterDelivery.objects.get(campaign=self.campaign, status='failed')
+        self.assertEqual((failed.email, failed.attempts), ('lector3@example.com', 3))
+        self.assertEqual(failed.last_error, '550 buzón inexistente')
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.total_sent, self.campaign.total_failed), (9, 1))
+        self.assertTrue(self.campaign.is_sent)
+
+    def test_claims_do_not_overlap(self):
+        NewsletterOutbox.enqueue(self.campaign)
+        NewsletterOutbox.enqueue(self.campaign)
+        first = NewsletterOutbox.claim(self.campaign, 6)
+        second = NewsletterOutbox.claim(self.campaign, 6)
+
+        self.assertEqual(NewsletterDelivery.objects.filter(campaign=self.campaign).count(), 10)
+        self.assertEqual((len(first), len(second)), (6, 4))
+        self.assertFalse({d.pk for d in first} & {d.pk for d in second})
+        self.assertEqual(NewsletterOutbox.claim(self.campaign, 6), [])
+
+
+class TokenBucketTests(TestCase):
+    def test_limits_the_rate_after_the_initial_burst(self):
+        now = [0.0]
+        waits = []
+
+        def sleep(seconds):
+            waits.append(seconds)
+            now[0] += seconds
+
+        bucket = TokenBucket(rate=10, capacity=5, clock=lambda: now[0], sleep=sleep)
+        for _ in range(25):
+            bucket.acquire()
+
+        # 5 de ráfaga y 20 a 10 por segundo
+        self.assertAlmostEqual(now[0], 2.0)
+        self.assertEqual(len(waits), 20)
+
+
+@override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 5, 'BACKOFF_SECONDS': 0})
+class ParallelOutboxTests(TransactionTestCase):
+    def test_workers_share_the_outbox_without_duplicates(self):
+        NewsletterSubscriber.objects.bulk_create(
+            NewsletterSubscriber(email=f'lector{i}@example.com', token=f'token-{i}') for i in range(60)
+        )
+        campaign = NewsletterCampaign.objects.create(title='Invierno', subject='Novedades', html_content='<p>Hola</p>')
+
+        # La base de tests es SQLite en memoria con caché compartida, que ante
+        # escrituras concurrentes falla en lugar de esperar: se serializan sólo
+        # los accesos a la base y el envío SMTP sigue siendo paralelo.
+        db_lock = threading.Lock()
+        claim, record = NewsletterOutbox.claim, NewsletterOutbox.record
+
+        def locked(function):
+            def wrapper(*args, **kwargs):
+                with db_lock:
+                    return function(*args, **kwargs)
+            return wrapper
+
+        with SMTPSink(message_delay=0.002) as sink, \
+                mock.patch.object(NewsletterOutbox, 'claim', locked(claim)), \
+                mock.patch.object(NewsletterOutbox, 'record', locked(record)):
+            totals = NewsletterOutbox.run(
+                campaign, workers=4, rate_limit=1000,
+                connection_factory=lambda: get_connection(
+                    'django.core.mail.backends.smtp.EmailBackend',
+                    host='127.0.0.1', port=sink.port, username='', password='', use_tls=False, timeout=5,
+                ),
+            )
+
+        campaign.refresh_from_db()
+        self.assertEqual(totals['sent'], 60)
+        self.assertEqual(sink.messages, 60)
+        self.assertEqual(sink.connections, 12)
+        self.assertTrue(campaign.is_sent)
+        self.assertEqual(campaign.total_sent, 60)
+        self.assertFalse(NewsletterDelivery.objects.exclude(status='sent').exists())
+
+
+class WelcomeEmailTests(TestCase):
+    def test_subscribing_queues_the_welcome_email_instead_of_sending_it(self):
+        with mock.patch.object(NewsletterService, 'send_welcome_email') as send:
+            response = self.client.post('/newsletter/subscribe/', {'email': 'nueva@example.com'})
+        self.assertEqual(response.status_code, 302)
+        send.assert_not_called()
+        self.assertEqual(len(mail.outbox), 0)
+        subscriber = NewsletterSubscriber.objects.get(email='nueva@example.com')
+        job = Job.objects.get(name='newsletter.welcome')
+        self.assertEqual(job.payload, {'subscriber_id': subscriber.pk})
+
+        self.assertEqual(JobService.run_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['nueva@example.com'])
+        html, _ = mail.outbox[0].alternatives[0]
+        self.assertIn(f'/newsletter/unsubscribe/{subscriber.token}/', html)
+
+    def test_failed_welcome_email_is_retried_later(self):
+        subscriber = NewsletterSubscriber.objects.create(email='reintento@example.com')
+        JobService.enqueue('newsletter.welcome', subscriber_id=subscriber.pk)
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('timeout')), \
+                self.assertLogs('apps.jobs.services', 'WARNING'):
+            self.assertEqual(JobService.run_pending(), (0, 1))
+        job = Job.objects.get()
+        self.assertEqual(job.status, 'pending')
+        self.assertIn('timeout', job.last_error)
+
+    def test_skips_subscribers_who_already_left(self):
+        subscriber = NewsletterSubscriber.objects.create(email='baja@example.com', is_active=False)
+        JobService.enqueue('newsletter.welcome', subscriber_id=subscriber.pk)
+        self.assertEqual(JobService.run_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class CampaignScheduleTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.scheduler = Scheduler(clock=lambda: self.now.timestamp())
+        self.schedule = CampaignSchedule(self.scheduler)
+
+    def create(self, title, minutes):
+        return NewsletterCampaign.objects.create(
+            title=title, subject=title, html_content='<p>Hola</p>',
+            scheduled_for=self.now + timedelta(minutes=minutes),
+        )
+
+    def dispatched(self):
+        return sorted(job.payload['campaign_id'] for job in Job.objects.filter(name='newsletter.send_campaign'))
+
+    def test_dispatches_due_campaigns_to_the_job_queue(self):
+        soon = self.create('Pronto', 5)
+        later = self.create('Después', 60)
+        NewsletterCampaign.objects.create(title='Borrador', subject='-', html_content='-')
+        self.assertTrue(self.schedule.check())
+
+        self.now += timedelta(minutes=10)
+        self.scheduler.run_due()
+        self.assertEqual(self.dispatched(), [soon.pk])
+        self.assertEqual(self.scheduler.next_due(), later.scheduled_for.timestamp())
+
+    def test_unchanged_campaigns_cost_one_query(self):
+        self.create('Pronto', 5)
+        self.schedule.check()
+        with self.assertNumQueries(1):
+            self.assertFalse(self.schedule.check())
+
+    def test_picks_up_new_and_rescheduled_campaigns(self):
+        campaign = self.create('Reprogramada', 60)
+        self.schedule.check()
+
+        campaign.scheduled_for = self.now + timedelta(minutes=1)
+        campaign.save()
+        added = self.create('Nueva', 2)
+        self.assertTrue(self.schedule.check())
+
+        self.now += timedelta(minutes=3)
+        self.scheduler.run_due()
+        self.assertEqual(self.dispatched(), [campaign.pk, added.pk])
+        # Ya encoladas: otro check no las vuelve a agendar
+        self.schedule.check()
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_sent_campaign_is_dropped_from_the_schedule(self):
+        campaign = self.create('Enviada a mano', 5)
+        self.schedule.check()
+        NewsletterCampaign.objects.filter(pk=campaign.pk).update(is_sent=True)
+        self.schedule.check()
+        self.assertIsNone(self.scheduler.next_due())
+
+    def test_send_job_runs_the_outbox(self):
+        NewsletterSubscriber.objects.create(email='lector@example.com')
+        campaign = self.create('Pronto', -1)
+        JobService.enqueue('newsletter.send_campaign', campaign_id=campaign.pk)
+        with override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 10, 'WORKERS': 1, 'RATE_LIMIT': None}):
+            self.assertEqual(JobService.run_pending(), (1, 0))
+        campaign.refresh_from_db()
+        self.assertTrue(campaign.is_sent)
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class DigestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        today = timezone.now().date()
+        librarian = User.objects.create_user('bibliotecaria', dni='L1', role='librarian')
+        cls.novels, cls.poetry = Category.objects.bulk_create(
+            Category(name=name, created_by=librarian) for name in ('Novela', 'Poesía')
+        )
+
+        def book(title, category, days_old=0, copies=1):
+            book = Book.objects.create(title=title, authors=['Autora'])
+            BookStock.objects.bulk_create(
+                BookStock(book=book, physical_id=f'{title}-{n}', status='available') for n in range(copies)
+            )
+            book.categories.add(category)
+            Book.objects.filter(pk=book.pk).update(created_at=timezone.now() - timedelta(days=days_old))
+            return book
+
+        cls.new_novel = book('Novela nueva', cls.novels)
+        cls.newer_novel = book('Novela más nueva', cls.novels)
+        Book.objects.filter(pk=cls.new_novel.pk).update(created_at=timezone.now() - timedelta(days=1))
+        cls.old_novel = book('Novela vieja', cls.novels, days_old=60)
+        cls.new_poems = book('Poemas nuevos', cls.poetry)
+        cls.popular_novel = book('Novela popular', cls.novels, days_old=60)
+        cls.popular_poems = book('Poemas populares', cls.poetry, days_old=60)
+        cls.read_novel = book('Novela ya leída', cls.novels, days_old=60)
+
+        # Socio vinculado a su suscripción y socio que se suscribió con el mismo email
+        cls.linked = User.objects.create_user('linked', email='linked@example.com', dni='U1')
+        cls.by_email = User.objects.create_user('by_email', email='poeta@example.com', dni='U2')
+        cls.linked.profile.favorite_categories.set([cls.novels])
+        cls.by_email.profile.favorite_categories.set([cls.poetry])
+        NewsletterSubscriber.objects.create(email='linked@example.com', user=cls.linked)
+        NewsletterSubscriber.objects.create(email='poeta@example.com')
+        NewsletterSubscriber.objects.create(email='anonimo@example.com')
+
+        reader = User.objects.create_user('reader', dni='U3')
+        loans = [Loan(user=reader, book=cls.popular_novel, due_date=today - timedelta(days=1), status='returned')] * 3
+        loans += [Loan(user=reader, book=cls.popular_poems, due_date=today, status='returned')] * 2
+        loans += [
+            Loan(user=reader, book=cls.read_novel, due_date=today, status='returned'),
+            Loan(user=cls.linked, book=cls.read_novel, due_date=today, status='returned'),
+            Loan(user=cls.linked, book=cls.old_novel, due_date=today + timedelta(days=2), status='active'),
+            Loan(user=cls.linked, book=cls.new_poems, due_date=today + timedelta(days=10), status='active'),
+        ]
+        Loan.objects.bulk_create(loans)
+
+    def test_sections_follow_each_subscribers_favorites(self):
+        digests = DigestService.build()
+
+        self.assertEqual(digests['linked@example.com'], {
+            'new_books': [self.newer_novel.pk, self.new_novel.pk],
+            'due_soon': [[self.old_novel.pk, f'{timezone.now().date() + timedelta(days=2):%d/%m/%Y}']],
+            'recommendations': [self.popular_novel.pk],
+        })
+        self.assertEqual(digests['poeta@example.com']['new_books'], [self.new_poems.pk])
+        self.assertEqual(digests['poeta@example.com']['recommendations'], [self.popular_poems.pk])
+        # Sin socio: sólo los más prestados
+        self.assertEqual(digests['anonimo@example.com'], {
+            'new_books': [], 'due_soon': [],
+            'recommendations': [
+                self.popular_novel.pk, self.popular_poems.pk, self.read_novel.pk, self.old_novel.pk, self.new_poems.pk,
+            ],
+        })
+
+    def test_query_count_does_not_depend_on_the_audience(self):
+        with CaptureQueriesContext(connection) as small:
+            DigestService.build()
+        for i in range(30):
+            user = User.objects.create_user(f'socio{i}', email=f'socio{i}@example.com', dni=f'S{i}')
+            NewsletterSubscriber.objects.create(email=user.email, user=user if i % 2 else None)
+            Loan.objects.create(user=user, book=self.popular_poems, due_date=timezone.now().date(), status='active')
+        with self.assertNumQueries(len(small)):
+            digests = DigestService.build()
+        self.assertEqual(len(digests), 33)
+
+    def test_outbox_renders_each_digest(self):
+        campaign = NewsletterCampaign.objects.create(
+            title='Resumen', subject='Tu resumen', kind='digest',
+            html_content='{% include "newsletter/resumen.html" %}', text_content='Resumen',
+        )
+        with override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 10, 'WORKERS': 1, 'RATE_LIMIT': None}):
+            NewsletterOutbox.run(campaign)
+
+        html = {message.to[0]: message.alternatives[0][0] for message in mail.outbox}
+        self.assertIn('Novela más nueva', html['linked@example.com'])
+        self.assertIn('Novela vieja', html['linked@example.com'])
+        self.assertNotIn('Poemas nuevos', html['linked@example.com'])
+        self.assertIn('Poemas nuevos', html['poeta@example.com'])
+        self.assertNotIn('préstamos por vencer', html['anonimo@example.com'])
+        # Los links pasan por el contador de clics, con la dirección original en la query
+        self.assertIn(f'%2Fbooks%2F{self.popular_novel.pk}%2F', html['anonimo@example.com'])
+
+
+@override_settings(SITE_URL='http://biblio.test')
+class TrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.campaign = NewsletterCampaign.objects.create(
+            title='Invierno', subject='Novedades', html_content='-', total_sent=4, started_at=timezone.now(),
+        )
+        cls.deliveries = NewsletterDelivery.objects.bulk_create(
+            NewsletterDelivery(campaign=cls.campaign, email=f'lector{i}@example.com', token=f't{i}', status='sent')
+            for i in range(4)
+        )
+
+    def setUp(self):
+        patcher = mock.patch.object(tracking, 'BUFFER', tracking.TrackingBuffer())
+        self.buffer = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pixel(self, delivery, signature=None):
+        url = tracking.open_url(self.campaign.pk, delivery.pk)
+        if signature:
+            url = url.rsplit('/', 1)[0] + f'/{signature}.gif'
+        return self.client.get(url.removeprefix('http://biblio.test'))
+
+    def test_rewrites_links_and_adds_the_pixel(self):
+        html = tracking.add_tracking(
+            '<body><a href="http://biblio.test/books/1/?a=1&amp;b=2">Libro</a>'
+            '<a href="http://biblio.test/newsletter/unsubscribe/abc/">Baja</a></body>',
+            self.campaign.pk, 7,
+        )
+        self.assertIn(f'/newsletter/t/c/{self.campaign.pk}/7/?u=http%3A%2F%2Fbiblio.test%2Fbooks%2F1%2F%3Fa%3D1%26b%3D2&amp;s=', html)
+        self.assertIn('href="http://biblio.test/newsletter/unsubscribe/abc/"', html)
+        self.assertIn(f'/newsletter/t/o/{self.campaign.pk}/7/', html.split('</a>')[-1])
+
+    @override_settings(NEWSLETTER_CONFIG={'TRACKING_FLUSH_INTERVAL': 3600, 'TRACKING_MAX_PENDING': 1000})
+    def test_hits_are_buffered_and_flushed_as_aggregated_updates(self):
+        first, second = self.deliveries[:2]
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                response = self.pixel(first)
+            self.pixel(second)
+        self.assertEqual(response['Content-Type'], 'image/gif')
+        self.assertEqual(response.content, tracking.PIXEL)
+
+        target = 'http://biblio.test/books/1/'
+        click = tracking.click_url(self.campaign.pk, second.pk, target).removeprefix('http://biblio.test')
+        response = self.client.get(click)
+        self.assertRedirects(response, target, fetch_redirect_response=False)
+
+        # Aperturas únicas, clics únicos y los incrementos de la campaña
+        with self.assertNumQueries(5):
+            self.assertEqual(self.buffer.flush(), 5)
+        self.campaign.refresh_from_db()
+        self.assertEqual(
+            (self.campaign.total_opens, self.campaign.unique_opens, self.campaign.total_clicks, self.campaign.unique_clicks),
+            (4, 2, 1, 1),
+        )
+        self.assertEqual(self.campaign.open_rate, 50)
+
+        # Volver a abrir no suma aperturas únicas
+        self.pixel(first)
+        self.buffer.flush()
+        self.campaign.refresh_from_db()
+        self.assertEqual((self.campaign.total_opens, self.campaign.unique_opens), (5, 2))
+
+    def test_forged_hits_are_not_counted(self):
+        response = self.pixel(self.deliveries[0], signature='falsa')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            f'/newsletter/t/c/{self.campaign.pk}/{self.deliveries[0].pk}/', {'u': 'http://evil.test/', 's': 'x'}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.buffer.pending, 0)
+
+    def test_flushes_once_the_buffer_is_full(self):
+        with override_settings(NEWSLETTER_CONFIG={'TRACKING_FLUSH_INTERVAL': 3600, 'TRACKING_MAX_PENDING': 3}):
+            for delivery in self.deliveries[:3]:
+                self.pixel(delivery)
+        self.assertEqual(self.buffer.pending, 0)
+        self.assertEqual(NewsletterCampaign.objects.get(pk=self.campaign.pk).unique_opens, 3)
+
+    def test_failed_flush_keeps_the_events(self):
+        self.buffer.record('open', self.campaign.pk, self.deliveries[0].pk)
+        with mock.patch.object(tracking.TrackingBuffer, '_write', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('apps.newsletter.tracking', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(NewsletterCampaign.objects.get(pk=self.campaign.pk).total_opens, 1)
+
+    def test_outbox_emails_carry_tracking(self):
+        NewsletterSubscriber.objects.create(email='nuevo@example.com')
+        campaign = NewsletterCampaign.objects.create(
+            title='Primavera', subject='Novedades',
+            html_content='<body><a href="http://biblio.test/books/">Catálogo</a></body>',
+        )
+        with override_settings(NEWSLETTER_CONFIG={'BATCH_SIZE': 10, 'WORKERS': 1, 'RATE_LIMIT': None}):
+            NewsletterOutbox.run(campaign)
+        delivery = campaign.deliveries.get()
+        html = mail.outbox[0].alternatives[0][0]
+        self.assertIn(tracking.open_url(campaign.pk, delivery.pk), html)
+        self.assertIn(f'/newsletter/t/c/{campaign.pk}/{delivery.pk}/', html)
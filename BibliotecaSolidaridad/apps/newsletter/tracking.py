@@ -0,0 +1,160 @@
+import atexit
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlencode
+from django.conf import settings
+from django.core.signing import Signer
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from .models import NewsletterCampaign, NewsletterDelivery
+
+logger = logging.getLogger(__name__)
+
+# GIF transparente de 1x1
+PIXEL = (
+    b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+    b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;'
+)
+_LINK = re.compile(r'href="(https?://[^"]+)"')
+_signer = Signer(salt='newsletter.tracking')
+
+
+def signature(*parts):
+    return _signer.signature(':'.join(str(part) for part in parts))
+
+
+def verify(sig, *parts):
+    return constant_time_compare(sig, signature(*parts))
+
+
+def open_url(campaign_id, delivery_id):
+    sig = signature(campaign_id, delivery_id)
+    return f"{settings.SITE_URL}/newsletter/t/o/{campaign_id}/{delivery_id}/{sig}.gif"
+
+
+def click_url(campaign_id, delivery_id, url):
+    query = urlencode({'u': url, 's': signature(campaign_id, delivery_id, url)})
+    return f"{settings.SITE_URL}/newsletter/t/c/{campaign_id}/{delivery_id}/?{query}"
+
+
+def add_tracking(html, campaign_id, delivery_id):
+    """
+    Pasa los links del email por el contador de clics y agrega el píxel de
+    apertura. El link de baja queda tal cual.
+    """
+    unsubscribe = f"{settings.SITE_URL}/newsletter/unsubscribe/"
+
+    def rewrite(match):
+        url = match.group(1).replace('&amp;', '&')
+        if url.startswith(unsubscribe):
+            return match.group(0)
+        return 'href="{}"'.format(click_url(campaign_id, delivery_id, url).replace('&', '&amp;'))
+
+    html = _LINK.sub(rewrite, html)
+    pixel = f'<img src="{open_url(campaign_id, delivery_id)}" width="1" height="1" alt="" style="display:none">'
+    if '</body>' in html:
+        return html.replace('</body>', pixel + '</body>', 1)
+    return html + pixel
+
+
+class TrackingBuffer:
+    """
+    Aperturas y clics acumulados en memoria. flush() los escribe agrupados:
+    un UPDATE por campaña con los incrementos (F('total_opens') + n) y otro
+    que marca de una vez los destinatarios que abrieron o clickearon por
+    primera vez, cuyo conteo de filas suma a las aperturas y clics únicos.
+    Si la escritura falla, los eventos vuelven al buffer para el próximo flush.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self._reset()
+        atexit.register(self.flush)
+
+    def _reset(self):
+        self.opens = Counter()
+        self.clicks = Counter()
+        self.opened = defaultdict(set)
+        self.clicked = defaultdict(set)
+        self.pending = 0
+
+    def record(self, kind, campaign_id, delivery_id):
+        with self.lock:
+            if kind == 'open':
+                self.opens[campaign_id] += 1
+                self.opened[campaign_id].add(delivery_id)
+            else:
+                self.clicks[campaign_id] += 1
+                self.clicked[campaign_id].add(delivery_id)
+                # Un clic prueba la apertura aunque el cliente haya bloqueado las imágenes
+                self.opened[campaign_id].add(delivery_id)
+            self.pending += 1
+
+    def maybe_flush(self, interval=None, max_pending=None):
+        config = settings.NEWSLETTER_CONFIG
+        interval = config.get('TRACKING_FLUSH_INTERVAL', 5) if interval is None else interval
+        max_pending = config.get('TRACKING_MAX_PENDING', 5000) if max_pending is None else max_pending
+        if self.pending and (self.pending >= max_pending or time.monotonic() - self.last_flush >= interval):
+            # Si otro hilo ya está escribiendo, éste sigue de largo
+            if self.flush_lock.acquire(blocking=False):
+                try:
+                    self.flush()
+                finally:
+                    self.flush_lock.release()
+
+    def flush(self):
+        """Escribe lo acumulado. Devuelve la cantidad de eventos escritos."""
+        with self.lock:
+            opens, clicks, opened, clicked, pending = (
+                self.opens, self.clicks, self.opened, self.clicked, self.pending
+            )
+            self._reset()
+            self.last_flush = time.monotonic()
+        if not pending:
+            return 0
+        try:
+            self._write(opens, clicks, opened, clicked)
+        except Exception:
+            logger.exception(f"No se pudieron guardar {pending} eventos de seguimiento, se reintentan")
+            with self.lock:
+                self.opens.update(opens)
+                self.clicks.update(clicks)
+                for campaign_id, ids in opened.items():
+                    self.opened[campaign_id] |= ids
+                for campaign_id, ids in clicked.items():
+                    self.clicked[campaign_id] |= ids
+                self.pending += pending
+            return 0
+        return pending
+
+    @staticmethod
+    def _write(opens, clicks, opened, clicked):
+        now = timezone.now()
+        with transaction.atomic():
+            for campaign_id in set(opens) | set(clicks):
+                deliveries = NewsletterDelivery.objects.filter(campaign_id=campaign_id)
+                unique_opens = unique_clicks = 0
+                if opened.get(campaign_id):
+                    unique_opens = deliveries.filter(
+                        pk__in=opened[campaign_id], opened_at__isnull=True
+                    ).update(opened_at=now)
+                if clicked.get(campaign_id):
+                    unique_clicks = deliveries.filter(
+                        pk__in=clicked[campaign_id], clicked_at__isnull=True
+                    ).update(clicked_at=now)
+                NewsletterCampaign.objects.filter(pk=campaign_id).update(
+                    total_opens=F('total_opens') + opens.get(campaign_id, 0),
+                    total_clicks=F('total_clicks') + clicks.get(campaign_id, 0),
+                    unique_opens=F('unique_opens') + unique_opens,
+                    unique_clicks=F('unique_clicks') + unique_clicks,
+                )
+
+
+BUFFER = TrackingBuffer()
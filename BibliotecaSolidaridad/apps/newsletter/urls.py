@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import SubscribeNewsletterView, UnsubscribeByEmailView, UnsubscribeNewsletterView
+from .views import SubscribeNewsletterView, UnsubscribeByEmailView, UnsubscribeNewsletterView, track_click, track_open
 
 urlpatterns = [
     path('subscribe/', SubscribeNewsletterView.as_view(), name='subscribe_newsletter'),
     path('unsubscribe/<str:token>/', UnsubscribeNewsletterView.as_view(), name='unsubscribe_newsletter'),
     path('unsubscribe/', UnsubscribeByEmailView.as_view(), name='unsubscribe_by_email'),
+    path('t/o/<int:campaign_id>/<int:delivery_id>/<str:signature>.gif', track_open, name='track_open'),
+    path('t/c/<int:campaign_id>/<int:delivery_id>/', track_click, name='track_click'),
 ]
\ No newline at end of file
@@ -1,16 +1,21 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
 from django.views.decorators.http import require_POST
 from django.conf import settings
 from .forms import NewsletterSubscriptionForm
 from .models import NewsletterSubscriber
-from .services import NewsletterService
+from . import tracking
+from apps.jobs.services import JobService
 from django.utils import timezone
-from django.template.loader import render_to_string
 from django.views.generic import View
 from django.utils.decorators import method_decorator
 
+def queue_welcome_email(subscriber):
+    """Encola el email de bienvenida; el request no espera al servidor SMTP"""
+    if settings.EMAIL_HOST_USER:  # Solo si el email está configurado
+        JobService.enqueue('newsletter.welcome', subscriber_id=subscriber.pk)
+
 def subscribe_newsletter(request):
     if request.method == 'POST':
         form = NewsletterSubscriptionForm(request.POST)
@@ -18,26 +23,8 @@ def subscribe_newsletter(request):
             subscriber = form.save(commit=False)
             subscriber.save()
             
-            # Enviar email de bienvenida
-            if settings.EMAIL_HOST_USER:  # Solo si el email está configurado
-                try:
-                    subject = "¡Bienvenido a nuestro newsletter!"
-                    html_content = render_to_string('newsletter/welcome.html', {
-                        'site_url': settings.SITE_URL,
-                        'unsubscribe_url': NewsletterService.get_unsubscribe_url(subscriber.email),
-                        'current_year': timezone.now().year
-                    })
-                    text_content = "¡Bienvenido a nuestro newsletter!"
-                    
-                    NewsletterService.send_newsletter(
-                        subject=subject,
-                        html_content=html_content,
-                        text_content=text_content,
-                        recipient_list=[subscriber.email]
-                    )
-                except Exception as e:
-                    # No romper el flujo si falla el email
-                    print(f"Error enviando email de bienvenida: {e}")
+            # El email de bienvenida lo envía el worker (manage.py run_jobs)
+            queue_welcome_email(subscriber)
             
             messages.success(request, "¡Te has suscrito exitosamente a nuestro newsletter!")
             return redirect('home')
@@ -85,38 +72,14 @@ class SubscribeNewsletterView(View):
             subscriber = form.save(commit=False)
             subscriber.save()
             
-            # Enviar email de bienvenida
-            self._send_welcome_email(subscriber)
+            # El email de bienvenida lo envía el worker (manage.py run_jobs)
+            queue_welcome_email(subscriber)
             
             messages.success(request, "¡Te has suscrito exitosamente a nuestro newsletter!")
             return redirect('home')
         
         # Si el formulario no es válido, mostrar errores
         return render(request, 'newsletter/subscribe.html', {'form': form})
-    
-    def _send_welcome_email(self, subscriber):
-        """Método helper para enviar email de bienvenida"""
-        if not settings.EMAIL_HOST_USER:  # Verificar si el email está configurado
-            return
-            
-        try:
-            subject = "¡Bienvenido a nuestro newsletter!"
-            html_content = render_to_string('newsletter/welcome.html', {
-                'site_url': settings.SITE_URL,
-                'unsubscribe_url': NewsletterService.get_unsubscribe_url(subscriber.email),
-                'current_year': timezone.now().year
-            })
-            text_content = "¡Bienvenido a nuestro newsletter!"
-            
-            NewsletterService.send_newsletter(
-                subject=subject,
-                html_content=html_content,
-                text_content=text_content,
-                recipient_list=[subscriber.email]
-            )
-        except Exception as e:
-            # No romper el flujo si falla el email
-            print(f"Error enviando email de bienvenida: {e}")
 
 
 class UnsubscribeNewsletterView(View):
@@ -167,4 +130,30 @@ class UnsubscribeByEmailView(View):
         except NewsletterSubscriber.DoesNotExist:
             messages.error(request, "No encontramos una suscripción activa con ese email.")
         
-        return render(request, 'newsletter/unsubscribe.html')
\ No newline at end of file
+        return render(request, 'newsletter/unsubscribe.html')
+
+
+def track_open(request, campaign_id, delivery_id, signature):
+    """
+    Píxel de apertura. Sólo suma al buffer en memoria: la escritura a la base
+    la hace un flush agrupado cada tanto (ver tracking.TrackingBuffer).
+    Con una firma inválida se devuelve el píxel igual, sin contar la apertura.
+    """
+    if tracking.verify(signature, campaign_id, delivery_id):
+        tracking.BUFFER.record('open', campaign_id, delivery_id)
+        tracking.BUFFER.maybe_flush()
+    response = HttpResponse(tracking.PIXEL, content_type='image/gif')
+    response['Cache-Control'] = 'no-store, private'
+    return response
+
+
+def track_click(request, campaign_id, delivery_id):
+    """Cuenta el clic y redirige al link original, que viaja firmado para no ser un redirect abierto"""
+    url = request.GET.get('u', '')
+    if not url.startswith(('http://', 'https://')) or not tracking.verify(
+        request.GET.get('s', ''), campaign_id, delivery_id, url
+    ):
+        raise Http404
+    tracking.BUFFER.record('click', campaign_id, delivery_id)
+    tracking.BUFFER.maybe_flush()
+    return HttpResponseRedirect(url)
@@ -1,3 +1,145 @@
+import random
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from apps.books.models import Book, BookStock, Category, Review
+from apps.dashboard.notifications import NotificationService
+from apps.dashboard.querycheck import DuplicateQueryAssertionsMixin
+from apps.loans.models import Loan, LoanRequest
+from apps.users.models import User, UserProfile
 
-# Create your tests here.
+
+def openlibrary_response(*args, **kwargs):
+    response = mock.Mock()
+    response.json.return_value = {
+        'docs': [
+            {'title': f'Resultado {i}', 'author_name': ['Autor'], 'edition_key': [f'OL{i}M']}
+            for i in range(10)
+        ]
+    }
+    return response
+
+
+class PageQueryBudgetTests(DuplicateQueryAssertionsMixin, TestCase):
+    """
+    Cada página se renderiza con un presupuesto fijo de consultas. Se renderiza
+    dos veces, antes y después de agregar más filas, para que cualquier consulta
+    por fila (N+1) haga fallar el test. Además ninguna forma de consulta puede
+    repetirse dentro del mismo request.
+    """
+
+    # Incluye las dos consultas de sesión y usuario de cada request autenticado
+    BUDGETS = {
+        'home': 7,
+        'book_search': 2,
+        'book_detail': 9,
+        'profile': 6,
+        'user_loans': 4,
+        'manage_loans': 7,
+        # Sin resumen del scheduler: la lectura del resumen, el cálculo en el momento y las campañas
+        'dashboard': 10,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.rng = random.Random(29)
+        cls.librarian = User.objects.create_user('bibliotecaria', dni='L1', role='librarian')
+        cls.reader = User.objects.create_user('lectora', dni='R1')
+        cls.categories = Category.objects.bulk_create(
+            Category(name=f'Categoría {i}', created_by=cls.librarian) for i in range(12)
+        )
+        cls._grow(books=400, users=200, loans=3000)
+        cls.book = Book.objects.order_by('id').first()
+
+    @classmethod
+    def _grow(cls, books, users, loans):
+        """Agrega un volumen proporcional de filas en todas las tablas que muestran las páginas"""
+        rng = cls.rng
+        today = timezone.now().date()
+        offset = Book.objects.count()
+
+        new_books = Book.objects.bulk_create(
+            Book(
+                title=f'Libro {offset + i}',
+                authors=[f'Autor {rng.randint(1, 40)}'],
+            )
+            for i in range(books)
+        )
+        BookStock.objects.bulk_create(
+            BookStock(book=book, physical_id=f'BS-{book.pk:07d}-{n}', status='available')
+            for book in new_books
+            for n in range(rng.randint(0, 4))
+        )
+        Book.categories.through.objects.bulk_create(
+            Book.categories.through(book_id=book.id, category_id=category.id)
+            for book in new_books
+            for category in rng.sample(cls.categories, 3)
+        )
+
+        user_offset = User.objects.count()
+        new_users = User.objects.bulk_create(
+            User(username=f'socio{user_offset + i}', dni=f'{user_offset + i:08d}', score=rng.uniform(0, 5))
+            for i in range(users)
+        )
+        patrons = new_users + [cls.reader]
+        all_books = list(Book.objects.all())
+
+        Loan.objects.bulk_create(
+            Loan(
+                user=rng.choice(patrons),
+                book=rng.choice(all_books),
+                due_date=today + timedelta(days=rng.randint(-30, 15)),
+                status=rng.choice(['active', 'overdue', 'returned', 'returned']),
+            )
+            for _ in range(loans)
+        )
+        LoanRequest.objects.bulk_create(
+            (LoanRequest(user=rng.choice(patrons), book=rng.choice(all_books)) for _ in range(loans // 10)),
+            ignore_conflicts=True,
+        )
+        Review.objects.bulk_create(
+            [
+                Review(user=user, book=all_books[0], rating=rng.randint(1, 5), comment='Muy bueno')
+                for user in new_users
+            ],
+            ignore_conflicts=True,
+        )
+        UserProfile.objects.get(user=cls.reader).favorite_books.add(*rng.sample(all_books, 10))
+
+    def _assert_budget(self, name, user, url):
+        cache.clear()
+        if user:
+            self.client.force_login(user)
+            # El badge de notificaciones no consulta la base con el cache tibio
+            NotificationService.unread_count(user)
+        for attempt in ('inicial', 'con más filas'):
+            with self.subTest(page=name, dataset=attempt):
+                with mock.patch('apps.books.openlibrary.requests.get', side_effect=openlibrary_response):
+                    with self.assertNumQueries(self.BUDGETS[name]), self.assertNoDuplicateQueries():
+                        response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+            self._grow(books=100, users=50, loans=500)
+
+    def test_home(self):
+        self._assert_budget('home', None, reverse('home'))
+
+    def test_book_search(self):
+        self._assert_budget('book_search', None, reverse('book_search') + '?q=Libro')
+
+    def test_book_detail(self):
+        self._assert_budget('book_detail', self.reader, reverse('book_detail', args=[self.book.id]))
+
+    def test_profile(self):
+        self._assert_budget('profile', self.reader, reverse('profile'))
+
+    def test_user_loans(self):
+        self._assert_budget('user_loans', self.reader, reverse('user_loans'))
+
+    def test_manage_loans(self):
+        self._assert_budget('manage_loans', self.librarian, reverse('manage_loans'))
+
+    def test_dashboard(self):
+        self._assert_budget('dashboard', self.librarian, reverse('dashboard'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_userprofile_favorite_books'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='active_loans_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
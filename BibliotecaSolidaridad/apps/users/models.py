@@ -18,6 +18,8 @@ class User(AbstractUser):
     score = models.FloatField(default=5.0)
     is_active_member = models.BooleanField(default=True)
     suspension_end_date = models.DateField(null=True, blank=True)
+    # Préstamos en curso (activos o vencidos), mantenido por LoanService
+    active_loans_count = models.PositiveIntegerField(default=0)
     
     def get_loan_limit(self):
         """Calcula el límite de préstamos basado en el puntaje"""
@@ -30,6 +32,11 @@ class User(AbstractUser):
         else:
             return 0
 
+    @property
+    def loan_headroom(self):
+        """Préstamos que todavía puede tomar sin superar su límite"""
+        return max(0, self.get_loan_limit() - self.active_loans_count)
+
     class Meta:
         db_table = 'users'
         verbose_name = 'Usuario'
@@ -0,0 +1,85 @@
+// Novedades en vivo: server-sent events y, si no hay (WSGI, proxy que corta el
+// stream, navegador viejo), polling con GET condicional a /eventos/estado/.
+// Cada novedad se re-emite como el evento 'biblioteca:evento' del document para
+// que cada página decida qué hacer; acá sólo se actualiza el badge de notificaciones.
+(function () {
+    const script = document.currentScript;
+    const streamUrl = script.dataset.streamUrl;
+    const stateUrl = script.dataset.stateUrl;
+    const pollInterval = parseInt(script.dataset.pollInterval, 10) * 1000;
+    const EVENTS = ['notification', 'notifications_read', 'loan_request', 'loan_approved',
+                    'loan_rejected', 'loan_returned', 'hold_ready', 'resync'];
+
+    function badge() {
+        let element = document.getElementById('notification-badge');
+        if (!element) {
+            element = document.createElement('span');
+            element.id = 'notification-badge';
+            element.className = 'badge rounded-pill bg-danger';
+            document.getElementById('notification-link').appendChild(element);
+        }
+        return element;
+    }
+
+    function setUnread(count) {
+        const element = badge();
+        element.textContent = count;
+        element.hidden = count <= 0;
+    }
+
+    function emit(type, data) {
+        document.dispatchEvent(new CustomEvent('biblioteca:evento', {detail: {type: type, data: data}}));
+    }
+
+    function handle(type, data) {
+        if (type === 'notification') {
+            setUnread((parseInt(badge().textContent, 10) || 0) + data.count);
+        } else if (type === 'notifications_read') {
+            setUnread(data.all ? 0 : (parseInt(badge().textContent, 10) || 0) - data.count);
+        }
+        emit(type, data);
+    }
+
+    function poll() {
+        let etag = null;
+        function check() {
+            const headers = etag ? {'If-None-Match': etag} : {};
+            fetch(stateUrl, {headers: headers, credentials: 'same-origin', cache: 'no-store'})
+                .then(function (response) {
+                    if (response.status !== 200) {
+                        return null;
+                    }
+                    const first = etag === null;
+                    etag = response.headers.get('ETag');
+                    return response.json().then(function (state) {
+                        setUnread(state.unread_notifications);
+                        if (!first) {
+                            emit('changed', state);
+                        }
+                    });
+                })
+                .catch(function () {})
+                .finally(function () {
+                    setTimeout(check, pollInterval);
+                });
+        }
+        check();
+    }
+
+    if (!window.EventSource) {
+        poll();
+        return;
+    }
+    const source = new EventSource(streamUrl);
+    EVENTS.forEach(function (type) {
+        source.addEventListener(type, function (event) {
+            handle(type, JSON.parse(event.data));
+        });
+    });
+    source.onerror = function () {
+        // CLOSED: el servidor respondió 204 o un error, el navegador no reintenta
+        if (source.readyState === EventSource.CLOSED) {
+            poll();
+        }
+    };
+})();